@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, struct, json, zlib, threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+import numpy as np
+
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
+import pinn
+import dose
+
+# ----------------------------------------- #
+"""
+Chunked compressed archive format for CT images and beam dose files.
+
+A volume is stored as blocks of Z planes, each compressed on its own with zlib or lzma, after a
+header and an index of block offsets so that any slice can be read by decompressing only the
+blocks it covers. The block bytes are the original file bytes, so the byte order of the .img
+and plan.Trial.binary.NNN files is kept and recorded in the header.
+
+File layout :
+	8 bytes		magic 'PINNVZ01'
+	4 bytes		little endian length of the JSON header
+	JSON header	shape, dtype, slabSize, codec and any metadata
+	index		little endian uint64 (offset, length) of each compressed block
+	blocks
+
+Archives are named after the file they replace with ARCHIVE_EXT appended. dose.readCT and
+dose.readBeamDose open an archive when the original file is not present.
+
+	archive.compressPlan('/data/Patient_1/Plan_0', removeOriginal=True)
+	ctData, ctHdr = dose.readCT('/data/Patient_1/Plan_0/plan.Trial', zRange=(40, 60))
+"""
+
+ARCHIVE_EXT = '.pvz'
+ARCHIVE_MAGIC = b'PINNVZ01'
+
+# ----------------------------------------- #
+
+def compressFile(srcFile, dstFile, shape, dtype, slabSize=8, codec='zlib', level=6, meta=None, nThreads=None):
+	"""
+	Convert a raw volume file to a chunked archive.
+	Arguments:
+		srcFile		Raw file holding a (Z, Y, X) volume
+		dstFile		Archive file to write
+		shape		Shape (Z, Y, X) of the volume
+		dtype		Data type of the raw file including its byte order, e.g. '>i2'
+		slabSize	Number of Z planes in each compressed block
+		codec		'zlib' or 'lzma'
+		level		Compression level
+		meta		Dictionary of metadata stored in the header
+		nThreads	Number of threads compressing blocks (default is the number of cpus)
+	"""
+	dtype = np.dtype(dtype)
+	planeBytes = shape[1] * shape[2] * dtype.itemsize
+	nSlabs = (shape[0] + slabSize - 1) // slabSize
+
+	if os.path.getsize(srcFile) != shape[0] * planeBytes:
+		raise ArchiveException("File %s does not match the volume shape %s" % (srcFile, str(shape)))
+
+	header = {'shape':list(shape), 'dtype':dtype.str, 'slabSize':slabSize, 'codec':codec, 'meta':meta or {}}
+	hdrBytes = json.dumps(header).encode('utf-8')
+
+	src = open(srcFile, 'rb')
+	readLock = threading.Lock()
+
+	def compressSlab(sInd):
+		with readLock:
+			src.seek(sInd * slabSize * planeBytes)
+			raw = src.read(slabSize * planeBytes)
+		return compressBytes(raw, codec, level)
+
+	if nThreads is None:
+		nThreads = multiprocessing.cpu_count()
+
+	dst = open(dstFile, 'wb')
+	dst.write(ARCHIVE_MAGIC)
+	dst.write(struct.pack('<I', len(hdrBytes)))
+	dst.write(hdrBytes)
+	indexPos = dst.tell()
+	dst.write(b'\0' * 16 * nSlabs)
+
+	# Compress a batch of blocks in parallel then write them in order, so only a batch is in memory
+	index = []
+	pool = ThreadPool(max(nThreads, 1))
+	try:
+		batch = max(nThreads, 1) * 2
+		for s0 in range(0, nSlabs, batch):
+			for block in pool.map(compressSlab, range(s0, min(s0 + batch, nSlabs))):
+				index.append( (dst.tell(), len(block)) )
+				dst.write(block)
+	finally:
+		pool.close()
+		pool.join()
+		src.close()
+
+	dst.seek(indexPos)
+	dst.write(np.array(index, dtype='<u8').tobytes())
+	dst.close()
+
+# ----------------------------------------- #
+
+def compressPlan(planDir, slabSize=8, codec='zlib', level=6, removeOriginal=False, nThreads=None):
+	"""
+	Convert the CT image and all the beam dose files of a plan to chunked archives.
+	Returns the list of archives written.
+	"""
+	planTrialFile = os.path.join(planDir, 'plan.Trial')
+	written = []
+
+	# CT image, the header stays as it is
+	fp1 = open(os.path.join(planDir, 'plan.defaults'))
+	imFile = os.path.join(planDir, fp1.readline().split(':')[1].strip())
+	fp1.close()
+
+	if os.path.exists(imFile + '.img'):
+		imHdr = pinn.read(imFile + '.header')
+		imType = '>i2' if imHdr.byte_order == 1 else '<i2'
+		compressFile(imFile + '.img', imFile + '.img' + ARCHIVE_EXT, (imHdr.z_dim, imHdr.y_dim, imHdr.x_dim), \
+					imType, slabSize, codec, level, nThreads=nThreads)
+		written.append(imFile + '.img')
+
+	# Beam doses, the shape of each comes from the dose grid of its trial
+	pln1 = pinn.read(planTrialFile)
+	if pln1.has_key('TrialList'):
+		trials = [ tr for tr in pln1.TrialList ]
+	else:
+		trials = [ pln1.Trial ]
+
+	for curTr in trials:
+		doseHdr = curTr.DoseGrid
+		shape = (doseHdr.Dimension.Z, doseHdr.Dimension.Y, doseHdr.Dimension.X)
+		for bm in curTr.BeamList:
+			doseFile = dose.beamDoseFile(planTrialFile, bm)
+			if doseFile in written or not os.path.exists(doseFile) or os.path.getsize(doseFile) == 0:
+				continue
+			compressFile(doseFile, doseFile + ARCHIVE_EXT, shape, '>f4', slabSize, codec, level, nThreads=nThreads)
+			written.append(doseFile)
+
+	if removeOriginal:
+		for fileName in written:
+			os.remove(fileName)
+
+	return [ fileName + ARCHIVE_EXT for fileName in written ]
+
+# ----------------------------------------- #
+
+def compressBytes(raw, codec, level=6):
+	"""
+	Compress a block of bytes with the given codec.
+	"""
+	if codec == 'zlib':
+		return zlib.compress(raw, level)
+	elif codec == 'lzma':
+		if lzma is None:
+			raise ArchiveException("lzma compression is not available, install backports.lzma")
+		return lzma.compress(raw, preset=level)
+	raise ArchiveException("Unrecognized codec : %s" % codec)
+
+# ----------------------------------------- #
+
+def decompressBytes(block, codec):
+	"""
+	Decompress a block of bytes with the given codec.
+	"""
+	if codec == 'zlib':
+		return zlib.decompress(block)
+	elif codec == 'lzma':
+		if lzma is None:
+			raise ArchiveException("lzma compression is not available, install backports.lzma")
+		return lzma.decompress(block)
+	raise ArchiveException("Unrecognized codec : %s" % codec)
+
+# ----------------------------------------- #
+
+def archiveFile(fileName):
+	"""
+	Return the name of the archive replacing a file, or None if there is no archive.
+	"""
+	if os.path.exists(fileName + ARCHIVE_EXT):
+		return fileName + ARCHIVE_EXT
+	return None
+
+# ----------------------------------------- #
+
+class chunkedVolume():
+	"""
+	Read only (Z, Y, X) volume stored in a chunked archive. Indexing it decompresses only the blocks
+	covering the requested planes, on a thread pool when there are several, and returns a numpy array.
+	The most recently used blocks are kept so scrolling through neighbouring slices is cheap.
+	"""
+	def __init__(self, fileName, nThreads=None, cacheSlabs=4):
+		self._fileName = fileName
+		self._lock = threading.Lock()
+
+		f = open(fileName, 'rb')
+		try:
+			if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+				raise ArchiveException("%s is not a volume archive" % fileName)
+			hdrLen = struct.unpack('<I', f.read(4))[0]
+			header = json.loads(f.read(hdrLen).decode('utf-8'))
+
+			self.shape = tuple(header['shape'])
+			self.ndim = 3
+			self.dtype = np.dtype(str(header['dtype']))
+			self.meta = header['meta']
+			self._slabSize = header['slabSize']
+			self._codec = header['codec']
+
+			nSlabs = (self.shape[0] + self._slabSize - 1) // self._slabSize
+			self._index = np.frombuffer(f.read(16 * nSlabs), dtype='<u8').reshape((nSlabs, 2))
+		except:
+			f.close()
+			raise
+		self._file = f
+
+		self._nThreads = nThreads
+		if self._nThreads is None:
+			self._nThreads = multiprocessing.cpu_count()
+		self._cacheSlabs = cacheSlabs
+		self._slabCache = OrderedDict()
+
+	# ------------------------------------------- #
+
+	def __len__(self):
+		return self.shape[0]
+
+	# ------------------------------------------- #
+
+	def slab(self, sInd):
+		"""
+		Return a block of planes as a numpy array, decompressing it if it isn't cached.
+		"""
+		with self._lock:
+			if sInd in self._slabCache:
+				data = self._slabCache.pop(sInd)
+				self._slabCache[sInd] = data
+				return data
+			offset, length = self._index[sInd]
+			self._file.seek(int(offset))
+			block = self._file.read(int(length))
+
+		z0 = sInd * self._slabSize
+		nz = min(z0 + self._slabSize, self.shape[0]) - z0
+		data = np.frombuffer(decompressBytes(block, self._codec), dtype=self.dtype)
+		data = data.reshape((nz, self.shape[1], self.shape[2]))
+
+		with self._lock:
+			self._slabCache[sInd] = data
+			while len(self._slabCache) > self._cacheSlabs:
+				self._slabCache.popitem(last=False)
+
+		return data
+
+	# ------------------------------------------- #
+
+	def planes(self, z0, z1):
+		"""
+		Return planes z0 to z1-1 as a numpy array.
+		"""
+		slabInds = range(z0 // self._slabSize, (max(z1, z0+1) - 1) // self._slabSize + 1)
+		if len(slabInds) > 1 and self._nThreads > 1:
+			pool = ThreadPool(min(self._nThreads, len(slabInds)))
+			try:
+				slabs = pool.map(self.slab, slabInds)
+			finally:
+				pool.close()
+				pool.join()
+		else:
+			slabs = [ self.slab(sInd) for sInd in slabInds ]
+
+		data = np.concatenate(slabs) if len(slabs) > 1 else slabs[0]
+		zStart = slabInds[0] * self._slabSize
+		return data[z0-zStart:z1-zStart]
+
+	# ------------------------------------------- #
+
+	def __getitem__(self, key):
+		"""
+		Index the volume as a numpy array, only the planes needed along Z are decompressed.
+		"""
+		if not isinstance(key, tuple):
+			key = (key,)
+		if len(key) == 0 or key[0] is Ellipsis:
+			return self.planes(0, self.shape[0])[key]
+
+		zKey = key[0]
+		if isinstance(zKey, slice):
+			start, stop, step = zKey.indices(self.shape[0])
+			zInds = np.arange(start, stop, step)
+		else:
+			zInds = np.asarray(zKey)
+			if zInds.dtype == bool:
+				zInds = np.flatnonzero(zInds)
+			zInds = np.where(zInds < 0, zInds + self.shape[0], zInds)
+
+		if zInds.size == 0:
+			return np.empty((0, self.shape[1], self.shape[2]), dtype=self.dtype)[(slice(None),) + key[1:]]
+
+		z0 = int(zInds.min())
+		data = self.planes(z0, int(zInds.max()) + 1)
+
+		if isinstance(zKey, slice):
+			zKey = slice(start - z0, stop - z0 if stop - z0 >= 0 else None, step)
+		else:
+			zKey = zInds - z0
+
+		return data[(zKey,) + key[1:]]
+
+	# ------------------------------------------- #
+
+	def __array__(self, dtype=None):
+		data = self.planes(0, self.shape[0])
+		if dtype is not None:
+			return data.astype(dtype)
+		return data
+
+	# ------------------------------------------- #
+
+	def close(self):
+		"""
+		Close the archive file.
+		"""
+		self._file.close()
+
+	# ------------------------------------------- #
+
+	def __enter__(self):
+		return self
+
+	# ------------------------------------------- #
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+
+# ----------------------------------------- #
+
+class ArchiveException(Exception):
+	pass
@@ -8,11 +8,15 @@ from matplotlib import cm, pylab
 from matplotlib.colors import LinearSegmentedColormap, colorConverter
 
 import pinn
+import pinnObjDict
 import imView
+import archive
+import xdrReference
 
 # ----------------------------------------- #
 
-def readDose(planTrialFile, trNum, chooseBmInd=-1):
+def readDose(planTrialFile, trNum, chooseBmInd=-1, cache=None, beamWeights=None, \
+				prescriptionDose=None, numberOfFractions=None):
 	"""
 	Read a dose cube for a trial in a given plan and return as a numpy array
 
@@ -22,10 +26,35 @@ def readDose(planTrialFile, trNum, chooseBmInd=-1):
 		Dose is prescribed to a norm point, 
 			beam weights are proportional to point dose 
 			and control point dose is not stored.
+
+	Arguments:
+		chooseBmInd			Index, or list of indices, of the beams to sum (default -1 is all beams)
+		cache				A doseCache.beamDoseCache holding the parsed plan files and unnormalised
+								beam doses. Beam binaries are then only read the first time they are
+								needed, so re-weighting and beam subsets are cheap to recalculate.
+		beamWeights			Dictionary of beam index to weight (%) replacing the beam weights in the plan
+		prescriptionDose	Dose per fraction replacing the prescription dose of every prescription
+		numberOfFractions	Number of fractions replacing that of every prescription
 	"""
+	bmInds, bmDoses, bmFactors, doseHdr = trialBeamDoses(planTrialFile, trNum, chooseBmInd, cache, \
+											beamWeights, prescriptionDose, numberOfFractions)
 
-	pln1 = pinn.read(os.path.join( os.path.dirname(planTrialFile),'plan.Trial'))
-	pts = pinn.read(os.path.join( os.path.dirname(planTrialFile),'plan.Points'))
+	dose = sumBeamDoses(bmDoses, bmFactors, \
+				(doseHdr.Dimension.Z, doseHdr.Dimension.Y, doseHdr.Dimension.X))
+		
+	return dose, doseHdr
+
+# ----------------------------------------- #
+
+def trialBeamDoses(planTrialFile, trNum, chooseBmInd=-1, cache=None, beamWeights=None, \
+				prescriptionDose=None, numberOfFractions=None):
+	"""
+	Return the unnormalised dose cubes of the beams in a trial and the factors they are 
+	multiplied by in the trial dose, without summing them. Arguments are as for readDose.
+	Without a cache the beam doses are read only memory mapped files.
+	Returns the beam indices, beam doses, beam dose factors and the DoseGrid.
+	"""
+	pln1, pts = readPlanFiles(planTrialFile, cache)
 	
 	nTrials = 1
 	if pln1.has_key('TrialList'):
@@ -41,68 +70,194 @@ def readDose(planTrialFile, trNum, chooseBmInd=-1):
 	
 	doseHdr = curTr.DoseGrid
 	
-	dose = np.zeros((doseHdr.Dimension.Z, doseHdr.Dimension.Y, doseHdr.Dimension.X))
-
-	prescriptionPoint = []
-	prescriptionDose = []
-	prescriptionPointDose = []
-	prescriptionPointDoseFactor = []
+	bmInds = []
+	bmDoses = []
+	bmFactors = []
 			
 	for bInd, bm in enumerate(curTr.BeamList):
-		if chooseBmInd >= 0 and bInd != chooseBmInd: 
+		if not beamChosen(bInd, chooseBmInd): 
 			continue
 		try:		
 			# Get the name of the file where the beam dose is saved - PREVIOUSLY USED DoseVarVolume ? 		
-			doseFile = os.path.join( os.path.dirname(planTrialFile), \
-					"plan.Trial.binary.%03d" % int(bm.DoseVolume.split('-')[1]))
+			doseFile = beamDoseFile(planTrialFile, bm)
 
-			# Read the dose from the file
-			bmDose = np.fromfile(doseFile,dtype='float32')
-		
-			if bmDose.nbytes == 0:
-				raise DoseInvalidException('')
+			# Map or fetch the dose from the file, it is only read when summed below
+			if cache is None:
+				bmDose = readBeamDose(doseFile, doseHdr, mmap=True)
+			else:
+				bmDose = cache.beamDose(doseFile, doseHdr)
 		except:
 			raise DoseInvalidException('Beam %d in trial %d has no stored dose. Try other trial [0-%d]' \
 					% (bInd, trNum, nTrials-1))
 		
-		# Reshape to a 3D array		
-		bmDose = bmDose.reshape(( doseHdr.Dimension.Z, doseHdr.Dimension.Y, doseHdr.Dimension.X ))
-		
-		# Solaris uses big endian schema. Almost everything else is little endian		
-		if sys.byteorder == 'little':
-			bmDose = bmDose.byteswap(True)
+		bmWeight = bm.Weight
+		if beamWeights is not None and bInd in beamWeights:
+			bmWeight = beamWeights[bInd]
 		
 		doseFactor = 1.0
 		
 		# Weight the dose cube by the beam weight
 		# Assume dose is prescribed to a norm point and beam weights are proportional to point dose
-		doseAtPoint = 0.0
-		
 		for pp in curTr.PrescriptionList:
-			if pp.Name == bm.PrescriptionName:
-				prescriptionDose.append(pp.PrescriptionDose * pp.NumberOfFractions)
-				if pp.WeightsProportionalTo == 'Point Dose':
-					for pt in pts.PoiList:
-						if pt.Name == pp.PrescriptionPoint:
+			if pp.Name == bm.PrescriptionName and pp.WeightsProportionalTo == 'Point Dose':
+				ppDose = pp.PrescriptionDose if prescriptionDose is None else prescriptionDose
+				ppFractions = pp.NumberOfFractions if numberOfFractions is None else numberOfFractions
+				
+				for pt in pts.PoiList:
+					if pt.Name == pp.PrescriptionPoint:
+						if cache is None:
 							doseAtPoint = doseAtCoord(bmDose, doseHdr, pt.XCoord, pt.YCoord, pt.ZCoord)
-							doseFactor = pp.PrescriptionDose * pp.NumberOfFractions * ( bm.Weight * 0.01 / doseAtPoint )
-							
-							prescriptionPoint.append([pt.XCoord, pt.YCoord, pt.ZCoord])
-							prescriptionPointDose.append(doseAtPoint)
-							prescriptionPointDoseFactor.append(doseFactor)
+						else:
+							doseAtPoint = cache.pointDose(doseFile, doseHdr, pt.XCoord, pt.YCoord, pt.ZCoord)
+						doseFactor = ppDose * ppFractions * ( bmWeight * 0.01 / doseAtPoint )
 		
-		dose += ( bmDose * doseFactor )
+		bmInds.append(bInd)
+		bmDoses.append(bmDose)
+		bmFactors.append(doseFactor)
+
+	return bmInds, bmDoses, bmFactors, doseHdr
+
+# ----------------------------------------- #
+
+def readPlanFiles(planTrialFile, cache=None):
+	"""
+	Read the plan.Trial and plan.Points files of a plan, from the cache if one is given.
+	"""
+	if cache is None:
+		pln1 = pinn.read(os.path.join( os.path.dirname(planTrialFile),'plan.Trial'))
+		pts = pinn.read(os.path.join( os.path.dirname(planTrialFile),'plan.Points'))
+	else:
+		pln1 = cache.readPlan(os.path.join( os.path.dirname(planTrialFile),'plan.Trial'))
+		pts = cache.readPlan(os.path.join( os.path.dirname(planTrialFile),'plan.Points'))
+	
+	return pln1, pts
+
+# ----------------------------------------- #
+
+def numTrials(planTrialFile, cache=None):
+	"""
+	Return the number of trials in a plan.
+	"""
+	pln1, pts = readPlanFiles(planTrialFile, cache)
+	if pln1.has_key('TrialList'):
+		return len(pln1.TrialList)
+	return 1
+
+# ----------------------------------------- #
+
+def beamChosen(bInd, chooseBmInd):
+	"""
+	Check if a beam index is selected by chooseBmInd, which is either a single index 
+	(negative to select all beams) or a list of indices.
+	"""
+	if hasattr(chooseBmInd, '__iter__'):
+		return bInd in chooseBmInd
+	return chooseBmInd < 0 or bInd == chooseBmInd
+
+# ----------------------------------------- #
+
+def beamDoseFile(planTrialFile, bm):
+	"""
+	Return the name of the binary file holding the dose of a beam.
+	"""
+	return os.path.join( os.path.dirname(planTrialFile), \
+			"plan.Trial.binary.%03d" % xdrReference.xdrIndex(bm.DoseVolume))
 
-	for bm, pD, pp in zip(range(len(prescriptionPointDose)), prescriptionPointDose, prescriptionPoint):
-		indPP = coordToIndex(doseHdr, pp[0], pp[1], pp[2])
+# ----------------------------------------- #
+
+def readBeamDose(doseFile, doseHdr, mmap=False):
+	"""
+	Read the unnormalised dose of a single beam and return it as a (Z, Y, X) float32 array.
+	The file is stored big endian (Solaris), with mmap the file is memory mapped read only
+	as a big endian array, otherwise it is read and converted to the native byte order.
+	If the file has been replaced by a chunked archive (see archive.py) then with mmap the
+	archive volume is returned, which decompresses only the planes that are sliced.
+	"""
+	shape = ( doseHdr.Dimension.Z, doseHdr.Dimension.Y, doseHdr.Dimension.X )
+
+	if not os.path.exists(doseFile) and archive.archiveFile(doseFile) is not None:
+		bmDose = archive.chunkedVolume(archive.archiveFile(doseFile))
+		if bmDose.shape != shape:
+			bmDose.close()
+			raise DoseInvalidException('Dose archive %s does not match the dose grid' % doseFile)
+		if mmap:
+			return bmDose
+		with bmDose:
+			return bmDose[:].astype('float32')
+
+	if os.path.getsize(doseFile) != 4 * shape[0] * shape[1] * shape[2]:
+		raise DoseInvalidException('Dose file %s does not match the dose grid' % doseFile)
+	
+	if mmap:
+		return np.memmap(doseFile, dtype='>f4', mode='r', shape=shape)
+	
+	return np.fromfile(doseFile, dtype='>f4').reshape(shape).astype('float32')
+
+# ----------------------------------------- #
+
+def sumBeamDoses(bmDoses, bmFactors, shape, slabSize=16):
+	"""
+	Sum a list of beam dose cubes each multiplied by a factor.
+	The sum is formed slab by slab along Z with all beams accumulated into a slab while it is in
+	cache, so only one pass is made over the output and temporaries are limited to a slab.
+	"""
+	dose = np.zeros(shape)
+	
+	for z0 in range(0, shape[0], slabSize):
+		slab = dose[z0:z0+slabSize]
+		for bmDose, doseFactor in zip(bmDoses, bmFactors):
+			slab += np.multiply(bmDose[z0:z0+slabSize], doseFactor, dtype='float64')
+	
+	return dose
+
+# ----------------------------------------- #
+
+class beamDoseSum():
+	"""
+	Weighted sum of beam dose cubes evaluated only for the part of the volume that is indexed,
+	so a trial dose can be resampled or reduced slab by slab without forming the whole cube.
+		trDose = beamDoseSum(bmDoses, bmFactors)
+		slab = trDose[10:20]
+	"""
+	def __init__(self, bmDoses, bmFactors, shape=None):
+		self._bmDoses = bmDoses
+		self._bmFactors = bmFactors
+		if shape is None:
+			shape = bmDoses[0].shape
+		self.shape = tuple(shape)
+		self.ndim = len(self.shape)
+		self.dtype = np.dtype('float64')
+
+	# ------------------------------------------- #
+
+	def __getitem__(self, key):
+		"""
+		Return the summed dose of the indexed part of the volume.
+		"""
+		if len(self._bmDoses) == 0:
+			return np.zeros(self.shape)[key]
 		
-	return dose, doseHdr
+		# Products are formed in float64, a float32 cube times a scalar would otherwise stay float32
+		dose = np.multiply(self._bmDoses[0][key], self._bmFactors[0], dtype='float64')
+		for bmDose, doseFactor in zip(self._bmDoses[1:], self._bmFactors[1:]):
+			dose += np.multiply(bmDose[key], doseFactor, dtype='float64')
+		
+		return dose
 
 # ----------------------------------------- #
 
-def readCT(planTrialFile):
+def readCT(planTrialFile, mmap=False, zRange=None, bounds=None):
 	"""
 	Read a CT cube for a plan
+	Arguments:
+		mmap	Memory map the image file read only rather than reading it. The array keeps the byte order
+					given by byte_order in the header so no data is read until slices are accessed.
+					For an image stored as a chunked archive (see archive.py) the archive volume is
+					returned, or only the blocks covering a sub-volume are decompressed.
+		zRange	(first, last+1) slice indices, only this range of slices is returned.
+		bounds	((xMin,xMax), (yMin,yMax), (zMin,zMax)) in cm, only the sub-volume covering this box
+					is returned, e.g. the bounding box of a roi. Any axis can be None to keep all of it.
+	When a sub-volume is returned the header is a copy with its dimensions and start positions updated.
 	"""	
 	fp1 = open(os.path.join( os.path.dirname(planTrialFile),'plan.defaults'))
 	imFile = fp1.readline().split(':')[1].strip()
@@ -111,29 +266,101 @@ def readCT(planTrialFile):
 	imFile = os.path.join( os.path.dirname(planTrialFile),imFile)
 	imHdr = pinn.read(imFile+'.header')
 
-	# Read the data from the file
-	imData = np.fromfile(imFile+'.img',dtype='int16')
-
-	# Reshape to a 3D array
-	imData = imData.reshape((imHdr.z_dim,imHdr.y_dim,imHdr.x_dim))
+	shape = (imHdr.z_dim, imHdr.y_dim, imHdr.x_dim)
 
 	# Solaris uses big endian schema. Almost everything else is little endian		
-	if sys.byteorder == 'little':
-		if imHdr.byte_order == 1:
-			imData = imData.byteswap(True)
+	if imHdr.byte_order == 1:
+		fileType = np.dtype('>i2')
+	else:
+		fileType = np.dtype('<i2')
+
+	box = ctSubVolume(imHdr, zRange, bounds)
+	(z0, z1), (y0, y1), (x0, x1) = box
+
+	if not os.path.exists(imFile+'.img') and archive.archiveFile(imFile+'.img') is not None:
+		imData = archive.chunkedVolume(archive.archiveFile(imFile+'.img'))
+		if imData.shape != shape:
+			imData.close()
+			raise DoseInvalidException('Image archive %s does not match the header' % imFile)
+		if not mmap:
+			with imData:
+				imData = imData[z0:z1, y0:y1, x0:x1].astype('int16')
+		elif box != [[0, shape[0]], [0, shape[1]], [0, shape[2]]]:
+			imData = imData[z0:z1, y0:y1, x0:x1]
+	elif mmap:
+		imData = np.memmap(imFile+'.img', dtype=fileType, mode='r', shape=shape)[z0:z1, y0:y1, x0:x1]
 	else:
-		if imHdr.byte_order == 0:
-			imData = imData.byteswap(True)
+		# Read only the slices that are needed and convert to the native byte order
+		fp1 = open(imFile+'.img', 'rb')
+		fp1.seek(z0 * shape[1] * shape[2] * fileType.itemsize)
+		imData = np.fromfile(fp1, dtype=fileType, count=(z1-z0) * shape[1] * shape[2])
+		fp1.close()
+
+		imData = imData.reshape((z1-z0, shape[1], shape[2]))[:, y0:y1, x0:x1].astype('int16')
+
+	if box != [[0, shape[0]], [0, shape[1]], [0, shape[2]]]:
+		imHdr = ctSubVolumeHeader(imHdr, box)
 		 	
 	return imData, imHdr
 
 # ----------------------------------------- #
 
+def ctSubVolume(ctHdr, zRange=None, bounds=None):
+	"""
+	Return the [[z0,z1], [y0,y1], [x0,x1]] index ranges of a CT sub-volume given by 
+	a slice range and / or a bounding box in cm (see readCT).
+	"""
+	shape = (ctHdr.z_dim, ctHdr.y_dim, ctHdr.x_dim)
+	box = [[0, shape[0]], [0, shape[1]], [0, shape[2]]]
+	
+	if zRange is not None:
+		box[0] = [ max(int(zRange[0]), 0), min(int(zRange[1]), shape[0]) ]
+	
+	if bounds is not None:
+		axes = ctGridAxes(ctHdr)
+		voxSize = (ctHdr.z_pixdim, ctHdr.y_pixdim, ctHdr.x_pixdim)
+		for ax, bnd in zip((2,1,0), bounds):
+			if bnd is None:
+				continue
+			# Keep one voxel either side of the box so that it can be interpolated anywhere inside
+			inside = np.where( (axes[ax] >= min(bnd) - voxSize[ax]) & \
+								(axes[ax] <= max(bnd) + voxSize[ax]) )[0]
+			if inside.size == 0:
+				box[ax] = [0, 0]
+			else:
+				box[ax] = [ max(box[ax][0], inside.min()), min(box[ax][1], inside.max()+1) ]
+	
+	for ax in range(3):
+		box[ax][1] = max(box[ax][0], box[ax][1])
+	
+	return box
+
+# ----------------------------------------- #
+
+def ctSubVolumeHeader(ctHdr, box):
+	"""
+	Return a copy of a CT header describing the sub-volume given by index ranges [[z0,z1], [y0,y1], [x0,x1]].
+	"""
+	(z0, z1), (y0, y1), (x0, x1) = box
+	
+	subHdr = pinnObjDict.pinnObjDict(dict(ctHdr), ctHdr._filename)
+	subHdr['z_dim'] = z1 - z0
+	subHdr['y_dim'] = y1 - y0
+	subHdr['x_dim'] = x1 - x0
+	subHdr['z_start'] = ctHdr.z_start + z0 * ctHdr.z_pixdim
+	# Rows run from the top of the image down (see coordToIndex)
+	subHdr['y_start'] = ctHdr.y_start + (ctHdr.y_dim - y1) * ctHdr.y_pixdim
+	subHdr['x_start'] = ctHdr.x_start + x0 * ctHdr.x_pixdim
+	
+	return subHdr
+
+# ----------------------------------------- #
+
 def plotCT(planTrialFile):
 	"""
 	Display the CT in a 3 plane image view gui
 	"""
-	ctData, ctHdr = readCT(planTrialFile)
+	ctData, ctHdr = readCT(planTrialFile, mmap=True)
 	
 	ctVoxSize = [ctHdr.z_pixdim,ctHdr.y_pixdim,ctHdr.x_pixdim]
 	
@@ -210,29 +437,62 @@ def plotDoseProfile(planTrialFile, trNum=0, dir='A', indX=-1, indY=-1, indZ=-1,
 
 # ----------------------------------------- #
 
-def plotDoseOnCT(planTrialFile, trNum=0):
+def plotDoseOnCT(planTrialFile, trNum=0, isodoseLevels=None):
+	"""
+	Display the dose distribution overlaid on the CT in a 3 plane view gui.
+	Neither volume is read when the gui opens, the CT is memory mapped and the trial dose is summed
+	from the memory mapped beam doses only for the slices displayed.
+	isodoseLevels is a list of doses, in the units of the trial dose, drawn as isodose lines.
+	"""
+	f1 = imView.slicesView( isodoseLevels=isodoseLevels, **doseOnCTImages(planTrialFile, trNum) )
+
+# ----------------------------------------- #
+
+def doseOnCTImages(planTrialFile, trNum=0):
 	"""
-	Display the dose distribution overlaid on the CT in a 3 plane view gui
+	Return the CT and the dose of a trial, their geometry and colour maps as the im1_ and im2_
+	keyword arguments of imView.slicesView, as shown by plotDoseOnCT and render.renderTrial.
+	The CT is memory mapped and the dose is a volumeProvider of the beam dose sum. The rois of
+	plan.roi, when there is one, are added as the rois argument.
 	"""
-	ctData, ctHdr = readCT(planTrialFile)
-	ctStartP = [ ctHdr.z_start, ctHdr.y_start, ctHdr.x_start ]
+	bmInds, bmDoses, bmFactors, doseHdr = trialBeamDoses(planTrialFile, trNum)
+	doseData = imView.volumeProvider( beamDoseSum(bmDoses, bmFactors, \
+					(doseHdr.Dimension.Z, doseHdr.Dimension.Y, doseHdr.Dimension.X)) )
+	doseAxes = doseGridAxes(doseHdr)
+	
+	# The viewer places index i at startP + i * voxSize. Rows run from the top of the grid down
+	# (see coordToIndex) so the Y start is given as minus the y of the first row, for both images,
+	# which keeps the dose aligned with the CT when it is resampled onto the CT pixels.
+	doseStartP = [ doseAxes[0][0], -doseAxes[1][0], doseAxes[2][0] ]
+	doseVoxSize = [ doseHdr.VoxelSize.Z, doseHdr.VoxelSize.Y, doseHdr.VoxelSize.X ]
+	
+	# Only map the CT slices covered by the dose grid
+	ctData, ctHdr = readCT(planTrialFile, mmap=True, \
+							bounds=(None, None, (doseAxes[0][0], doseAxes[0][-1])))
+	ctAxes = ctGridAxes(ctHdr)
+	ctStartP = [ ctAxes[0][0], -ctAxes[1][0], ctAxes[2][0] ]
 	ctVoxSize = [ ctHdr.z_pixdim,ctHdr.y_pixdim,ctHdr.x_pixdim ]
 	cmapCT = cm.bone
 	cmapCT.set_gamma(1.0)
 	
-	doseData, doseHdr = readDose(planTrialFile, trNum)
-	doseStartP = [ doseHdr.Origin.Z, doseHdr.Origin.Y, doseHdr.Origin.X ]
-	doseVoxSize = [ doseHdr.VoxelSize.Z, doseHdr.VoxelSize.Y, doseHdr.VoxelSize.X ]
-	
 	cmapDose = cm.jet	# Use jet colormap to paint dose
 	cmapDose.set_gamma(3.0)	# Bias spread of colors to higher doses
 
 	# Make dose transparent with lower does more transparent.
 	cmapDose._lut[:-3,-1] = np.linspace(0.0, 0.8, cmapDose.N)
-					
-	f1 = imView.slicesView(
-			im1_data=ctData, im1_startP=ctStartP, im1_voxSize=ctVoxSize, im1_cmap=cmapCT, 
-			im2_data=doseData, im2_startP=doseStartP, im2_voxSize=doseVoxSize, im2_cmap=cmapDose)
+	
+	images = { 'im1_data':ctData, 'im1_startP':ctStartP, 'im1_voxSize':ctVoxSize, 'im1_cmap':cmapCT, \
+			'im2_data':doseData, 'im2_startP':doseStartP, 'im2_voxSize':doseVoxSize, 'im2_cmap':cmapDose }
+	
+	# Roi vertices in the (Z, Y, X) coordinates of the viewer, Y mirrored as for the start points
+	roiFile = os.path.join(os.path.dirname(planTrialFile), 'plan.roi')
+	if os.path.exists(roiFile):
+		import roi
+		images['rois'] = [ {'name':rr['name'], 'color':rr['color'], 'offsets':rr['offsets'], \
+							'vertices':np.column_stack(( rr['vertices'][:,2], -rr['vertices'][:,1], rr['vertices'][:,0] ))} \
+							for rr in roi.readRois(roiFile) ]
+	
+	return images
 
 # ----------------------------------------- #
 
@@ -242,44 +502,102 @@ def coordToIndex(imHdr, xCoord, yCoord, zCoord):
 	"""
 	
 	# coord in cm from primary image centre
-	xCoord -= imHdr.Origin.X
+	# (not done in place so that numpy arrays of coordinates are left untouched)
+	xCoord = xCoord - imHdr.Origin.X
 	yCoord = imHdr.Origin.Y + imHdr.Dimension.Y * imHdr.VoxelSize.Y - yCoord
-	zCoord -= imHdr.Origin.Z
+	zCoord = zCoord - imHdr.Origin.Z
 	
 	# coord now in cm from start of dose cube
-	xCoord /= imHdr.VoxelSize.X
-	yCoord /= imHdr.VoxelSize.Y
-	zCoord /= imHdr.VoxelSize.Z
+	xCoord = xCoord / imHdr.VoxelSize.X
+	yCoord = yCoord / imHdr.VoxelSize.Y
+	zCoord = zCoord / imHdr.VoxelSize.Z
 	
 	# coord now in pixels from start of dose cube
 	return xCoord, yCoord, zCoord
 
 # ----------------------------------------- #
 
+def gridAxes(startP, voxSize, shape):
+	"""
+	Return the coordinates of the voxel centres along each array axis [Z, Y, X] of a volume
+	given its start position and voxel size in [Z, Y, X] order.
+	Rows run from the top of the grid downward, following coordToIndex.
+	"""
+	zAxis = startP[0] + np.arange(shape[0]) * voxSize[0]
+	yAxis = startP[1] + (shape[1] - np.arange(shape[1])) * voxSize[1]
+	xAxis = startP[2] + np.arange(shape[2]) * voxSize[2]
+	
+	return [zAxis, yAxis, xAxis]
+
+# ----------------------------------------- #
+
+def doseGridAxes(doseHdr):
+	"""
+	Return the voxel centre coordinates [Z, Y, X] of a DoseGrid.
+	"""
+	return gridAxes([ doseHdr.Origin.Z, doseHdr.Origin.Y, doseHdr.Origin.X ], \
+					[ doseHdr.VoxelSize.Z, doseHdr.VoxelSize.Y, doseHdr.VoxelSize.X ], \
+					[ doseHdr.Dimension.Z, doseHdr.Dimension.Y, doseHdr.Dimension.X ])
+
+# ----------------------------------------- #
+
+def ctGridAxes(ctHdr):
+	"""
+	Return the voxel centre coordinates [Z, Y, X] of a CT image from its header.
+	"""
+	return gridAxes([ ctHdr.z_start, ctHdr.y_start, ctHdr.x_start ], \
+					[ ctHdr.z_pixdim, ctHdr.y_pixdim, ctHdr.x_pixdim ], \
+					[ ctHdr.z_dim, ctHdr.y_dim, ctHdr.x_dim ])
+
+# ----------------------------------------- #
+
 def doseAtCoord(doseData, doseHdr, xCoord, yCoord, zCoord):
 	"""
 	Linearly interpolate the dose at a set of coordinates
 	"""
-	xCoord, yCoord, zCoord = coordToIndex(doseHdr, xCoord, yCoord, zCoord)
-	
-	xP = np.floor(xCoord)
-	yP = np.floor(yCoord)
-	zP = np.floor(zCoord)
+	return dosesAtCoords(doseData, doseHdr, xCoord, yCoord, zCoord)[0]
 
-	xF = xCoord - xP
-	yF = yCoord - yP
-	zF = zCoord - zP
+# ----------------------------------------- #
 
-	dose = 	doseAtIndex(doseData, zP, yP, xP) * (1.0-zF) * (1.0-yF) * (1.0-xF) + \
-			doseAtIndex(doseData, zP, yP, xP+1) * (1.0-zF) * (1.0-yF) * xF + \
-			doseAtIndex(doseData, zP, yP+1, xP) * (1.0-zF) * yF * (1.0-xF) + \
-			doseAtIndex(doseData, zP, yP+1, xP+1) * (1.0-zF) * yF * xF + \
-			doseAtIndex(doseData, zP+1, yP, xP) * zF * (1.0-yF) * (1.0-xF) + \
-			doseAtIndex(doseData, zP+1, yP, xP+1) * zF * (1.0-yF) * xF + \
-			doseAtIndex(doseData, zP+1, yP+1, xP) * zF * yF * (1.0-xF) + \
-			doseAtIndex(doseData, zP+1, yP+1, xP+1) * zF * yF * xF
+def dosesAtCoords(doseData, doseHdr, xCoords, yCoords, zCoords):
+	"""
+	Linearly interpolate the dose at arrays of coordinates in a single vectorised pass.
+	Only the 8 neighbouring voxels of each point are read, so doseData can be a memory mapped file.
+	"""
+	xInd, yInd, zInd = coordToIndex(doseHdr, np.atleast_1d(np.asarray(xCoords, dtype='float64')), \
+				np.atleast_1d(np.asarray(yCoords, dtype='float64')), \
+				np.atleast_1d(np.asarray(zCoords, dtype='float64')))
+	
+	return interpAtIndices(doseData, zInd, yInd, xInd)
 
-	return dose
+# ----------------------------------------- #
+
+def interpAtIndices(data, zInd, yInd, xInd):
+	"""
+	Trilinear interpolation of a 3D array at arrays of fractional indices.
+	Neighbouring voxels outside the array contribute zero.
+	"""
+	zP = np.floor(zInd).astype(np.intp)
+	yP = np.floor(yInd).astype(np.intp)
+	xP = np.floor(xInd).astype(np.intp)
+	
+	zF = zInd - zP
+	yF = yInd - yP
+	xF = xInd - xP
+	
+	result = np.zeros(zP.shape)
+	
+	for dz, wz in ((0, 1.0-zF), (1, zF)):
+		for dy, wy in ((0, 1.0-yF), (1, yF)):
+			for dx, wx in ((0, 1.0-xF), (1, xF)):
+				iz = zP + dz
+				iy = yP + dy
+				ix = xP + dx
+				valid = (iz >= 0) & (iz < data.shape[0]) & (iy >= 0) & (iy < data.shape[1]) & \
+						(ix >= 0) & (ix < data.shape[2])
+				result[valid] += data[iz[valid], iy[valid], ix[valid]] * (wz * wy * wx)[valid]
+	
+	return result
 
 # ----------------------------------------- #
 
@@ -288,9 +606,10 @@ def doseAtIndex(dose, indZ, indY, indX):
 	Return dose at indices.
 	Beyond end of dose array return zero
 	"""
+	indZ, indY, indX = int(indZ), int(indY), int(indX)
 	try:
 		dd = dose[indZ,indY,indX]
-		if indZ > 0 and indY > 0 and indX > 0:
+		if indZ >= 0 and indY >= 0 and indX >= 0:
 			return dd
 		else:
 			return 0.0
@@ -304,13 +623,7 @@ def profileAlongX(dose, indZ, indY):
 	Return a 1D array of dose values along a profile in the 
 	X axis direction at a specified Z and Y position given by array indices.
 	"""
-	
-	profile1 = np.zeros(dose.shape[2])
-	print("%s : %s" % (str(dose.shape),str(profile1.shape)))	
-	for dd in xrange(dose.shape[2]):
-		profile1[dd] = dose[indZ][indY][dd]
-
-	return profile1
+	return np.array(dose[int(indZ), int(indY), :], dtype='float64')
 
 # ----------------------------------------- #
 
@@ -319,11 +632,7 @@ def profileAlongY(dose, indZ, indX):
 	Return a 1D array of dose values along a profile in the 
 	Y axis direction at a specified Z and X position given by array indices.
 	"""
-	profile1 = np.zeros(dose.shape[1])
-	for dd in xrange(dose.shape[1]):
-		profile1[dd] = dose[indZ][dd][indX]
-
-	return profile1
+	return np.array(dose[int(indZ), :, int(indX)], dtype='float64')
 
 # ----------------------------------------- #
 
@@ -332,11 +641,72 @@ def profileAlongZ(dose, indY, indX):
 	Return a 1D array of dose values along a profile in the 
 	Z axis direction at a specified Y and X position given by array indices.
 	"""
-	profile1 = np.zeros(dose.shape[0])
-	for dd in xrange(dose.shape[0]):
-		profile1[dd] = dose[dd][indY][indX]
+	return np.array(dose[:, int(indY), int(indX)], dtype='float64')
+
+# ----------------------------------------- #
+
+def profilesAlongLines(doseData, doseHdr, startPts, endPts, nPoints=None, spacing=None):
+	"""
+	Return interpolated dose profiles along any number of straight lines in a single vectorised pass.
+	Arguments:
+		startPts	Start points of the lines as an Nx3 array of x, y, z coordinates in cm
+		endPts		End points of the lines as an Nx3 array
+		nPoints		Number of points sampled along every line
+		spacing		Sample spacing in cm used to set nPoints from the longest line
+						(default is half the smallest dose voxel size)
+	Returns the distance of each sample from the start of its line and the dose profiles,
+	both as N x nPoints arrays.
+	"""
+	startPts = np.atleast_2d(np.asarray(startPts, dtype='float64'))
+	endPts = np.atleast_2d(np.asarray(endPts, dtype='float64'))
+	
+	lengths = np.sqrt(((endPts - startPts)**2).sum(axis=1))
+	
+	if nPoints is None:
+		if spacing is None:
+			spacing = 0.5 * min(doseHdr.VoxelSize.X, doseHdr.VoxelSize.Y, doseHdr.VoxelSize.Z)
+		nPoints = int(np.ceil(lengths.max() / spacing)) + 1
+	
+	frac = np.linspace(0.0, 1.0, nPoints)
+	samples = startPts[:,None,:] + frac[None,:,None] * (endPts - startPts)[:,None,:]
+	
+	profiles = dosesAtCoords(doseData, doseHdr, samples[:,:,0].ravel(), samples[:,:,1].ravel(), \
+							samples[:,:,2].ravel()).reshape((startPts.shape[0], nPoints))
+	
+	return lengths[:,None] * frac[None,:], profiles
 
-	return profile1
+# ----------------------------------------- #
+
+def profilesAlongPolylines(doseData, doseHdr, polylines, spacing=None):
+	"""
+	Return interpolated dose profiles along any number of polylines in a single vectorised pass.
+	Arguments:
+		polylines	A list of Mx3 arrays of x, y, z vertices in cm
+		spacing		Sample spacing in cm along each polyline (default is half the smallest voxel size)
+	Returns a list of (distance along the polyline, dose) pairs of 1D arrays, one per polyline.
+	"""
+	if spacing is None:
+		spacing = 0.5 * min(doseHdr.VoxelSize.X, doseHdr.VoxelSize.Y, doseHdr.VoxelSize.Z)
+	
+	distances = []
+	samples = []
+	for vertices in polylines:
+		vertices = np.atleast_2d(np.asarray(vertices, dtype='float64'))
+		segLen = np.sqrt((np.diff(vertices, axis=0)**2).sum(axis=1))
+		cumLen = np.concatenate(([0.0], np.cumsum(segLen)))
+		
+		dist = np.linspace(0.0, cumLen[-1], int(np.ceil(cumLen[-1] / spacing)) + 1)
+		distances.append(dist)
+		samples.append( np.column_stack([ np.interp(dist, cumLen, vertices[:,ax]) for ax in range(3) ]) )
+	
+	if len(samples) == 0:
+		return []
+	
+	samples = np.concatenate(samples)
+	doses = dosesAtCoords(doseData, doseHdr, samples[:,0], samples[:,1], samples[:,2])
+	splits = np.cumsum([ dist.size for dist in distances ])[:-1]
+	
+	return list(zip(distances, np.split(doses, splits)))
 
 # ----------------------------------------- #
 
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, hashlib, tempfile
+import numpy as np
+from collections import OrderedDict
+
+import pinn
+import dose
+import archive
+
+# ----------------------------------------- #
+"""
+Cache of unnormalised beam dose cubes so trial doses can be re-normalised without re-reading files.
+
+readDose multiplies each stored beam dose by
+	PrescriptionDose * NumberOfFractions * Weight * 0.01 / doseAtPoint
+Once the beam cubes, their reference point doses and the parsed plan files are cached, changing
+any of these factors or the set of beams only costs one multiply-add pass over the dose grid :
+
+	cache = doseCache.beamDoseCache(maxBytes=2*1024**3, diskDir='/scratch/doseCache')
+	dose1, hdr = dose.readDose(planTrialFile, 0, cache=cache)
+	dose2, hdr = dose.readDose(planTrialFile, 0, cache=cache, beamWeights={0:60.0, 1:40.0})
+	dose3, hdr = dose.readDose(planTrialFile, 0, cache=cache, chooseBmInd=[0,2])
+"""
+
+# ----------------------------------------- #
+
+class beamDoseCache():
+	"""
+	Least recently used cache of beam dose cubes held in memory, with an optional directory of .npy
+	files holding the cubes in native byte order so later sessions don't need to read the binaries.
+	Entries are keyed by file name, modification time and size so edited plans are re-read.
+	"""
+	def __init__(self, maxBytes=1024**3, diskDir=None, mmap=False, maxPlans=16, \
+				maxMapped=256):
+		"""
+		Arguments:
+			maxBytes	Memory limit for the cached dose cubes, the least recently used are evicted first
+			diskDir		Directory in which to store .npy copies of the cubes (default is memory only)
+			mmap		Memory map the beam files rather than reading them, for uses that only touch
+							a small part of each cube such as point doses
+			maxPlans	Number of parsed plan files kept, the least recently used are removed first
+			maxMapped	Number of memory mapped cubes kept, which don't count towards maxBytes
+		"""
+		self._maxBytes = maxBytes
+		self._diskDir = diskDir
+		self._mmap = mmap
+		self._maxPlans = maxPlans
+		self._maxMapped = maxMapped
+		self._nBytes = 0
+		self._nMapped = 0
+
+		self._doses = OrderedDict()
+		self._sizes = {}
+		self._pointDoses = {}
+		self._plans = OrderedDict()
+
+		if diskDir is not None and not os.path.isdir(diskDir):
+			os.makedirs(diskDir)
+
+	# ------------------------------------------- #
+
+	def fileKey(self, fileName):
+		"""
+		Return a key identifying the current contents of a file, or of the archive replacing it.
+		"""
+		if not os.path.exists(fileName) and archive.archiveFile(fileName) is not None:
+			fileName = archive.archiveFile(fileName)
+		st = os.stat(fileName)
+		return (os.path.abspath(fileName), st.st_mtime, st.st_size)
+
+	# ------------------------------------------- #
+
+	def readPlan(self, pinnFile):
+		"""
+		Read a pinnacle file, reusing the parsed object if the file hasn't changed.
+		"""
+		key = self.fileKey(pinnFile)
+		if key in self._plans:
+			plan = self._plans.pop(key)
+		else:
+			plan = pinn.read(pinnFile)
+		self._plans[key] = plan
+
+		while len(self._plans) > self._maxPlans:
+			self._plans.popitem(last=False)
+
+		return plan
+
+	# ------------------------------------------- #
+
+	def beamDose(self, doseFile, doseHdr):
+		"""
+		Return the unnormalised dose cube of a beam as a read only float32 array
+		(a big endian memory map of the beam file when the cache was created with mmap).
+		"""
+		key = self.fileKey(doseFile)
+
+		if key in self._doses:
+			bmDose = self._doses.pop(key)
+			self._doses[key] = bmDose
+			return bmDose
+
+		npyFile = self.diskFile(key)
+		bmDose = None
+		nBytes = 0
+		if self._mmap:
+			bmDose = dose.readBeamDose(doseFile, doseHdr, mmap=True)
+		elif npyFile is not None and os.path.exists(npyFile):
+			try:
+				bmDose = np.load(npyFile, mmap_mode='r')
+			except (IOError, OSError, ValueError, EOFError):
+				# A damaged cache file is treated as a miss and rewritten below
+				bmDose = None
+
+		if bmDose is None:
+			bmDose = dose.readBeamDose(doseFile, doseHdr)
+			nBytes = bmDose.nbytes
+			if npyFile is not None:
+				self.writeDiskFile(npyFile, bmDose)
+
+		if hasattr(bmDose, 'flags'):
+			bmDose.flags.writeable = False
+
+		# Only cubes read into memory count towards the limit, memory maps are paged in by the OS
+		self._doses[key] = bmDose
+		self._sizes[key] = nBytes
+		self._nBytes += nBytes
+		if nBytes == 0:
+			self._nMapped += 1
+		self.evict()
+
+		return bmDose
+
+	# ------------------------------------------- #
+
+	def pointDose(self, doseFile, doseHdr, xCoord, yCoord, zCoord):
+		"""
+		Return the unnormalised dose of a beam at a point, as used for the beam weight normalisation.
+		"""
+		key = self.fileKey(doseFile)
+		bmDose = self.beamDose(doseFile, doseHdr)
+
+		# Point doses are kept with their cube and evicted along with it
+		pointDoses = self._pointDoses.setdefault(key, {})
+		if (xCoord, yCoord, zCoord) not in pointDoses:
+			pointDoses[(xCoord, yCoord, zCoord)] = dose.doseAtCoord(bmDose, doseHdr, xCoord, yCoord, zCoord)
+		return pointDoses[(xCoord, yCoord, zCoord)]
+
+	# ------------------------------------------- #
+
+	def diskFile(self, key):
+		"""
+		Return the name of the .npy file used to store a cube on disk, or None if there is no disk cache.
+		"""
+		if self._diskDir is None:
+			return None
+		return os.path.join(self._diskDir, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.npy')
+
+	# ------------------------------------------- #
+
+	def writeDiskFile(self, npyFile, bmDose):
+		"""
+		Write a cube to the disk cache through a temporary file renamed over the target, so an
+		interrupted write or another process sharing the directory never leaves a partial file.
+		"""
+		fd, tmpFile = tempfile.mkstemp(suffix='.tmp', dir=self._diskDir)
+		try:
+			f = os.fdopen(fd, 'wb')
+			try:
+				np.save(f, bmDose)
+			finally:
+				f.close()
+			os.rename(tmpFile, npyFile)
+		except:
+			if os.path.exists(tmpFile):
+				os.remove(tmpFile)
+			raise
+
+	# ------------------------------------------- #
+
+	def evict(self):
+		"""
+		Remove the least recently used cubes and their point doses until the cache is within its
+		memory limit and number of memory mapped cubes. The most recently added cube is always kept.
+		"""
+		while (self._nBytes > self._maxBytes or self._nMapped > self._maxMapped) and len(self._doses) > 1:
+			key, bmDose = self._doses.popitem(last=False)
+			nBytes = self._sizes.pop(key)
+			self._nBytes -= nBytes
+			if nBytes == 0:
+				self._nMapped -= 1
+			self._pointDoses.pop(key, None)
+			closeDose(bmDose)
+
+	# ------------------------------------------- #
+
+	def nbytes(self):
+		"""
+		Return the number of bytes of dose held in memory.
+		"""
+		return self._nBytes
+
+	# ------------------------------------------- #
+
+	def clear(self):
+		"""
+		Empty the in memory cache. Files in the disk cache are kept.
+		"""
+		for bmDose in self._doses.values():
+			closeDose(bmDose)
+		self._doses = OrderedDict()
+		self._sizes = {}
+		self._pointDoses = {}
+		self._plans = OrderedDict()
+		self._nBytes = 0
+		self._nMapped = 0
+
+# ----------------------------------------- #
+
+def closeDose(bmDose):
+	"""
+	Close the file held by a cached cube, such as the archive of a chunkedVolume.
+	"""
+	if hasattr(bmDose, 'close'):
+		bmDose.close()
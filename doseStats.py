@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import numpy as np
+
+import dose
+import dvh
+
+# ----------------------------------------- #
+"""
+Dose statistics calculated by streaming over the beam dose files in blocks of Z planes.
+
+The beam files are memory mapped and each block of the trial dose is formed from the weighted
+beam sum, reduced and discarded, so the full float64 trial dose is never held in memory.
+Percentiles need a second pass over the files to histogram the dose between the minimum and
+maximum found in the first pass, this is skipped when no percentiles are requested.
+
+	stats = doseStats.trialDoseStats(planTrialFile, 0, masks={'PTV':ptvMask},
+										percentiles=(2, 50, 98), isodoseLevels=(2000, 5700))
+	print(stats['PTV']['max'], stats['global']['isodoseVolumes'][5700])
+"""
+
+# ----------------------------------------- #
+
+def trialDoseStats(planTrialFile, trNum, masks=None, percentiles=(), isodoseLevels=(), \
+					blockSize=16, nBins=10000):
+	"""
+	Calculate dose statistics for a trial over the whole dose grid and inside each of a set of masks.
+	Arguments:
+		masks			Dictionary of name to boolean mask or flat voxel indices on the dose grid
+		percentiles		Percentiles of the voxel doses to calculate
+		isodoseLevels	Doses for which to calculate the volume (cm^3) receiving at least that dose
+		blockSize		Number of Z planes of dose formed at a time
+		nBins			Number of histogram bins used for the percentiles
+	Returns a dictionary with an entry 'global' and one per mask, each a dictionary with keys :
+		max, min, mean, volume, maxIndex (Z, Y, X), maxCoord (X, Y, Z in cm),
+		percentiles (dictionary of percentile to dose) and isodoseVolumes (dictionary of level to cm^3)
+	"""
+	bmInds, bmDoses, bmFactors, doseHdr = dose.trialBeamDoses(planTrialFile, trNum)
+	trDose = dose.beamDoseSum(bmDoses, bmFactors)
+
+	return volumeStats(trDose, doseHdr, masks, percentiles, isodoseLevels, blockSize, nBins)
+
+# ----------------------------------------- #
+
+def planDoseStats(planTrialFile, masks=None, percentiles=(), isodoseLevels=(), blockSize=16, nBins=10000):
+	"""
+	Calculate the dose statistics of every trial in a plan, returned as a list with one entry per trial.
+	"""
+	return [ trialDoseStats(planTrialFile, trNum, masks, percentiles, isodoseLevels, blockSize, nBins) \
+				for trNum in range(dose.numTrials(planTrialFile)) ]
+
+# ----------------------------------------- #
+
+def volumeStats(doseData, doseHdr, masks=None, percentiles=(), isodoseLevels=(), blockSize=16, nBins=10000):
+	"""
+	Calculate dose statistics block by block from any volume that can be sliced along Z,
+	e.g. a memory mapped array or a dose.beamDoseSum. Arguments and result are as for trialDoseStats.
+	"""
+	shape = doseData.shape
+	planeSize = shape[1] * shape[2]
+	voxelVolume = doseHdr.VoxelSize.X * doseHdr.VoxelSize.Y * doseHdr.VoxelSize.Z
+
+	accums = {'global':statsAccumulator(None, isodoseLevels)}
+	if masks is not None:
+		for name, mask in masks.items():
+			accums[name] = statsAccumulator(np.sort(dvh.maskIndices(mask)), isodoseLevels)
+
+	blocks = [ (z0, min(z0 + blockSize, shape[0])) for z0 in range(0, shape[0], blockSize) ]
+
+	for z0, z1 in blocks:
+		block = np.asarray(doseData[z0:z1], dtype='float64').ravel()
+		for acc in accums.values():
+			acc.addBlock(block, z0 * planeSize, z1 * planeSize)
+
+	if len(percentiles) > 0:
+		for acc in accums.values():
+			acc.startHistogram(nBins)
+		for z0, z1 in blocks:
+			block = np.asarray(doseData[z0:z1], dtype='float64').ravel()
+			for acc in accums.values():
+				acc.addHistogramBlock(block, z0 * planeSize, z1 * planeSize)
+
+	axes = dose.doseGridAxes(doseHdr)
+	stats = {}
+	for name, acc in accums.items():
+		stats[name] = acc.result(shape, axes, voxelVolume, percentiles)
+
+	return stats
+
+# ----------------------------------------- #
+
+class statsAccumulator():
+	"""
+	Accumulate dose statistics over the voxels of a mask (or every voxel) one block at a time.
+	"""
+	def __init__(self, voxInd, isodoseLevels=()):
+		"""
+		Arguments:
+			voxInd			Sorted flat voxel indices of the mask, or None for every voxel
+			isodoseLevels	Dose levels to count the voxels receiving at least that dose
+		"""
+		self._voxInd = voxInd
+		self._levels = list(isodoseLevels)
+		self._levelCounts = np.zeros(len(self._levels), dtype=np.int64)
+		self._count = 0
+		self._sum = 0.0
+		self._max = -np.inf
+		self._min = np.inf
+		self._maxInd = -1
+		self._hist = None
+
+	# ------------------------------------------- #
+
+	def blockValues(self, block, start, end):
+		"""
+		Return the doses in a block that are inside the mask and their flat indices in the volume.
+		"""
+		if self._voxInd is None:
+			return block, None
+		i0, i1 = np.searchsorted(self._voxInd, [start, end])
+		return block[self._voxInd[i0:i1] - start], self._voxInd[i0:i1]
+
+	# ------------------------------------------- #
+
+	def addBlock(self, block, start, end):
+		"""
+		Add a block of dose covering flat voxel indices start to end-1.
+		"""
+		values, inds = self.blockValues(block, start, end)
+		if values.size == 0:
+			return
+
+		self._count += values.size
+		self._sum += values.sum()
+		self._min = min(self._min, values.min())
+
+		bMax = values.argmax()
+		if values[bMax] > self._max:
+			self._max = values[bMax]
+			self._maxInd = start + bMax if inds is None else inds[bMax]
+
+		for lInd, level in enumerate(self._levels):
+			self._levelCounts[lInd] += np.count_nonzero(values >= level)
+
+	# ------------------------------------------- #
+
+	def startHistogram(self, nBins):
+		"""
+		Prepare the histogram for the second pass, using the dose range found in the first pass.
+		"""
+		self._nBins = nBins
+		self._hist = np.zeros(nBins, dtype=np.int64)
+
+	# ------------------------------------------- #
+
+	def addHistogramBlock(self, block, start, end):
+		"""
+		Add a block of dose to the histogram used for percentiles.
+		"""
+		values, inds = self.blockValues(block, start, end)
+		if values.size == 0 or self._count == 0:
+			return
+		self._hist += np.histogram(values, bins=self._nBins, range=(self._min, max(self._max, self._min + 1.0e-9)))[0]
+
+	# ------------------------------------------- #
+
+	def percentile(self, pct):
+		"""
+		Return a percentile of the dose interpolated within the histogram bins.
+		"""
+		if self._count == 0:
+			return 0.0
+		edges = np.linspace(self._min, max(self._max, self._min + 1.0e-9), self._nBins + 1)
+		cumCount = np.concatenate(([0], np.cumsum(self._hist))) * 100.0 / self._count
+		return np.interp(pct, cumCount, edges)
+
+	# ------------------------------------------- #
+
+	def result(self, shape, axes, voxelVolume, percentiles=()):
+		"""
+		Return the accumulated statistics as a dictionary.
+		"""
+		if self._count == 0:
+			return {'max':0.0, 'min':0.0, 'mean':0.0, 'volume':0.0, 'maxIndex':None, 'maxCoord':None, \
+					'percentiles':dict([ (pct, 0.0) for pct in percentiles ]), \
+					'isodoseVolumes':dict([ (level, 0.0) for level in self._levels ])}
+
+		maxIndex = np.unravel_index(self._maxInd, shape)
+
+		return {'max':self._max, 'min':self._min, 'mean':self._sum / self._count, \
+				'volume':self._count * voxelVolume, 'maxIndex':tuple([ int(ii) for ii in maxIndex ]), \
+				'maxCoord':(axes[2][maxIndex[2]], axes[1][maxIndex[1]], axes[0][maxIndex[0]]), \
+				'percentiles':dict([ (pct, self.percentile(pct)) for pct in percentiles ]), \
+				'isodoseVolumes':dict([ (level, count * voxelVolume) \
+										for level, count in zip(self._levels, self._levelCounts) ])}
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, re
+import numpy as np
+
+import pinn
+import dose
+import roi
+
+# ----------------------------------------- #
+"""
+Dose volume histograms calculated from the dose cubes returned by dose.readDose.
+
+The dose cube is converted to histogram bin numbers once and every roi is then histogrammed
+with a single bincount over its voxel indices, so the cost of adding another roi is
+proportional to the number of voxels it contains rather than the size of the dose grid.
+"""
+
+# ----------------------------------------- #
+
+def calcDVHs(doseData, masks, binWidth=1.0, voxelVolume=1.0):
+	"""
+	Calculate the differential and cumulative DVH for a set of rois.
+	Arguments:
+		doseData	The dose cube as a 3D numpy array (Z, Y, X)
+		masks		A dictionary of roi name to either a boolean mask with the shape of doseData
+						or an array of flat voxel indices into doseData
+		binWidth	The width of the histogram bins in the units of the dose (cGy for readDose)
+		voxelVolume	The volume of a dose voxel, the DVH volumes are given in these units
+	Returns a dictionary of roi name to a dictionary with keys:
+		bins			The lower dose of each histogram bin
+		differential	The volume in each bin
+		cumulative		The volume receiving at least the dose of each bin
+		volume			The total volume of the roi
+		min, max, mean	Dose statistics taken directly from the voxel doses
+	"""
+	flatDose = doseData.ravel()
+
+	nBins = int(flatDose.max() / binWidth) + 2
+	bins = np.arange(nBins) * binWidth
+
+	# Bin number of every voxel, shared by all rois
+	binInd = np.floor_divide(flatDose, binWidth).astype(np.int32)
+	np.clip(binInd, 0, nBins-1, out=binInd)
+
+	dvhs = {}
+	for name, mask in masks.items():
+		voxInd = maskIndices(mask)
+
+		if voxInd.size == 0:
+			dvhs[name] = { 'bins':bins, 'differential':np.zeros(nBins), 'cumulative':np.zeros(nBins), \
+							'volume':0.0, 'min':0.0, 'max':0.0, 'mean':0.0 }
+			continue
+
+		roiDose = flatDose[voxInd]
+		diff = np.bincount(binInd[voxInd], minlength=nBins) * float(voxelVolume)
+
+		dvhs[name] = { 'bins':bins, 'differential':diff, 'cumulative':diff[::-1].cumsum()[::-1], \
+						'volume':voxInd.size * float(voxelVolume), 'min':roiDose.min(), \
+						'max':roiDose.max(), 'mean':roiDose.mean() }
+
+	return dvhs
+
+# ----------------------------------------- #
+
+def dvhMetric(dvh, metric):
+	"""
+	Evaluate a standard metric on a DVH returned by calcDVHs. Metrics are given as strings :
+		Dmax, Dmin, Dmean	Maximum, minimum and mean dose
+		D95					Minimum dose to the hottest 95% of the volume
+		D2cc				Minimum dose to the hottest 2 cm^3 of the volume
+		V2000				Percentage of the volume receiving at least 2000 (dose units, e.g. cGy)
+		V2000cc				Absolute volume receiving at least 2000
+	"""
+	if metric in ('Dmax','Dmin','Dmean'):
+		return dvh[metric[1:].lower()]
+
+	m1 = re.match(r'^([DV])([0-9]*\.?[0-9]+)(cc)?$', metric)
+	if m1 is None:
+		raise InvalidMetricException("Unrecognized DVH metric : %s" % metric)
+
+	metType, value, absolute = m1.group(1), float(m1.group(2)), m1.group(3) is not None
+
+	if dvh['volume'] <= 0.0:
+		return 0.0
+
+	cumulative = dvh['cumulative']
+	if not absolute:
+		cumulative = cumulative * 100.0 / dvh['volume']
+
+	if metType == 'V':
+		return np.interp(value, dvh['bins'], cumulative, right=0.0)
+	else:
+		# Cumulative DVH decreases with dose so reverse it for interpolation
+		return np.interp(value, cumulative[::-1], dvh['bins'][::-1])
+
+# ----------------------------------------- #
+
+def dvhMetrics(dvhs, metrics=('Dmax','Dmean','Dmin','D95')):
+	"""
+	Evaluate a list of metrics for every DVH in a dictionary returned by calcDVHs.
+	Returns a dictionary of roi name to a dictionary of metric name to value.
+	"""
+	result = {}
+	for name, dvh in dvhs.items():
+		result[name] = dict([ (met, dvhMetric(dvh, met)) for met in metrics ])
+	return result
+
+# ----------------------------------------- #
+
+def maskIndices(mask):
+	"""
+	Return the flat voxel indices of a roi mask. Index arrays are passed through unchanged.
+	"""
+	mask = np.asarray(mask)
+	if mask.dtype == bool:
+		return np.flatnonzero(mask)
+	return mask.ravel()
+
+# ----------------------------------------- #
+
+def gridKey(doseHdr):
+	"""
+	Return a hashable description of a dose grid geometry, used to share masks between trials.
+	"""
+	return tuple([ float(doseHdr[ent][ax]) for ent in ('Origin','VoxelSize','Dimension') \
+															for ax in ('X','Y','Z') ])
+
+# ----------------------------------------- #
+
+class dvhBatch():
+	"""
+	Calculate DVHs for all trials in a plan.
+	The roi contours are read once and masks are cached for each distinct dose grid, so repeated
+	calls don't recompute them. Only the dose cube of the most recent trial is kept, so a plan with
+	many trials never holds more than one cube in memory.
+	"""
+	def __init__(self, planTrialFile, roiNames=None, binWidth=1.0):
+		"""
+		Arguments:
+			planTrialFile	Path to the plan.Trial file (plan.roi is read from the same directory)
+			roiNames		List of roi names to include (default is all rois)
+			binWidth		Width of the DVH dose bins
+		"""
+		self._planTrialFile = planTrialFile
+		self._binWidth = binWidth
+
+		# Only the points of the selected rois are parsed
+		self._rois = roi.readRois(os.path.join( os.path.dirname(planTrialFile),'plan.roi'), names=roiNames)
+
+		self._maskCache = {}
+		self._doseCache = {}
+		self._nTrials = -1
+
+	# ------------------------------------------- #
+
+	def numTrials(self):
+		"""
+		Return the number of trials in the plan.
+		"""
+		if self._nTrials < 0:
+			pln1 = pinn.read(os.path.join( os.path.dirname(self._planTrialFile),'plan.Trial'))
+			self._nTrials = 1
+			if pln1.has_key('TrialList'):
+				self._nTrials = len(pln1.TrialList)
+		return self._nTrials
+
+	# ------------------------------------------- #
+
+	def masks(self, doseHdr):
+		"""
+		Return the roi masks as flat voxel indices on a dose grid, computing them on first use.
+		"""
+		key = gridKey(doseHdr)
+		if key not in self._maskCache:
+			self._maskCache[key] = dict([ (rr['name'], np.flatnonzero(roi.roiMask(rr['vertices'], doseHdr, rr['offsets']))) \
+												for rr in self._rois ])
+		return self._maskCache[key]
+
+	# ------------------------------------------- #
+
+	def trialDose(self, trNum):
+		"""
+		Return the dose cube and dose grid of a trial, reading it unless it is the last trial read.
+		"""
+		if trNum not in self._doseCache:
+			# Drop the previous cube first so two are never held at once
+			self._doseCache = {}
+			self._doseCache[trNum] = dose.readDose(self._planTrialFile, trNum)
+		return self._doseCache[trNum]
+
+	# ------------------------------------------- #
+
+	def trialDVHs(self, trNum):
+		"""
+		Calculate the DVH of every roi for a single trial.
+		"""
+		doseData, doseHdr = self.trialDose(trNum)
+		voxelVolume = doseHdr.VoxelSize.X * doseHdr.VoxelSize.Y * doseHdr.VoxelSize.Z
+		return calcDVHs(doseData, self.masks(doseHdr), self._binWidth, voxelVolume)
+
+	# ------------------------------------------- #
+
+	def planDVHs(self):
+		"""
+		Calculate the DVH of every roi for every trial in the plan.
+		Returns a list with one dictionary of DVHs per trial.
+		"""
+		return [ self.trialDVHs(trNum) for trNum in range(self.numTrials()) ]
+
+	# ------------------------------------------- #
+
+	def planMetrics(self, metrics=('Dmax','Dmean','Dmin','D95')):
+		"""
+		Evaluate DVH metrics for every roi in every trial.
+		Returns a list of rows of [trial number, roi name, metric values ...]
+		"""
+		table = []
+		for trNum, dvhs in enumerate(self.planDVHs()):
+			mets = dvhMetrics(dvhs, metrics)
+			for rr in self._rois:
+				table.append( [trNum, rr['name']] + [ mets[rr['name']][met] for met in metrics ] )
+		return table
+
+	# ------------------------------------------- #
+
+	def clearCache(self):
+		"""
+		Release the cached masks and dose cube.
+		"""
+		self._maskCache = {}
+		self._doseCache = {}
+
+# ----------------------------------------- #
+
+class InvalidMetricException(Exception):
+	pass
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, shutil
+import numpy as np
+
+import dose
+
+# ----------------------------------------- #
+"""
+Export dose and CT volumes to NRRD (.nrrd / .nhdr) and MetaImage (.mha / .mhd) files.
+
+The format is chosen from the file extension, .nhdr and .mhd write a detached header with the
+voxel data in a .raw file next to it. Positions and spacing are written in mm in the pinnacle
+patient coordinate system. Array rows run from the top of the grid down (see dose.coordToIndex)
+so the second axis has a negative direction.
+
+For a CT the voxel data is taken straight from the .img file with its own byte order, as a hard
+link for detached headers where possible, otherwise streamed into the file, so exporting a large
+CT never passes the image through numpy. A CT compressed by archive.compressPlan is decompressed
+and written a slab at a time.
+
+	export.exportCT(planTrialFile, '/data/export/ct.nhdr')
+	export.exportDose(planTrialFile, 0, '/data/export/dose_trial0.mha')
+"""
+
+# ----------------------------------------- #
+
+def exportDose(planTrialFile, trNum, fileName, doseData=None, doseHdr=None):
+	"""
+	Export the dose of a trial as float32. Pass doseData and doseHdr from dose.readDose to
+	avoid reading the dose again.
+	"""
+	if doseData is None:
+		doseData, doseHdr = dose.readDose(planTrialFile, trNum)
+
+	voxSize = [ doseHdr.VoxelSize.Z, doseHdr.VoxelSize.Y, doseHdr.VoxelSize.X ]
+	writeVolume(fileName, doseData, dose.doseGridAxes(doseHdr), voxSize, dtype='float32')
+
+# ----------------------------------------- #
+
+def exportCT(planTrialFile, fileName, link=True):
+	"""
+	Export the CT of a plan, copying or hard linking the voxel data from the .img file, or writing
+	it from the archive when the .img file has been compressed.
+	"""
+	fp1 = open(os.path.join( os.path.dirname(planTrialFile),'plan.defaults'))
+	imFile = fp1.readline().split(':')[1].strip()
+	fp1.close()
+	imFile = os.path.join( os.path.dirname(planTrialFile),imFile) + '.img'
+
+	# Only the header is needed when the .img file is there, the mapped image is never read
+	ctData, ctHdr = dose.readCT(planTrialFile, mmap=True)
+
+	if not os.path.exists(imFile):
+		imFile = None
+
+	voxSize = [ ctHdr.z_pixdim, ctHdr.y_pixdim, ctHdr.x_pixdim ]
+	writeVolume(fileName, ctData, dose.ctGridAxes(ctHdr), voxSize, dtype=ctData.dtype, \
+				srcFile=imFile, link=link)
+
+# ----------------------------------------- #
+
+def writeVolume(fileName, data, axes, voxSize, dtype=None, srcFile=None, link=True, slabSize=16):
+	"""
+	Write a (Z, Y, X) volume to a NRRD or MetaImage file chosen by the file extension.
+	Arguments:
+		data		The volume, only its shape is used when srcFile is given
+		axes		Voxel centre coordinates [Z, Y, X] in cm (see dose.gridAxes)
+		voxSize		Voxel size [Z, Y, X] in cm
+		dtype		Data type written, including byte order (default is that of data)
+		srcFile		Raw file holding the voxel data in dtype, used in place of data
+		link		Hard link srcFile as the data file of a detached header rather than copy it
+		slabSize	Number of Z planes converted at a time when writing from data
+	"""
+	if dtype is None:
+		dtype = data.dtype
+	dtype = np.dtype(dtype)
+
+	ext = os.path.splitext(fileName)[1].lower()
+	detached = ext in ('.nhdr', '.mhd')
+	dataFile = os.path.splitext(fileName)[0] + '.raw'
+
+	geometry = volumeGeometry(data.shape, axes, voxSize)
+
+	if ext in ('.nrrd', '.nhdr'):
+		hdrTxt = nrrdHeader(geometry, dtype, detached and os.path.basename(dataFile))
+	elif ext in ('.mha', '.mhd'):
+		hdrTxt = metaImageHeader(geometry, dtype, detached and os.path.basename(dataFile))
+	else:
+		raise ExportFormatException("Unrecognized export format : %s" % ext)
+
+	f = open(fileName, 'wb')
+	f.write(hdrTxt.encode('ascii'))
+
+	if detached:
+		f.close()
+		if srcFile is not None and os.path.abspath(srcFile) == os.path.abspath(dataFile):
+			return
+		if os.path.exists(dataFile):
+			os.remove(dataFile)
+		if srcFile is not None:
+			linkOrCopy(srcFile, dataFile, link)
+		else:
+			writeRaw(dataFile, data, dtype, slabSize)
+	else:
+		if srcFile is not None:
+			src = open(srcFile, 'rb')
+			shutil.copyfileobj(src, f, 16 * 1024 * 1024)
+			src.close()
+		else:
+			writeSlabs(f, data, dtype, slabSize)
+		f.close()
+
+# ----------------------------------------- #
+
+def volumeGeometry(shape, axes, voxSize):
+	"""
+	Return the sizes, origin and axis directions in mm of a (Z, Y, X) volume in file order (X, Y, Z).
+	"""
+	sizes = [ shape[2], shape[1], shape[0] ]
+	origin = [ 10.0 * axes[2][0], 10.0 * axes[1][0], 10.0 * axes[0][0] ]
+
+	directions = []
+	for fAx, ax in enumerate((2, 1, 0)):
+		step = 10.0 * voxSize[ax]
+		if len(axes[ax]) > 1 and axes[ax][1] < axes[ax][0]:
+			step = -step
+		direction = [0.0, 0.0, 0.0]
+		direction[fAx] = step
+		directions.append(direction)
+
+	return {'sizes':sizes, 'origin':origin, 'directions':directions}
+
+# ----------------------------------------- #
+
+def nrrdHeader(geometry, dtype, dataFile=None):
+	"""
+	Return the text of a NRRD header, with a data file entry for detached headers.
+	"""
+	nrrdTypes = {'i1':'int8', 'u1':'uint8', 'i2':'short', 'u2':'ushort', 'i4':'int', 'u4':'uint', \
+					'f4':'float', 'f8':'double'}
+
+	hdrTxt = "NRRD0004\n# Written by pinnpy\n"
+	hdrTxt += "type: %s\n" % nrrdTypes[dtype.kind + str(dtype.itemsize)]
+	hdrTxt += "dimension: 3\nspace dimension: 3\n"
+	hdrTxt += "sizes: %d %d %d\n" % tuple(geometry['sizes'])
+	hdrTxt += "space directions: %s\n" % ' '.join([ "(%s)" % numberText(dd, ',') for dd in geometry['directions'] ])
+	hdrTxt += "space origin: (%s)\n" % numberText(geometry['origin'], ',')
+	hdrTxt += "space units: \"mm\" \"mm\" \"mm\"\n"
+	hdrTxt += "kinds: domain domain domain\n"
+	if dtype.itemsize > 1:
+		hdrTxt += "endian: %s\n" % ('big' if isBigEndian(dtype) else 'little')
+	hdrTxt += "encoding: raw\n"
+	if dataFile:
+		hdrTxt += "data file: %s\n" % dataFile
+	hdrTxt += "\n"
+
+	return hdrTxt
+
+# ----------------------------------------- #
+
+def metaImageHeader(geometry, dtype, dataFile=None):
+	"""
+	Return the text of a MetaImage header, ElementDataFile is LOCAL unless a data file is given.
+	"""
+	metaTypes = {'i1':'MET_CHAR', 'u1':'MET_UCHAR', 'i2':'MET_SHORT', 'u2':'MET_USHORT', 'i4':'MET_INT', \
+					'u4':'MET_UINT', 'f4':'MET_FLOAT', 'f8':'MET_DOUBLE'}
+
+	spacing = [ abs(geometry['directions'][ax][ax]) for ax in range(3) ]
+	transform = [ np.sign(geometry['directions'][ax][ax]) if rr == ax else 0 \
+						for rr in range(3) for ax in range(3) ]
+
+	hdrTxt = "ObjectType = Image\nNDims = 3\nBinaryData = True\n"
+	hdrTxt += "BinaryDataByteOrderMSB = %s\n" % ('True' if isBigEndian(dtype) else 'False')
+	hdrTxt += "CompressedData = False\n"
+	hdrTxt += "TransformMatrix = %s\n" % ' '.join([ "%d" % tt for tt in transform ])
+	hdrTxt += "Offset = %s\n" % numberText(geometry['origin'])
+	hdrTxt += "CenterOfRotation = 0 0 0\n"
+	hdrTxt += "ElementSpacing = %s\n" % numberText(spacing)
+	hdrTxt += "DimSize = %d %d %d\n" % tuple(geometry['sizes'])
+	hdrTxt += "ElementType = %s\n" % metaTypes[dtype.kind + str(dtype.itemsize)]
+	hdrTxt += "ElementDataFile = %s\n" % (dataFile if dataFile else 'LOCAL')
+
+	return hdrTxt
+
+# ----------------------------------------- #
+
+def numberText(values, sep=' '):
+	"""
+	Format a list of numbers, which may be numpy scalars, as plain decimal text for a header.
+	"""
+	return sep.join([ '%.10g' % float(vv) for vv in values ])
+
+# ----------------------------------------- #
+
+def isBigEndian(dtype):
+	"""
+	Check if a numpy data type is stored big endian.
+	"""
+	return dtype.byteorder == '>' or (dtype.byteorder == '=' and np.little_endian == False)
+
+# ----------------------------------------- #
+
+def linkOrCopy(srcFile, dstFile, link=True):
+	"""
+	Hard link a file, or copy it if linking is not possible (e.g. on a different file system).
+	"""
+	if link and hasattr(os, 'link'):
+		try:
+			os.link(srcFile, dstFile)
+			return
+		except OSError:
+			pass
+	shutil.copyfile(srcFile, dstFile)
+
+# ----------------------------------------- #
+
+def writeRaw(dataFile, data, dtype, slabSize=16):
+	"""
+	Write a volume to a raw data file.
+	"""
+	f = open(dataFile, 'wb')
+	writeSlabs(f, data, dtype, slabSize)
+	f.close()
+
+# ----------------------------------------- #
+
+def writeSlabs(f, data, dtype, slabSize=16):
+	"""
+	Write a volume to an open file a slab at a time, arrays already in dtype are written without a copy.
+	"""
+	for z0 in range(0, data.shape[0], slabSize):
+		np.ascontiguousarray(data[z0:z0+slabSize], dtype=dtype).tofile(f)
+
+# ----------------------------------------- #
+
+class ExportFormatException(Exception):
+	pass
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+import dose
+import resample
+
+# ----------------------------------------- #
+"""
+3D gamma index comparison of two dose distributions.
+
+The evaluated dose is resampled onto the grid of the reference dose and padded, then every
+search offset within the search radius is precomputed once as flat index offsets and
+interpolation weights, sorted by distance. Reference voxels are searched shell by shell in
+order of increasing distance and a voxel stops being searched as soon as its best gamma can't
+be improved by the distance term of the next shell. Blocks of voxels are searched in parallel.
+
+	gam = gamma.gammaIndex(refDose, refHdr, evalDose, evalHdr, dta=0.3, doseDiff=3.0)
+	print(gamma.gammaPassRate(gam))
+"""
+
+# ----------------------------------------- #
+
+def gammaIndex(refDose, refHdr, evalDose, evalHdr, dta=0.3, doseDiff=3.0, local=False, \
+				cutoff=10.0, normDose=None, searchStep=None, maxGamma=2.0, nThreads=None, \
+				blockSize=65536):
+	"""
+	Calculate the gamma index of every voxel in the reference dose.
+	Arguments:
+		refDose, refHdr		Reference dose cube (Z, Y, X) and its DoseGrid
+		evalDose, evalHdr	Evaluated dose cube and its DoseGrid, which can differ from the reference grid
+		dta					Distance to agreement criterion in cm
+		doseDiff			Dose difference criterion in percent
+		local				Use the local reference dose for the dose difference rather than normDose
+		cutoff				Voxels with reference dose below this percentage of normDose are not evaluated
+		normDose			Dose used for global normalisation and the cutoff (default maximum reference dose)
+		searchStep			Spacing of the search points in cm (default dta / 3)
+		maxGamma			The search radius is maxGamma * dta, voxels with no better match get gamma >= maxGamma
+		nThreads			Number of threads (default is the number of cpus)
+		blockSize			Number of voxels searched together by one thread
+	Returns the gamma index as a float32 array with the shape of refDose and NaN for unevaluated voxels.
+	"""
+	refDose = np.asarray(refDose, dtype='float64')
+	refAxes = dose.doseGridAxes(refHdr)
+	voxSize = np.array([ refHdr.VoxelSize.Z, refHdr.VoxelSize.Y, refHdr.VoxelSize.X ], dtype='float64')
+
+	if normDose is None:
+		normDose = refDose.max()
+	if searchStep is None:
+		searchStep = dta / 3.0
+	if nThreads is None:
+		nThreads = multiprocessing.cpu_count()
+
+	# Evaluated dose on the reference grid, NaN outside the evaluated grid so it never matches
+	evalOnRef = resample.gridResampler(dose.doseGridAxes(evalHdr), refAxes, fill=np.nan, \
+										nThreads=nThreads).resample(evalDose)
+
+	offsets, margin = searchOffsets(voxSize, dta, searchStep, maxGamma)
+
+	padded = np.pad(evalOnRef, [(mm, mm) for mm in margin], mode='constant', constant_values=np.nan)
+	padShape = padded.shape
+	padFlat = padded.ravel()
+	padStrides = np.array([ padShape[1] * padShape[2], padShape[2], 1 ])
+
+	# Each offset becomes a list of flat index offsets into the padded volume and interpolation weights
+	shells = []
+	for distSq, offList in offsets:
+		shellOffs = []
+		for off in offList:
+			base = np.floor(off).astype(int)
+			frac = off - base
+			corners = []
+			for cz in (0, 1):
+				for cy in (0, 1):
+					for cx in (0, 1):
+						wt = (frac[0] if cz else 1.0-frac[0]) * (frac[1] if cy else 1.0-frac[1]) * \
+							 (frac[2] if cx else 1.0-frac[2])
+						if wt > 1.0e-9:
+							corners.append( (int(np.dot(base + [cz, cy, cx], padStrides)), wt) )
+			shellOffs.append(corners)
+		shells.append( (distSq, shellOffs) )
+
+	# Reference voxels to evaluate
+	voxInd = np.flatnonzero(refDose >= cutoff * 0.01 * normDose)
+	refVals = refDose.ravel()[voxInd]
+
+	if local:
+		# Clamp the local dose so zero dose reference voxels don't divide by zero
+		localDose = np.maximum(refVals, max(1.0e-6 * normDose, 1.0e-12))
+		ddSq = (doseDiff * 0.01 * localDose) ** 2
+	else:
+		ddSq = np.ones(voxInd.size) * (doseDiff * 0.01 * normDose) ** 2
+
+	zz, yy, xx = np.unravel_index(voxInd, refDose.shape)
+	padInd = (zz + margin[0]) * padStrides[0] + (yy + margin[1]) * padStrides[1] + (xx + margin[2])
+
+	gamSq = np.empty(voxInd.size)
+
+	def runBlock(b0):
+		b1 = min(b0 + blockSize, voxInd.size)
+		gamSq[b0:b1] = searchBlock(padFlat, padInd[b0:b1], refVals[b0:b1], ddSq[b0:b1], shells, dta)
+
+	blocks = range(0, voxInd.size, blockSize)
+	if nThreads > 1 and len(blocks) > 1:
+		pool = ThreadPool(min(nThreads, len(blocks)))
+		try:
+			pool.map(runBlock, blocks)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		for b0 in blocks:
+			runBlock(b0)
+
+	gam = np.empty(refDose.shape, dtype='float32')
+	gam.fill(np.nan)
+	gam.ravel()[voxInd] = np.sqrt(gamSq)
+
+	return gam
+
+# ----------------------------------------- #
+
+def searchOffsets(voxSize, dta, searchStep, maxGamma):
+	"""
+	Return the search offsets within the search radius in voxel units, grouped into shells
+	of equal distance in increasing order as a list of (distance^2 / dta^2, [offsets]),
+	and the margin in voxels needed around the volume for every offset to stay inside it.
+	"""
+	radius = maxGamma * dta
+	nSteps = int(np.floor(radius / searchStep))
+	steps = np.arange(-nSteps, nSteps+1) * searchStep
+
+	oz, oy, ox = np.meshgrid(steps, steps, steps, indexing='ij')
+	distSq = oz.ravel()**2 + oy.ravel()**2 + ox.ravel()**2
+	inside = distSq <= radius**2 + 1.0e-9
+
+	distSq = np.round(distSq[inside] / dta**2, 9)
+	offs = np.column_stack((oz.ravel()[inside], oy.ravel()[inside], ox.ravel()[inside])) / voxSize
+
+	order = np.argsort(distSq, kind='mergesort')
+	distSq = distSq[order]
+	offs = offs[order]
+
+	shells = []
+	starts = np.concatenate(([0], np.flatnonzero(np.diff(distSq)) + 1, [distSq.size]))
+	for s0, s1 in zip(starts[:-1], starts[1:]):
+		shells.append( (distSq[s0], list(offs[s0:s1])) )
+
+	margin = [ int(np.ceil(radius / vs)) + 1 for vs in voxSize ]
+
+	return shells, margin
+
+# ----------------------------------------- #
+
+def searchBlock(padFlat, padInd, refVals, ddSq, shells, dta):
+	"""
+	Search a block of reference voxels shell by shell and return gamma^2 for each voxel.
+	Voxels are dropped from the search once their best gamma^2 is no larger than the
+	distance term of the next shell.
+	"""
+	best = np.empty(padInd.size)
+	best.fill(np.inf)
+
+	active = np.arange(padInd.size)
+	curInd = padInd
+	curRef = refVals
+	curDD = ddSq
+	curBest = best.copy()
+
+	for sInd, (distSq, shellOffs) in enumerate(shells):
+		for corners in shellOffs:
+			evalVals = padFlat[curInd + corners[0][0]] * corners[0][1]
+			for cOff, cWt in corners[1:]:
+				evalVals += padFlat[curInd + cOff] * cWt
+
+			gSq = distSq + (evalVals - curRef) ** 2 / curDD
+			np.fmin(curBest, gSq, out=curBest)
+
+		# Early termination, voxels that can't improve on the next shell are finished
+		if sInd + 1 < len(shells):
+			finished = curBest <= shells[sInd+1][0]
+			if finished.any():
+				best[active[finished]] = curBest[finished]
+				keep = ~finished
+				active = active[keep]
+				curInd = curInd[keep]
+				curRef = curRef[keep]
+				curDD = curDD[keep]
+				curBest = curBest[keep]
+				if active.size == 0:
+					break
+
+	best[active] = curBest
+
+	return best
+
+# ----------------------------------------- #
+
+def gammaPassRate(gam, threshold=1.0):
+	"""
+	Return the percentage of evaluated voxels with gamma index no larger than threshold.
+	"""
+	evaluated = ~np.isnan(gam)
+	if not evaluated.any():
+		return 0.0
+	return 100.0 * np.count_nonzero(gam[evaluated] <= threshold) / np.count_nonzero(evaluated)
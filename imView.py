@@ -4,8 +4,33 @@ from matplotlib import pylab
 from matplotlib import widgets
 from matplotlib import pyplot
 from matplotlib import cm
+from matplotlib.transforms import Bbox
+from matplotlib.colors import Normalize, colorConverter
+from matplotlib.collections import LineCollection
 
 import numpy as np
+import threading, time
+from collections import OrderedDict, deque
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+import resample
+
+# Timer used for the viewer statistics, time.time where python has no perf_counter
+perfClock = getattr(time, 'perf_counter', time.time)
+
+# Array axes of the rows and columns of a slice in each orientation
+PLANE_AXES = [ (1, 2), (0, 2), (0, 1) ]
+
+# Array axes reduced by each level of a volumePyramid, the axial plane
+DOWNSAMPLED_AXES = (1, 2)
+
+# Clinical display windows (width, level) in HU
+WINDOW_PRESETS = OrderedDict([ ('soft tissue', (400, 40)), ('lung', (1500, -600)), ('bone', (1800, 400)), \
+								('brain', (80, 40)), ('liver', (150, 30)), ('mediastinum', (350, 50)) ])
 
 # --------------------------------------- #
 
@@ -17,13 +42,17 @@ class slicesView():
 				startP=[0.0,0.0,0.0], voxSize=[1.0,1.0,1.0], cmap=cm.bone, \
 				im1_data=-1, im1_startP=-1, im1_voxSize=-1, im1_cmap=-1, \
 				im2_data=-1, im2_startP=-1, im2_voxSize=-1, im2_cmap=-1, \
-				interpType='linear'):
+				interpType='linear', blit=True, prefetch=4, pyramid=True, window=None, windowOffset=0, \
+				rois=None, isodoseLevels=None, isodoseColors=None, stats=None, statsReadout=False):
 		"""
 		Create a GUI displaying the desired data in 3 orthogonal views.
 		The user can click to select a view and then press keys n and p to move between slices
-		and press keys a, s and c to switch between views.
+		and press keys a, s and c to switch between views. Dragging with the right mouse button
+		changes the window width (left / right) and level (up / down) of the first image and
+		key w steps through the WINDOW_PRESETS.
 		Arguments:
-			data	The data as a 3D numpy array to be displayed.
+			data	The data to be displayed, a 3D numpy array or anything indexed like one (e.g. a
+						memory map) or a sliceProvider.
 			figure	Plot axes in an existing figure along the right hand side
 						(default is to create a new figure window)
 			slices	A 3 element list of slice indices to initialize the 3 viewing axes
@@ -37,15 +66,38 @@ class slicesView():
 			
 		----------------------------------
 		When supplying two or three data arrays the following arguments replace the single data equivalents
-			im1_data	The data as a 3D numpy array to be displayed as the first imageset.
+			im1_data	The data to be displayed as the first imageset, as for data.
 			im1_startP	A 3 element list for the start position of im1_data
 			im1_voxSize	A 3 element list for the voxel size of im1_data
 			im1_cmap	A matplotlib colormap to be assigned to im1_data
 			
-			im2_data	The data as a 3D numpy array to be displayed as the second imageset.
+			im2_data	The data to be displayed as the second imageset, as for data.
 			im2_startP	A 3 element list for the start position of im2_data
 			im2_voxSize	A 3 element list for the voxel size of im2_data
 			im2_cmap	A matplotlib colormap to be assigned to im2_data
+		
+		----------------------------------
+			blit	Redraw only the slice images and axes borders that change, over a cached background,
+						when scrolling and selecting axes (default True). The images and borders are
+						animated artists so they are left out of savefig, use headless rendering for files.
+			prefetch	Number of slices ahead in the scrolling direction that are colour mapped and
+						interpolated by a background thread (default 4, 0 to prepare slices on demand)
+			pyramid	Display slices of the primary image downsampled by powers of 2 in the axial plane
+						when the axes are smaller on screen than the image (default True). The
+						downsampled slices are averaged when first needed and the recent ones kept.
+			window	Display window of the first image, the name of one of the WINDOW_PRESETS or a
+						(width, level) pair (default is the full range of the data)
+			windowOffset	Stored value of 0 HU added to the preset levels, e.g. 1000 for CT images
+						stored as CT numbers (default 0)
+			rois	Regions of interest whose contours are drawn over the first image, as read by
+						roi.readRois with the vertices in the (Z, Y, X) coordinates of the image
+						(see dose.doseOnCTImages and contourIndex)
+			isodoseLevels	Values of the second image drawn as contour lines, e.g. isodose levels
+						(default is none, see setIsodoseLevels)
+			isodoseColors	Colours of the isodose lines (default is spread over the jet colormap)
+			stats	Collect the timings of every displayed frame and of the stages preparing the slices,
+						True or a viewerStats to collect them in (default is not to, see setStats)
+			statsReadout	Show the frame rate and latency of the recent frames in the figure
 		"""
 		
 		# If we've been given a figure then use it otherwise make a new figure
@@ -75,6 +127,22 @@ class slicesView():
 		btmFigW = btmFigH
 		topFigW = btmFigW * 2.0 + midBrdrW
 		
+		self._blit = blit and hasattr(self._fig.canvas, 'copy_from_bbox')
+		self._prefetch = prefetch
+		self._usePyramid = pyramid
+		self._window = window
+		self._windowOffset = windowOffset
+		self._rois = rois
+		self._isodoseLevels = isodoseLevels
+		self._isodoseColors = isodoseColors
+		self._presetInd = -1
+		self._wlDrag = None
+		self._axBackground = [None, None, None]
+		self.stats = None
+		self._statsText = None
+		self._statsBackground = None
+		self._drawPending = None
+		
 		self.connect()
 		
 		self._ax = []
@@ -86,12 +154,16 @@ class slicesView():
 						im1_cmap, im2_data, im2_startP, im2_voxSize, im2_cmap, interpType)
 		
 		self.initializeImageSlices()
+		self.setStats(stats, statsReadout)
 		
 		self._widetAx = []
 		for aa in self._ax:
 			aa.get_xaxis().set_visible( False )
 			aa.get_yaxis().set_visible( False )
-			self._widetAx.append( widgets.Button(aa,'') )
+			# Same hover colour as the button colour so moving the mouse over an axes doesn't redraw the figure
+			self._widetAx.append( widgets.Button(aa,'',color='0.85',hovercolor='0.85') )
+			for brdr in aa.spines.values():
+				brdr.set_animated( self._blit )
 		
 		self._widetAx[0].on_clicked( self.clickAx1 )
 		self._widetAx[1].on_clicked( self.clickAx2 )
@@ -105,32 +177,176 @@ class slicesView():
 
 	# --------------------------------------- #
 	
-	def refreshIm(self, ax):
+	def refreshIm(self, ax, fullRedraw=False):
 		"""
 		Refresh the slice image in the desired axes.
+		Only the images of the axes are redrawn unless fullRedraw is set, which is needed when the
+		orientation, and so the shape of the axes, changes.
 		"""
-		
-		if self._axOrien[ax] == 0:		
-			self._im1_dispSlices[ax] = self._im1_data[ self._im1_slice[ax], :, : ]
+		frameStart = perfClock()
+		orien = self._axOrien[ax]
+		if orien == 0:		
 			self._ax[ax].set_aspect( self._im1_voxSize[1] / self._im1_voxSize[2] )
-		elif self._axOrien[ax] == 1:		
-			self._im1_dispSlices[ax] = self._im1_data[:,self._im1_slice[ax],:]
+		elif orien == 1:		
 			self._ax[ax].set_aspect( self._im1_voxSize[0] / self._im1_voxSize[2] )
 		else:		
-			self._im1_dispSlices[ax] = self._im1_data[:,:,self._im1_slice[ax]]
 			self._ax[ax].set_aspect( self._im1_voxSize[0] / self._im1_voxSize[1] )
 		
+		# Prepared slices come from the ring buffer when they have been prefetched
+		self._axLevel[ax] = self.chooseLevel(ax)
+		misses = self._sliceBuffer[ax].misses
+		self._im1_dispSlices[ax] = self._sliceBuffer[ax].get( self.sliceKey(ax, self._im1_slice[ax]) )
 		self._im1[ax].set_array(self._im1_dispSlices[ax])
+		prepared = perfClock()
 		
-		if self._plotIm2:
-			self._im2_slice[ax] = self.setSecondarySlice(
-										self._im2_axes, self._im2_data.shape, ax)
-			self._im2_dispSlices[ax] = self.interpSecondary(
-										self._im2_data, self._im2_slice, self._im2_voxSize, ax)
-			self._im2[ax].set_array(self._im2_dispSlices[ax])
+		if self._contours is not None:
+			segments, colors = self._contours.lines(orien, self._im1_slice[ax])
+			self._roiLines[ax].set_segments(segments)
+			self._roiLines[ax].set_color(colors)
+		
+		if self._isodose is not None:
+			segments, colors = self._isoBuffer[ax].get( self.isodoseKey(ax, self._im1_slice[ax]) )
+			self._isoLines[ax].set_segments(segments)
+			self._isoLines[ax].set_color(colors)
+		
+		lines = perfClock()
+		self.prefetchSlices(ax)
+		drawStart = perfClock()
+		
+		blitted = False
+		if fullRedraw:
+			self._im1[ax].set_extent(self._im1_extent[self._axOrien[ax]])
+			self._fig.canvas.draw_idle()
+		else:
+			blitted = self.blitAxes(ax)
+		
+		if self.stats is not None:
+			frameEnd = perfClock()
+			frame = self.stats.addFrame( {'ax':ax, 'orien':orien, 'index':self._im1_slice[ax], \
+						'level':self._axLevel[ax], 'buffered':self._sliceBuffer[ax].misses == misses, \
+						'prepare':prepared - frameStart, 'lines':lines - prepared, \
+						'draw':frameEnd - drawStart if blitted else None, 'latency':frameEnd - frameStart} )
+			# A full draw happens later in the gui event loop, onDraw completes the record when it ends
+			if not blitted:
+				self._drawPending = (frame, frameStart, drawStart)
+			self.showStats()
 		
 		#print('Ax %d - %s : %s' % (ax, str(self._ax[ax].get_aspect()), str(self._im1_voxSize)) )
-		pylab.show()
+	
+	# --------------------------------------- #
+	
+	def onDraw(self, event):
+		"""
+		After a full draw of the figure store the background of each axes, without the animated
+		slice images and borders, then draw them on top. The draw and latency of the frame waiting
+		for the draw are recorded.
+		"""
+		if self._drawPending is not None:
+			frame, frameStart, drawStart = self._drawPending
+			self._drawPending = None
+			if self.stats is not None:
+				drawEnd = perfClock()
+				self.stats.drawFrame(frame, drawEnd - drawStart, drawEnd - frameStart)
+		
+		if not self._blit:
+			return
+		
+		for ax in range(3):
+			self._axBackground[ax] = self._fig.canvas.copy_from_bbox( self.blitBox(ax) )
+			self.drawAxesArtists(ax)
+		
+		if self._statsText is not None:
+			self._statsBackground = self._fig.canvas.copy_from_bbox( self.statsBox() )
+			self._fig.draw_artist(self._statsText)
+	
+	# --------------------------------------- #
+	
+	def blitBox(self, ax):
+		"""
+		Return the region of the canvas redrawn for an axes, its bounding box plus the border line width.
+		"""
+		x0, y0, x1, y1 = self._ax[ax].bbox.extents
+		return Bbox.from_extents(x0 - 3, y0 - 3, x1 + 3, y1 + 3)
+	
+	# --------------------------------------- #
+	
+	def drawAxesArtists(self, ax):
+		"""
+		Draw the animated artists of an axes onto the canvas.
+		"""
+		self._ax[ax].draw_artist(self._im1[ax])
+		if self._isodose is not None:
+			self._ax[ax].draw_artist(self._isoLines[ax])
+		if self._contours is not None:
+			self._ax[ax].draw_artist(self._roiLines[ax])
+		for brdr in self._ax[ax].spines.values():
+			self._ax[ax].draw_artist(brdr)
+	
+	# --------------------------------------- #
+	
+	def blitAxes(self, ax):
+		"""
+		Redraw the slice images and borders of an axes over its stored background and update only
+		that part of the canvas. Falls back to a full redraw when there is no background yet.
+		Returns whether the axes were blitted.
+		"""
+		if not self._blit or self._axBackground[ax] is None:
+			self._fig.canvas.draw_idle()
+			return False
+		
+		self._fig.canvas.restore_region(self._axBackground[ax])
+		self.drawAxesArtists(ax)
+		self._fig.canvas.blit( self.blitBox(ax) )
+		return True
+	
+	# --------------------------------------- #
+	
+	def setStats(self, stats=True, readout=False):
+		"""
+		Start or stop collecting the timings of the viewer. stats is True for a new viewerStats, a
+		viewerStats to add to, e.g. one shared by several viewers, or None to stop. readout shows the
+		frame rate and latency in the bottom left corner of the figure.
+		"""
+		if stats is True or (stats is None and readout):
+			stats = viewerStats()
+		self.stats = stats or None
+		self._renderer.stats = self.stats
+		
+		if readout and self.stats is not None:
+			if self._statsText is None:
+				self._statsText = self._fig.text(0.01, 0.02, '', family='monospace', fontsize='small', \
+											verticalalignment='bottom', animated=self._blit)
+		elif self._statsText is not None:
+			self._statsText.remove()
+			self._statsText = None
+		self._statsBackground = None
+		self._fig.canvas.draw_idle()
+	
+	# --------------------------------------- #
+	
+	def statsBox(self):
+		"""
+		Return the region of the canvas under the statistics readout, the bottom of the left margin.
+		"""
+		x0, y0, x1, y1 = self._fig.bbox.extents
+		return Bbox.from_extents(x0, y0, x0 + 0.19 * (x1 - x0), y0 + 0.4 * (y1 - y0))
+	
+	# --------------------------------------- #
+	
+	def showStats(self):
+		"""
+		Update the statistics readout with the recent frames.
+		"""
+		if self._statsText is None:
+			return
+		self._statsText.set_text( self.stats.readout() )
+		
+		if self._blit and self._statsBackground is not None:
+			self._fig.canvas.restore_region(self._statsBackground)
+			self._fig.draw_artist(self._statsText)
+			self._fig.canvas.blit( self.statsBox() )
+		elif not self._blit:
+			self._fig.canvas.draw_idle()
 	
 	# --------------------------------------- #
 	
@@ -139,39 +355,63 @@ class slicesView():
 		Extract the slices to display and initialize the plot arrays
 		"""
 		
+		# Colour mapping and the overlay are done when slices are prepared, so the images display RGBA
+		# arrays. Downsampled primary images are shown in axes smaller on screen than the image.
+		if self._plotIm2:
+			self._renderer = sliceRenderer(self._im1_data, self._im1_axes, self._im1_cmap, \
+								self._im2_data, self._im2_axes, self._im2_cmap, self._imInterpType, \
+								self._window, self._windowOffset, self._usePyramid)
+		else:
+			self._renderer = sliceRenderer(self._im1_data, self._im1_axes, self._im1_cmap, \
+								interpType=self._imInterpType, window=self._window, \
+								windowOffset=self._windowOffset, pyramid=self._usePyramid)
+		self._pyramid = self._renderer.pyramid
+		self._axLevel = [ 0, 0, 0 ]
+		self._axLevel = [ self.chooseLevel(ax) for ax in range(3) ]
+		
+		self._scrollDir = [1, 1, 1]
+		self._sliceBuffer = [ sliceBuffer(self._renderer.prepareSlice, 2 * self._prefetch + 2, self._prefetch > 0) \
+								for ax in range(3) ]
+		
 		self._im1_dispSlices = []		
 		self._im1 = [] 
 		
+		# The secondary image is resampled onto the primary pixels and composited with it, so each
+		# axes shows a single image
 		for ax in range(3):
-			if self._axOrien[ax] == 0:		
-				self._im1_dispSlices.append( self._im1_data[ self._im1_slice[ax], :, : ] )
-			elif self._axOrien[ax] == 1:
-				self._im1_dispSlices.append( self._im1_data[ :, self._im1_slice[ax], : ] )
-			else:
-				self._im1_dispSlices.append( self._im1_data[ :, :, self._im1_slice[ax] ] )
-			
 			self._ax[ax].hold(True)
-			self._im1.append( self._ax[ax].imshow( self._im1_dispSlices[ax], cmap = self._im1_cmap, \
-					vmax=self._im1_max, vmin=self._im1_min ))  
+			self._im1_dispSlices.append( self._sliceBuffer[ax].get( self.sliceKey(ax, self._im1_slice[ax]) ) )
+			self._im1.append( self._ax[ax].imshow( self._im1_dispSlices[ax], animated=self._blit ))  
 			self._im1[-1].set_extent(self._im1_extent[self._axOrien[ax]])
 		
-		if self._plotIm2:
-			self._im2_slice = np.zeros(3)
-			self._im2_dispSlices = []
-			self._im2 = []
-			
-			if ax == 0:
-				self._fig.colorbar(self._im2[ax], self._ax[ax])
-
+		# Roi contours are line collections over the images, their lines are cached per slice
+		self._contours = None
+		if self._rois is not None:
+			self._contours = contourIndex(self._rois, self._im1_axes)
+			self._roiLines = []
 			for ax in range(3):
-				self._im2_slice[ax] = self.setSecondarySlice(
-										self._im2_axes, self._im2_data.shape, ax)
-				self._im2_dispSlices.append( self.interpSecondary(
-										self._im2_data, self._im2_slice, self._im2_voxSize, ax) )
-				self._im2.append( self._ax[ax].imshow(self._im2_dispSlices[ax], cmap = self._im2_cmap, \
-						vmax=self._im2_max, vmin=self._im2_min ))
-				self._im2[-1].set_extent(self._im2_extent[self._axOrien[ax]])
+				self._roiLines.append( LineCollection([], linewidths=1.0, animated=self._blit) )
+				self._ax[ax].add_collection(self._roiLines[ax], autolim=False)
 		
+		self._isodose = None
+		if self._plotIm2 and self._isodoseLevels:
+			self.initializeIsodose(self._isodoseLevels, self._isodoseColors)
+		
+	# --------------------------------------- #
+	
+	def initializeIsodose(self, levels, colors=None):
+		"""
+		Set up the isodose lines, which are prepared and prefetched like the slices in their own buffers.
+		Only done once there are levels to draw, so a viewer without them starts no extra threads.
+		"""
+		self._isodose = isodoseLines(self._im2_data, self._im2_axes, self._im1_axes, levels, colors)
+		self._isoBuffer = [ sliceBuffer(self._isodose.compute, 2 * self._prefetch + 2, self._prefetch > 0) \
+								for ax in range(3) ]
+		self._isoLines = []
+		for ax in range(3):
+			self._isoLines.append( LineCollection([], linewidths=1.0, animated=self._blit) )
+			self._ax[ax].add_collection(self._isoLines[ax], autolim=False)
+	
 	# --------------------------------------- #
 	
 	def processArguments(self, data, slices, startP, voxSize, cmap, im1_data, im1_startP, \
@@ -183,12 +423,12 @@ class slicesView():
 		self._imInterpType = interpType
 		
 		if type(im1_data) is int:
-			self._im1_data = data
+			self._im1_data = asProvider(data)
 			self._im1_voxSize = voxSize
 			self._im1_startP = startP
 			self._im1_cmap = cmap
 		else:
-			self._im1_data = im1_data
+			self._im1_data = asProvider(im1_data)
 			if type(im1_startP) is int:
 				self._im1_startP = startP
 			else:
@@ -204,11 +444,9 @@ class slicesView():
 			else:
 				self._im1_cmap = im1_cmap
 			
-			self._im1_max = self._im1_data.max()
-			self._im1_min = self._im1_data.min()
 
 			if not (type(im2_data) is int):
-				self._im2_data = im2_data
+				self._im2_data = asProvider(im2_data)
 				self._plotIm2 = True
 				if type(im2_startP) is int:
 					self._im2_startP = im1_startP
@@ -224,9 +462,6 @@ class slicesView():
 					self._im2_cmap = im1_cmap
 				else:
 					self._im2_cmap = im2_cmap
-				
-				self._im2_max = self._im2_data.max()
-				self._im2_min = self._im2_data.min()
 
 		# If arguments specify slice indices then use them otherwise set as centre of image
 		self._im1_slice = np.zeros(3,dtype='int16')		
@@ -242,15 +477,10 @@ class slicesView():
 		self._axOrien = np.arange(3, dtype='int16')
 		
 		self._im1_axes = self.setImageAxes(self._im1_data.shape, self._im1_voxSize, self._im1_startP)
-		self._im1_extent = [ 	[ self._im1_axes[2][0], self._im1_axes[2][-1], self._im1_axes[1][0], self._im1_axes[1][-1] ], \
-								[ self._im1_axes[2][0], self._im1_axes[2][-1], self._im1_axes[0][0], self._im1_axes[0][-1] ], \
-								[ self._im1_axes[1][0], self._im1_axes[1][-1], self._im1_axes[0][0], self._im1_axes[0][-1] ] ]
+		self._im1_extent = imageExtents(self._im1_axes)
 		
 		if self._plotIm2:
 			self._im2_axes = self.setImageAxes(self._im2_data.shape, self._im2_voxSize, self._im2_startP)
-			self._im2_extent = [ 	[ self._im2_axes[2][0], self._im2_axes[2][-1], self._im2_axes[1][0], self._im2_axes[1][-1] ], \
-									[ self._im2_axes[2][0], self._im2_axes[2][-1], self._im2_axes[0][0], self._im2_axes[0][-1] ], \
-									[ self._im2_axes[1][0], self._im2_axes[1][-1], self._im2_axes[0][0], self._im2_axes[0][-1] ] ]
 			
 	# --------------------------------------- #
 	
@@ -258,96 +488,194 @@ class slicesView():
 		"""
 		Calculate the x, y and z axes as numpy ranges.
 		"""
-		im_ax0 = np.arange(imData_shape[0]) * im_voxSize[0] + im_startP[0]
-		im_ax1 = np.arange(imData_shape[1]) * im_voxSize[1] + im_startP[1]
-		im_ax2 = np.arange(imData_shape[2]) * im_voxSize[2] + im_startP[2]
+		return imageAxes(imData_shape, im_voxSize, im_startP)
 		
-		im_axes = [im_ax0, im_ax1, im_ax2]
+	# --------------------------------------- #
+	
+	def setWindow(self, window):
+		"""
+		Change the display window of the primary image, a preset name or a (width, level) pair.
+		Only the window table is rebuilt, the prepared slices are dropped and the axes redrawn.
+		"""
+		self._renderer.setWindow(window)
+		for ax in range(3):
+			self._sliceBuffer[ax].clear()
+			self.refreshIm(ax)
+	
+	# --------------------------------------- #
+	
+	def nextWindowPreset(self):
+		"""
+		Change the display window to the next of the WINDOW_PRESETS.
+		"""
+		names = list(WINDOW_PRESETS.keys())
+		self._presetInd = (self._presetInd + 1) % len(names)
+		self.setWindow(names[self._presetInd])
+	
+	# --------------------------------------- #
+	
+	def windowPress(self, event):
+		"""
+		Start changing the window with a right button drag.
+		"""
+		if event.button == 3 and event.inaxes in self._ax:
+			self._wlDrag = (event.x, event.y, self._renderer.window[0], self._renderer.window[1])
+	
+	# --------------------------------------- #
+	
+	def windowDrag(self, event):
+		"""
+		Change the window width with horizontal and the level with vertical movement of the mouse,
+		by the window width every 256 screen pixels.
+		"""
+		if self._wlDrag is None or event.x is None:
+			return
+		x0, y0, width, level = self._wlDrag
+		scale = width / 256.0
+		self.setWindow( (max(width + (event.x - x0) * scale, 1.0), level + (event.y - y0) * scale) )
+	
+	# --------------------------------------- #
+	
+	def windowRelease(self, event):
+		"""
+		Finish changing the window.
+		"""
+		if event.button == 3:
+			self._wlDrag = None
+	
+	# --------------------------------------- #
+	
+	def prefetchSlices(self, ax):
+		"""
+		Queue the next slices in the scrolling direction of an axes to be prepared in the background.
+		"""
+		if self._prefetch <= 0:
+			return
+		orien = self._axOrien[ax]
+		index = self._im1_slice[ax]
+		nSlices = self._im1_data.shape[orien]
+		step = self._scrollDir[ax]
 		
-		return im_axes
+		# Neighbouring slices can share a plane of a downsampled level
+		keys = []
+		curKey = self.sliceKey(ax, index)
+		for nn in range(1, self._prefetch + 1):
+			if 0 <= index + step * nn < nSlices:
+				key = self.sliceKey(ax, index + step * nn)
+				if key != curKey and key not in keys:
+					keys.append(key)
+		self._sliceBuffer[ax].prefetch(keys)
 		
+		if self._isodose is not None and len(self._isodose.levels) > 0:
+			self._isoBuffer[ax].prefetch( [ self.isodoseKey(ax, index + step * nn) \
+				for nn in range(1, self._prefetch + 1) if 0 <= index + step * nn < nSlices ] )
+	
 	# --------------------------------------- #
 	
-	def setSecondarySlice(self, im_axes, imData_shape, ax):
+	def isodoseKey(self, ax, index):
 		"""
-		Calculate slice indices of a secondary image to be overlaid on the current primary slices. 
+		Return the (orientation, index, levels) of the isodose lines of slice index of an axes.
 		"""
-		if self._axOrien[ax] == 0:
-			im_slice = np.interp(self._im1_axes[0][self._im1_slice[ax]], im_axes[0], np.arange(imData_shape[0]))
-		elif self._axOrien[ax] == 1:
-			im_slice = np.interp(self._im1_axes[1][self._im1_slice[ax]], im_axes[1], np.arange(imData_shape[1]))
-		else:
-			im_slice = np.interp(self._im1_axes[2][self._im1_slice[ax]], im_axes[2], np.arange(imData_shape[2]))
-		
-		return im_slice		
+		return (self._axOrien[ax], index, self._isodose.levels)
 	
 	# --------------------------------------- #
 	
-	def interpSecondary(self, imData, imSlice, voxSize, ax):
+	def setIsodoseLevels(self, levels, colors=None):
 		"""
-		Interpolate a set of image slices at the required positions 
-		"""		
-		if self._imInterpType == 'linear':
-			return self.interpSecondaryNearNeighbour(imData, imSlice, voxSize, ax)
-		elif self._imInterpType == 'neighbour':
-			return self.interpSecondaryLinear(imData, imSlice, voxSize, ax)
+		Change the isodose levels drawn over the slices. Lines already computed for other levels are
+		left in the buffers and dropped as new ones are added.
+		"""
+		if not self._plotIm2:
+			raise InvalidArgumentsException("Isodose lines need a second image")
+		if self._isodose is None:
+			self.initializeIsodose(levels, colors)
 		else:
-			raise InvalidArgumentsException("Unrecognized interpolation type : %s" \
-					% str(self._imInterpType) )
-
+			self._isodose.setLevels(levels, colors)
+		for ax in range(3):
+			self.refreshIm(ax)
+	
 	# --------------------------------------- #
 	
-	def interpSecondaryLinear(self, imData, imSlice, voxSize, ax):			
+	def sliceKey(self, ax, index):
 		"""
-		Interpolate a set of image slices at the required positions 
-		using linear interpolation.
+		Return the (orientation, index, level) of the prepared slice showing slice index of the primary
+		image in an axes, at the pyramid level of the axes.
 		"""
-		slice_flr = np.floor(imSlice[ax])
-				
-		if self._axOrien[ax] == 0:
-			wt1 = ( imSlice[ax] - slice_flr ) / voxSize[0]
-			wt0 = 1.0 - wt1
-			dispSlice = imData[int(slice_flr),:,:] * wt0 + imData[int(slice_flr+1),:,:] * wt1
-		elif self._axOrien[0] == 1:
-			wt1 = ( imSlice[ax] - slice_flr ) / voxSize[1]
-			wt0 = 1.0 - wt1
-			dispSlice = imData[:,int(slice_flr),:] * wt0 + imData[:,int(slice_flr+1),:] * wt1
-		else:
-			wt1 = ( imSlice[ax] - slice_flr ) / voxSize[2]
-			wt0 = 1.0 - wt1
-			dispSlice = imData[:,:,int(slice_flr)] * wt0 + imData[:,:,int(slice_flr+1)] * wt1
-		
-		return dispSlice
-
+		orien = self._axOrien[ax]
+		level = self._axLevel[ax]
+		return (orien, self._pyramid.levelIndex(orien, index, level), level)
+	
 	# --------------------------------------- #
 	
-	def interpSecondaryNearNeighbour(self, imData, imSlice, voxSize, ax):			
+	def chooseLevel(self, ax):
 		"""
-		Interpolate a set of image slices at the required positions
-		using nearest neighbour interpolation.
+		Return the coarsest pyramid level that still has at least one pixel per screen pixel of an axes,
+		along the downsampled axes of its slices.
 		"""
-		slice_rnd = np.int16(imSlice[ax]+0.5)
+		x0, y0, x1, y1 = self._ax[ax].bbox.extents
+		rowAx, colAx = PLANE_AXES[self._axOrien[ax]]
 		
-		if self._axOrien[ax] == 0:
-			dispSlice = imData[slice_rnd,:,:]
-		elif self._axOrien[ax] == 1:
-			dispSlice = imData[:,slice_rnd,:]
-		else:
-			dispSlice = imData[:,:,slice_rnd]
-				
-		return dispSlice
+		level = 0
+		while level < self._pyramid.maxLevel:
+			shape = self._pyramid.shape(level + 1)
+			if (rowAx in DOWNSAMPLED_AXES and shape[rowAx] < y1 - y0) or \
+			   (colAx in DOWNSAMPLED_AXES and shape[colAx] < x1 - x0):
+				break
+			level += 1
 		
+		return level
+	
+	# --------------------------------------- #
+	
+	def onClose(self, event):
+		"""
+		The figure has been closed so stop the prefetch threads, which would otherwise keep the volumes
+		in memory.
+		"""
+		self.close()
+	
+	# --------------------------------------- #
+	
+	def close(self):
+		"""
+		Stop preparing slices in the background and empty the buffers.
+		"""
+		for buf in self._sliceBuffer + (self._isoBuffer if self._isodose is not None else []):
+			buf.close()
+	
+	# --------------------------------------- #
+	
+	def onResize(self, event):
+		"""
+		The figure has been resized so show the pyramid level matching the new size of each axes.
+		"""
+		for ax in range(3):
+			if self.chooseLevel(ax) != self._axLevel[ax]:
+				self.refreshIm(ax, fullRedraw=True)
+	
 	# --------------------------------------- #
 
 	def connect(self):		
 		'connect to all the events we need'
 		self._evkp = self._fig.canvas.mpl_connect('key_press_event', self.keyPress)
+		self._evdr = self._fig.canvas.mpl_connect('draw_event', self.onDraw)
+		self._evrs = self._fig.canvas.mpl_connect('resize_event', self.onResize)
+		self._evbp = self._fig.canvas.mpl_connect('button_press_event', self.windowPress)
+		self._evmm = self._fig.canvas.mpl_connect('motion_notify_event', self.windowDrag)
+		self._evbr = self._fig.canvas.mpl_connect('button_release_event', self.windowRelease)
+		self._evcl = self._fig.canvas.mpl_connect('close_event', self.onClose)
 	
 	# --------------------------------------- #
 
 	def disconnect(self):
 		'disconnect all the stored connection ids'
-		self._ax1.figure.canvas.mpl_disconnect(self._evkp)
+		self._fig.canvas.mpl_disconnect(self._evkp)
+		self._fig.canvas.mpl_disconnect(self._evdr)
+		self._fig.canvas.mpl_disconnect(self._evrs)
+		self._fig.canvas.mpl_disconnect(self._evbp)
+		self._fig.canvas.mpl_disconnect(self._evmm)
+		self._fig.canvas.mpl_disconnect(self._evbr)
+		self._fig.canvas.mpl_disconnect(self._evcl)
 			
 	# --------------------------------------- #
 		
@@ -355,14 +683,7 @@ class slicesView():
 		"""
 		First axes has been clicked so indicate it as the selected axes.
 		"""
-		self._curAx = 0
-		[brdr.set_linewidth(2.0) for brdr in self._ax[0].spines.itervalues()]
-		[brdr.set_linewidth(0.1) for brdr in self._ax[1].spines.itervalues()]
-		[brdr.set_linewidth(0.1) for brdr in self._ax[2].spines.itervalues()]
-		[brdr.set_color('white') for brdr in self._ax[0].spines.itervalues()]
-		[brdr.set_color('black') for brdr in self._ax[1].spines.itervalues()]
-		[brdr.set_color('black') for brdr in self._ax[2].spines.itervalues()]
-		pylab.show()
+		self.selectAx(0)
 		
 	# --------------------------------------- #
 
@@ -370,14 +691,7 @@ class slicesView():
 		"""
 		Second axes has been clicked so indicate it as the selected axes.
 		"""
-		self._curAx = 1		
-		[brdr.set_linewidth(2.0) for brdr in self._ax[1].spines.itervalues()]
-		[brdr.set_linewidth(0.1) for brdr in self._ax[0].spines.itervalues()]
-		[brdr.set_linewidth(0.1) for brdr in self._ax[2].spines.itervalues()]
-		[brdr.set_color('white') for brdr in self._ax[1].spines.itervalues()]
-		[brdr.set_color('black') for brdr in self._ax[0].spines.itervalues()]
-		[brdr.set_color('black') for brdr in self._ax[2].spines.itervalues()]
-		pylab.show()
+		self.selectAx(1)
 		
 	# --------------------------------------- #
 	
@@ -385,14 +699,25 @@ class slicesView():
 		"""
 		Third axes has been clicked so indicate it as the selected axes.
 		"""
-		self._curAx = 2		
-		[brdr.set_linewidth(2.0) for brdr in self._ax[2].spines.itervalues()]
-		[brdr.set_linewidth(0.1) for brdr in self._ax[0].spines.itervalues()]
-		[brdr.set_linewidth(0.1) for brdr in self._ax[1].spines.itervalues()]
-		[brdr.set_color('white') for brdr in self._ax[2].spines.itervalues()]
-		[brdr.set_color('black') for brdr in self._ax[0].spines.itervalues()]
-		[brdr.set_color('black') for brdr in self._ax[1].spines.itervalues()]
-		pylab.show()
+		self.selectAx(2)
+		
+	# --------------------------------------- #
+	
+	def selectAx(self, curAx):
+		"""
+		Highlight the border of the selected axes. Only the axes whose borders change are redrawn.
+		"""
+		prevAx = getattr(self, '_curAx', None)
+		self._curAx = curAx
+		
+		for ax in range(3):
+			for brdr in self._ax[ax].spines.values():
+				brdr.set_linewidth(2.0 if ax == curAx else 0.1)
+				brdr.set_color('white' if ax == curAx else 'black')
+		
+		for ax in set([prevAx, curAx]):
+			if ax is not None:
+				self.blitAxes(ax)
 		
 	# --------------------------------------- #
 	
@@ -401,20 +726,22 @@ class slicesView():
 		Respond to a keyboard button
 		"""
 		#print("Key %s has been pressed on axes %d" % (event.key, self._curAx))
-		if event.key is 'n':
+		if event.key == 'n':
 			self.nextIm()
-		elif event.key is 'p':
+		elif event.key == 'p':
 			self.prevIm()
-		elif event.key is 'up':
+		elif event.key == 'up':
 			self.prevIm()
-		elif event.key is 'down':
+		elif event.key == 'down':
 			self.nextIm()
-		elif event.key is 'a':
+		elif event.key == 'a':
 			self.axToAxial()
-		elif event.key is 's':
+		elif event.key == 's':
 			self.axToSag()
-		elif event.key is 'c':
+		elif event.key == 'c':
 			self.axToCoron()
+		elif event.key == 'w':
+			self.nextWindowPreset()
 		
 	# --------------------------------------- #
 	
@@ -422,7 +749,9 @@ class slicesView():
 		"""
 		Move image in current axes to next slice.
 		"""
-		self._im1_slice[self._curAx] += 1
+		if self._im1_slice[self._curAx] < self._im1_data.shape[self._axOrien[self._curAx]] - 1:
+			self._im1_slice[self._curAx] += 1
+		self._scrollDir[self._curAx] = 1
 		self.refreshIm(self._curAx)
 		
 	# --------------------------------------- #
@@ -431,7 +760,9 @@ class slicesView():
 		"""
 		Move image in current axes to next slice.
 		"""
-		self._im1_slice[self._curAx] -= 1
+		if self._im1_slice[self._curAx] > 0:
+			self._im1_slice[self._curAx] -= 1
+		self._scrollDir[self._curAx] = -1
 		self.refreshIm(self._curAx)
 		
 	# --------------------------------------- #
@@ -444,7 +775,7 @@ class slicesView():
 			self._axOrien[self._curAx] = 0
 			self._im1_slice[self._curAx] = self._im1_data.shape[0] / 2
 			self._ax[self._curAx].set_aspect( self._im1_voxSize[1] / self._im1_voxSize[2] )
-			self.refreshIm(self._curAx)
+			self.refreshIm(self._curAx, fullRedraw=True)
 		
 	# --------------------------------------- #
 	
@@ -456,7 +787,7 @@ class slicesView():
 			self._axOrien[self._curAx] = 2
 			self._im1_slice[self._curAx] = self._im1_data.shape[2] / 2
 			self._ax[self._curAx].set_aspect( self._im1_voxSize[0] / self._im1_voxSize[1] )
-			self.refreshIm(self._curAx)
+			self.refreshIm(self._curAx, fullRedraw=True)
 		
 	# --------------------------------------- #
 	
@@ -468,7 +799,7 @@ class slicesView():
 			self._axOrien[self._curAx] = 1
 			self._im1_slice[self._curAx] = self._im1_data.shape[1] / 2
 			self._ax[self._curAx].set_aspect( self._im1_voxSize[0] / self._im1_voxSize[2] )
-			self.refreshIm(self._curAx)
+			self.refreshIm(self._curAx, fullRedraw=True)
 		
 	# --------------------------------------- #
 		
@@ -478,6 +809,1059 @@ class slicesView():
 
 	# --------------------------------------- #
 
+def imageAxes(shape, voxSize, startP):
+	"""
+	Return the Z, Y and X axes of an image, the position of index i being startP + i * voxSize.
+	"""
+	return [ np.arange(shape[nn]) * voxSize[nn] + startP[nn] for nn in range(3) ]
+
+# --------------------------------------- #
+
+def imageExtents(axes):
+	"""
+	Return the imshow extent of the slices of an image in each orientation.
+	"""
+	return [ [ axes[2][0], axes[2][-1], axes[1][0], axes[1][-1] ], \
+			[ axes[2][0], axes[2][-1], axes[0][0], axes[0][-1] ], \
+			[ axes[1][0], axes[1][-1], axes[0][0], axes[0][-1] ] ]
+
+# --------------------------------------- #
+
+def displayCoords(axis, coords, vertical=False):
+	"""
+	Convert coordinates along an image axis to the display coordinates of slice images placed by
+	imageExtents. imshow stretches the pixels over the extent and puts the first row at the top.
+	"""
+	axis = np.asarray(axis, dtype='float64')
+	step = axis[1] - axis[0] if axis.size > 1 else 1.0
+	pixel = (axis[-1] - axis[0]) / axis.size
+	pos = ( (np.asarray(coords) - axis[0]) / step + 0.5 ) * pixel
+	if vertical:
+		return axis[-1] - pos
+	return axis[0] + pos
+
+# --------------------------------------- #
+
+def planeOf(data, orien, index):
+	"""
+	Return slice index of a 3D array in orientation orien (0 axial, 1 coronal, 2 sagittal).
+	"""
+	if orien == 0:
+		return data[ index, :, : ]
+	elif orien == 1:
+		return data[ :, index, : ]
+	return data[ :, :, index ]
+
+# --------------------------------------- #
+
+class sliceRenderer():
+	"""
+	Prepares the RGBA slices of a primary image, with a secondary image resampled onto its pixels and
+	composited over it, for the slicesView gui and for headless rendering (see render.py) so both show
+	the same window, colour maps and resampling. Nothing here depends on a figure or backend.
+	"""
+	def __init__(self, im1_data, im1_axes, im1_cmap, im2_data=None, im2_axes=None, im2_cmap=None, \
+				interpType='linear', window=None, windowOffset=0, pyramid=True):
+		"""
+		Arguments:
+			im1_data		The primary image, a sliceProvider or an array (see asProvider)
+			im1_axes		The Z, Y and X axes of the primary image (see imageAxes)
+			im1_cmap		A matplotlib colormap for the primary image
+			im2_data		The secondary image overlaid on the primary (default is none)
+			im2_axes		The Z, Y and X axes of the secondary image
+			im2_cmap		A matplotlib colormap for the secondary image, its alpha sets the blending
+			interpType		Resampling of the secondary image, 'linear' or 'neighbour'
+			window			Display window of the primary image (see slicesView)
+			windowOffset	Stored value of 0 HU added to the preset levels
+			pyramid			Build downsampled levels of the primary image (see volumePyramid)
+		"""
+		self._im1_data = asProvider(im1_data)
+		self._im1_cmap = im1_cmap
+		self._imInterpType = interpType
+		self._windowOffset = windowOffset
+		
+		self.stats = None
+		
+		self._plotIm2 = im2_data is not None
+		if self._plotIm2:
+			self._im2_data = asProvider(im2_data)
+			self._im2_axes = im2_axes
+			self._im2_weights = {}
+			im2_min, im2_max = self._im2_data.valueRange()
+			self._im2_mapper = cm.ScalarMappable( Normalize(vmin=im2_min, vmax=im2_max), im2_cmap )
+			self._im2_mapper.to_rgba( np.zeros((1,1)) )
+		
+		self.pyramid = volumePyramid(self._im1_data, im1_axes, maxLevel=None if pyramid else 0)
+		self.setWindow(window)
+	
+	# --------------------------------------- #
+	
+	def secondaryWeights(self, orien, index, level=0):
+		"""
+		Return the interpolation tables from the secondary image onto the pixels of slice index of the
+		primary image in orientation orien, at a level of the primary pyramid, for the slice axis and the
+		row and column axes of the slice (see resample.axisWeights). The row and column tables are
+		calculated once per orientation and level.
+		"""
+		im1_axes = self.pyramid.axes(level)
+		rowAx, colAx = PLANE_AXES[orien]
+		if (orien, level) not in self._im2_weights:
+			self._im2_weights[(orien, level)] = ( resample.axisWeights(self._im2_axes[rowAx], im1_axes[rowAx]), \
+												resample.axisWeights(self._im2_axes[colAx], im1_axes[colAx]) )
+		rowWts, colWts = self._im2_weights[(orien, level)]
+		
+		sliceWts = resample.axisWeights(self._im2_axes[orien], [ im1_axes[orien][index] ])
+		
+		return sliceWts, rowWts, colWts
+	
+	# --------------------------------------- #
+	
+	def interpSecondary(self, imData, orien, index, level=0):
+		"""
+		Resample the secondary image onto the pixel grid of slice index of the primary image in orientation
+		orien, at a level of the primary pyramid. Pixels outside the secondary image are NaN.
+		"""		
+		if self._imInterpType == 'linear':
+			return self.interpSecondaryLinear(imData, orien, index, level)
+		elif self._imInterpType == 'neighbour':
+			return self.interpSecondaryNearNeighbour(imData, orien, index, level)
+		else:
+			raise InvalidArgumentsException("Unrecognized interpolation type : %s" \
+					% str(self._imInterpType) )
+
+	# --------------------------------------- #
+	
+	def interpSecondaryLinear(self, imData, orien, index, level=0):			
+		"""
+		Resample the secondary image onto a primary slice using linear interpolation,
+		one axis at a time.
+		"""
+		(s0, s1, sWt, sIn), (r0, r1, rWt, rIn), (c0, c1, cWt, cIn) = self.secondaryWeights(orien, index, level)
+		
+		plane = np.asarray( imData.slice(orien, s0[0]), dtype='float64' )
+		if sWt[0] > 0.0:
+			plane = plane * (1.0 - sWt[0]) + imData.slice(orien, s1[0]) * sWt[0]
+		
+		rows = plane[r0] * (1.0 - rWt)[:,np.newaxis] + plane[r1] * rWt[:,np.newaxis]
+		dispSlice = rows[:,c0] * (1.0 - cWt) + rows[:,c1] * cWt
+		
+		dispSlice[ ~(rIn[:,np.newaxis] & cIn[np.newaxis,:]) | ~sIn[0] ] = np.nan
+		
+		return dispSlice
+
+	# --------------------------------------- #
+	
+	def interpSecondaryNearNeighbour(self, imData, orien, index, level=0):			
+		"""
+		Resample the secondary image onto a primary slice using nearest neighbour interpolation.
+		"""
+		(s0, s1, sWt, sIn), (r0, r1, rWt, rIn), (c0, c1, cWt, cIn) = self.secondaryWeights(orien, index, level)
+		
+		plane = imData.slice(orien, s1[0] if sWt[0] >= 0.5 else s0[0])
+		rows = np.where(rWt >= 0.5, r1, r0)
+		cols = np.where(cWt >= 0.5, c1, c0)
+		
+		dispSlice = np.asarray( plane[np.ix_(rows, cols)], dtype='float64' )
+		dispSlice[ ~(rIn[:,np.newaxis] & cIn[np.newaxis,:]) | ~sIn[0] ] = np.nan
+				
+		return dispSlice
+		
+	# --------------------------------------- #
+	
+	def primarySlice(self, orien, index, level=0):
+		"""
+		Extract a slice of the primary image in orientation orien, at a level of the primary pyramid.
+		"""
+		return self.pyramid.level(level).slice(orien, index)
+	
+	# --------------------------------------- #
+	
+	def prepareSlice(self, orien, index, level=0):
+		"""
+		Return the colour mapped RGBA slice of the primary image, with the secondary image resampled
+		onto its pixels and composited over it if there is one, ready to be displayed for slice index
+		in orientation orien at a level of the primary pyramid. Called from the prefetch thread as well
+		as the gui. The time of each stage is added to stats when there is one.
+		"""
+		t0 = perfClock()
+		imSlice = self.primarySlice(orien, index, level)
+		t1 = perfClock()
+		rgba = self.mapPrimary(imSlice)
+		t2 = perfClock()
+		
+		stages = {'extract':t1 - t0, 'colour':t2 - t1}
+		if self._plotIm2:
+			im2_slice = self.interpSecondary(self._im2_data, orien, index, level)
+			t3 = perfClock()
+			im2_rgba = self._im2_mapper.to_rgba( np.ma.masked_invalid(im2_slice), bytes=True )
+			alpha = im2_rgba[:,:,3:] * (1.0 / 255.0)
+			rgba[:,:,:3] = rgba[:,:,:3] * (1.0 - alpha) + im2_rgba[:,:,:3] * alpha
+			stages['overlay'] = t3 - t2
+			stages['colour'] += perfClock() - t3
+		
+		if self.stats is not None:
+			self.stats.addStages(stages)
+		return rgba
+	
+	# --------------------------------------- #
+	
+	def mapPrimary(self, imSlice):
+		"""
+		Colour map a slice of the primary image to RGBA bytes, with a single lookup in the window table
+		for 8 and 16 bit integer images. The table is indexed by the bit pattern of the values so no
+		arithmetic is done on the slice. The pattern is read in the byte order of the slice itself, as
+		downsampled levels of a big endian image are native.
+		"""
+		if self._im1_table is not None:
+			imSlice = np.asarray(imSlice)
+			return np.take(self._im1_table, imSlice.view(imSlice.dtype.str.replace('i', 'u')), axis=0)
+		return self._im1_mapper.to_rgba( imSlice, bytes=True )
+	
+	# --------------------------------------- #
+	
+	def windowLevel(self, window):
+		"""
+		Return the (width, level) of a display window given as a preset name, a (width, level) pair or
+		None for the full range of the primary image.
+		"""
+		if window is None:
+			im1_min, im1_max = [ float(vv) for vv in self._im1_data.valueRange() ]
+			return max(im1_max - im1_min, 1.0e-6), (im1_max + im1_min) / 2.0
+		if window in WINDOW_PRESETS:
+			width, level = WINDOW_PRESETS[window]
+			return float(width), float(level + self._windowOffset)
+		try:
+			width, level = window
+		except (TypeError, ValueError):
+			raise InvalidArgumentsException("Unrecognized window : %s" % str(window))
+		return float(width), float(level)
+	
+	# --------------------------------------- #
+	
+	def setWindowTable(self, width, level):
+		"""
+		Build the colour mapping of the primary image for a display window. Images with 8 or 16 bit
+		integer values get a lookup table with an RGBA entry for every value, others are normalized
+		to the window as they are mapped.
+		"""
+		self.window = (width, level)
+		
+		dtype = self._im1_data.dtype
+		if dtype.kind in 'iu' and dtype.itemsize <= 2:
+			values = np.arange(2 ** (8 * dtype.itemsize)).astype('u%d' % dtype.itemsize)
+			if dtype.kind == 'i':
+				values = values.view('i%d' % dtype.itemsize)
+			normed = np.clip( (values - (level - width / 2.0)) / width, 0.0, 1.0 )
+			self._im1_table = self._im1_cmap(normed, bytes=True)
+		else:
+			self._im1_table = None
+			self._im1_mapper = cm.ScalarMappable( Normalize(vmin=level - width / 2.0, vmax=level + width / 2.0), \
+													self._im1_cmap )
+			self._im1_mapper.to_rgba( np.zeros((1,1)) )
+	
+	# --------------------------------------- #
+	
+	def setWindow(self, window):
+		"""
+		Change the display window of the primary image, a preset name, a (width, level) pair or None
+		for the full range of the image.
+		"""
+		self.setWindowTable( *self.windowLevel(window) )
+
+# --------------------------------------- #
+
+class sliceProvider():
+	"""
+	Source of the slices shown by slicesView. The viewer only asks a provider for the shape and type of
+	its volume, the range of its values and the (orientation, index) slices it displays, so a volume
+	doesn't need to be in memory, or to exist at all, until its slices are looked at. Providers for
+	other sources implement slice, the slices are asked for from the prefetch thread as well as the gui.
+	"""
+	def __init__(self, shape, dtype, valueRange=None, rangeSamples=9):
+		"""
+		Arguments:
+			shape			Shape (Z, Y, X) of the volume
+			dtype			Data type of the slices
+			valueRange		(min, max) of the values, used to colour map the slices (default is to estimate it
+								from rangeSamples evenly spaced axial slices the first time it is needed)
+			rangeSamples	Number of axial slices the value range is estimated from
+		"""
+		self.shape = tuple(shape)
+		self.ndim = 3
+		self.dtype = np.dtype(dtype)
+		self._valueRange = valueRange
+		self._rangeSamples = rangeSamples
+	
+	# --------------------------------------- #
+	
+	def slice(self, orien, index):
+		"""
+		Return slice index in orientation orien (0 axial, 1 coronal, 2 sagittal) as a 2D array.
+		"""
+		raise NotImplementedError
+	
+	# --------------------------------------- #
+	
+	def valueRange(self):
+		"""
+		Return the (min, max) of the values of the volume.
+		"""
+		if self._valueRange is None:
+			zInds = np.unique( np.linspace(0, self.shape[0] - 1, self._rangeSamples).round().astype(int) )
+			planes = [ self.slice(0, zz) for zz in zInds ]
+			self._valueRange = ( min(np.min(pp) for pp in planes), max(np.max(pp) for pp in planes) )
+		return self._valueRange
+
+# --------------------------------------- #
+
+class volumeProvider(sliceProvider):
+	"""
+	Provides the slices of anything indexed as a (Z, Y, X) array, e.g. a numpy array, a memory mapped
+	image (dose.readCT with mmap), an archive.chunkedVolume or a dose.beamDoseSum, which sums the beam
+	doses of a slice only when it is displayed. Only the slices displayed are read.
+	"""
+	def __init__(self, data, valueRange=None, rangeSamples=9):
+		"""
+		Arguments:
+			data			The volume
+			valueRange		(min, max) of the values (default is the exact range of an array in memory,
+								otherwise estimated, see sliceProvider, when it is first needed)
+			rangeSamples	Number of axial slices the value range is estimated from
+		"""
+		sliceProvider.__init__(self, data.shape, data.dtype, valueRange, rangeSamples)
+		self._data = data
+	
+	# --------------------------------------- #
+	
+	def valueRange(self):
+		"""
+		Return the (min, max) of the values of the volume, exact for an array in memory. Only
+		calculated when first asked for, which a viewer given a display window never does.
+		"""
+		if self._valueRange is None and type(self._data) is np.ndarray:
+			self._valueRange = ( self._data.min(), self._data.max() )
+		return sliceProvider.valueRange(self)
+	
+	# --------------------------------------- #
+	
+	def slice(self, orien, index):
+		"""
+		Return slice index in orientation orien (0 axial, 1 coronal, 2 sagittal) as a 2D array.
+		"""
+		return np.asarray( planeOf(self._data, orien, index) )
+
+# --------------------------------------- #
+
+def asProvider(data, valueRange=None):
+	"""
+	Return data as a sliceProvider, wrapping anything that isn't one already in a volumeProvider.
+	"""
+	if isinstance(data, sliceProvider):
+		return data
+	return volumeProvider(data, valueRange)
+
+# --------------------------------------- #
+
+class volumePyramid():
+	"""
+	Multi-resolution pyramid of a (Z, Y, X) volume. Each level halves the Y and X dimensions of the one
+	before by averaging blocks of 2x2 pixels, Z is kept so every axial slice can still be shown.
+	Levels are pyramidLevels, which downsample a slice from the level before only when it is asked
+	for, and their axes are calculated from those of the full resolution volume, so nothing is read
+	until a slice is displayed. At a downsampled level neighbouring coronal and sagittal slices share
+	a plane, as they are closer together than a pixel on screen.
+	"""
+	def __init__(self, data, axes, maxLevel=None, minSize=32, cacheSize=32):
+		"""
+		Arguments:
+			data		The full resolution volume, a sliceProvider or an array (see asProvider)
+			axes		The Z, Y and X axes of the volume (see slicesView.setImageAxes)
+			maxLevel	Coarsest level built (default is the last level with Y and X of at least minSize)
+			minSize		Smallest Y or X dimension of a level when maxLevel is not given
+			cacheSize	Number of downsampled slices kept by each level
+		"""
+		self._levels = [ asProvider(data) ]
+		self._axes = [ [ np.asarray(aa, dtype='float64') for aa in axes ] ]
+		self._cacheSize = cacheSize
+		self._lock = threading.Lock()
+		
+		if maxLevel is None:
+			maxLevel = 0
+			while min( self.shape(maxLevel + 1)[nn] for nn in DOWNSAMPLED_AXES ) >= minSize:
+				maxLevel += 1
+		self.maxLevel = maxLevel
+	
+	# --------------------------------------- #
+	
+	def shape(self, level):
+		"""
+		Return the shape of a level, without building it.
+		"""
+		shape = list(self._levels[0].shape)
+		for nn in DOWNSAMPLED_AXES:
+			shape[nn] = shape[nn] >> level
+		return tuple(shape)
+	
+	# --------------------------------------- #
+	
+	def levelIndex(self, orien, index, level):
+		"""
+		Return the index in a level of slice index of the full resolution volume in orientation orien.
+		"""
+		if orien not in DOWNSAMPLED_AXES:
+			return index
+		return min(index >> level, self.shape(level)[orien] - 1)
+	
+	# --------------------------------------- #
+	
+	def level(self, level):
+		"""
+		Return the sliceProvider of a level, adding it and any missing levels before it.
+		"""
+		with self._lock:
+			while len(self._levels) <= level:
+				self._levels.append( pyramidLevel(self._levels[-1], self._cacheSize) )
+			return self._levels[level]
+	
+	# --------------------------------------- #
+	
+	def axes(self, level):
+		"""
+		Return the Z, Y and X axes of a level, the centres of its averaged pixels.
+		"""
+		with self._lock:
+			while len(self._axes) <= level:
+				self._axes.append( [ halveAxis(aa) if nn in DOWNSAMPLED_AXES else aa \
+										for nn, aa in enumerate(self._axes[-1]) ] )
+			return self._axes[level]
+
+# --------------------------------------- #
+
+class pyramidLevel(sliceProvider):
+	"""
+	Level of a volumePyramid, the Y and X dimensions of the level before halved. A slice is averaged
+	from the slices of the level before the first time it is asked for and the most recent slices
+	are kept. Integer images are rounded and keep their type, in native byte order, so they can still
+	be displayed through a window table.
+	"""
+	def __init__(self, source, cacheSize=32):
+		"""
+		Arguments:
+			source		The sliceProvider of the level before
+			cacheSize	Number of slices kept
+		"""
+		dtype = source.dtype.newbyteorder('=') if source.dtype.kind in 'iu' else np.dtype('float32')
+		sliceProvider.__init__(self, (source.shape[0], source.shape[1] // 2, source.shape[2] // 2), dtype)
+		self._source = source
+		self._cacheSize = cacheSize
+		self._cache = OrderedDict()
+		self._lock = threading.Lock()
+	
+	# --------------------------------------- #
+	
+	def valueRange(self):
+		"""
+		Return the (min, max) of the values of the full resolution volume.
+		"""
+		return self._source.valueRange()
+	
+	# --------------------------------------- #
+	
+	def slice(self, orien, index):
+		"""
+		Return slice index in orientation orien (0 axial, 1 coronal, 2 sagittal) as a 2D array.
+		"""
+		key = (orien, index)
+		with self._lock:
+			if key in self._cache:
+				self._cache[key] = self._cache.pop(key)
+				return self._cache[key]
+		
+		plane = self.downsample(orien, index)
+		
+		with self._lock:
+			self._cache[key] = plane
+			while len(self._cache) > self._cacheSize:
+				self._cache.popitem(last=False)
+		return plane
+	
+	# --------------------------------------- #
+	
+	def downsample(self, orien, index):
+		"""
+		Average the 2x2 blocks of the level before making slice index in orientation orien, dropping
+		the last row or column when the dimension is odd. An axial slice comes from one axial slice
+		of the level before, coronal and sagittal slices from the two either side of the slice.
+		"""
+		if orien in DOWNSAMPLED_AXES:
+			plane = 0.5 * ( np.asarray(self._source.slice(orien, 2 * index), dtype='float32') + \
+							np.asarray(self._source.slice(orien, 2 * index + 1), dtype='float32') )
+			nCols = self.shape[PLANE_AXES[orien][1]]
+			plane = plane[:, :2*nCols].reshape((plane.shape[0], nCols, 2)).mean(axis=2)
+		else:
+			ny, nx = self.shape[1], self.shape[2]
+			plane = np.asarray( self._source.slice(orien, index)[:2*ny, :2*nx], dtype='float32' )
+			plane = plane.reshape((ny, 2, nx, 2)).mean(axis=(1, 3))
+		
+		if self.dtype.kind in 'iu':
+			plane = np.rint(plane)
+		return plane.astype(self.dtype)
+
+# --------------------------------------- #
+
+def halveAxis(axis):
+	"""
+	Return the centres of pairs of points of an axis, as downsampled by volumePyramid.
+	"""
+	n = axis.size // 2
+	return axis[:2*n].reshape((n, 2)).mean(axis=1)
+
+# --------------------------------------- #
+
+class contourIndex():
+	"""
+	Contours of regions of interest drawn over the slices of an image. Every contour lies in an axial
+	plane, so an axial slice looks its contours up in an index of slice to contours built once. The
+	lines of a coronal or sagittal slice are where the slice plane crosses the contour edges, found
+	for all the edges of a roi at once and drawn as ticks one axial slice high. The lines of the most
+	recently shown slices are kept. Lines are in the display coordinates of the slice images, as
+	placed by imageExtents.
+	"""
+	def __init__(self, rois, axes, cacheSize=32, defaultColor='yellow'):
+		"""
+		Arguments:
+			rois			List of rois as read by roi.readRois (name, color, vertices and offsets), with
+								the vertices in the (Z, Y, X) coordinates of the image axes
+			axes			The Z, Y and X axes of the image the contours are drawn over
+			cacheSize		Number of slices whose lines are kept
+			defaultColor	Colour of rois whose display colour matplotlib doesn't know
+		"""
+		self._axes = [ np.asarray(aa, dtype='float64') for aa in axes ]
+		self._cacheSize = cacheSize
+		self._cache = OrderedDict()
+		self._lock = threading.Lock()
+		
+		# Half the height of the ticks of coronal and sagittal slices
+		self._halfZ = 0.5 * abs(self._axes[0][1] - self._axes[0][0]) if self._axes[0].size > 1 else 0.5
+		
+		self.names = []
+		self.colors = []
+		self._edges = []
+		self._axial = {}
+		
+		for roiInd, rr in enumerate(rois):
+			self.names.append(rr['name'])
+			try:
+				self.colors.append( colorConverter.to_rgba(rr['color']) )
+			except (ValueError, TypeError, KeyError):
+				self.colors.append( colorConverter.to_rgba(defaultColor) )
+			
+			vertices = np.asarray(rr['vertices'], dtype='float64')
+			offsets = np.asarray(rr['offsets'], dtype=np.int64)
+			
+			# Edges from each vertex to the next of its closed curve
+			nextInd = np.arange(1, vertices.shape[0] + 1)
+			nonEmpty = np.diff(offsets) > 0
+			nextInd[offsets[1:][nonEmpty] - 1] = offsets[:-1][nonEmpty]
+			valid = np.repeat( np.diff(offsets) >= 2, np.diff(offsets) )
+			self._edges.append( (vertices[valid], vertices[nextInd[valid]]) )
+			
+			for c0, c1 in zip(offsets[:-1], offsets[1:]):
+				if c1 - c0 < 2:
+					continue
+				zz = self.nearestSlice(vertices[c0,0])
+				if zz is None:
+					continue
+				curve = vertices[ list(range(c0, c1)) + [c0] ]
+				line = np.column_stack(( self.display(curve[:,2], 2), self.display(curve[:,1], 1, True) ))
+				self._axial.setdefault(zz, []).append( (roiInd, line) )
+	
+	# --------------------------------------- #
+	
+	def nearestSlice(self, zCoord):
+		"""
+		Return the axial slice index nearest a z coordinate, or None if it is outside the image.
+		"""
+		zz = int(np.abs(self._axes[0] - zCoord).argmin())
+		if abs(self._axes[0][zz] - zCoord) > self._halfZ + 1.0e-6:
+			return None
+		return zz
+	
+	# --------------------------------------- #
+	
+	def display(self, coords, axis, vertical=False):
+		"""
+		Convert coordinates along an image axis to the display coordinates of the slice images.
+		imshow stretches the pixels over the extent and puts the first row at the top.
+		"""
+		return displayCoords(self._axes[axis], coords, vertical)
+	
+	# --------------------------------------- #
+	
+	def lines(self, orien, index):
+		"""
+		Return the contour lines of slice index in orientation orien, as a list of segments for a
+		LineCollection and the colour of each.
+		"""
+		key = (orien, index)
+		with self._lock:
+			if key in self._cache:
+				self._cache[key] = self._cache.pop(key)
+				return self._cache[key]
+		
+		if orien == 0:
+			curves = self._axial.get(index, [])
+			lines = ( [ line for roiInd, line in curves ], [ self.colors[roiInd] for roiInd, line in curves ] )
+		else:
+			lines = self.crossings(orien, index)
+		
+		with self._lock:
+			self._cache[key] = lines
+			while len(self._cache) > self._cacheSize:
+				self._cache.popitem(last=False)
+		return lines
+	
+	# --------------------------------------- #
+	
+	def crossings(self, orien, index):
+		"""
+		Return the ticks where the plane of a coronal or sagittal slice crosses the contours, with the
+		colour of each tick.
+		"""
+		plane = self._axes[orien][index]
+		rowAx, colAx = PLANE_AXES[orien]
+		
+		segments = []
+		colors = []
+		for roiInd, (p0, p1) in enumerate(self._edges):
+			crossed = (p0[:,orien] <= plane) != (p1[:,orien] <= plane)
+			if not crossed.any():
+				continue
+			q0, q1 = p0[crossed], p1[crossed]
+			wt = (plane - q0[:,orien]) / (q1[:,orien] - q0[:,orien])
+			across = self.display(q0[:,colAx] + wt * (q1[:,colAx] - q0[:,colAx]), colAx)
+			
+			ticks = np.empty((across.size, 2, 2))
+			ticks[:,:,0] = across[:,np.newaxis]
+			ticks[:,0,1] = self.display(q0[:,0] - self._halfZ, 0, True)
+			ticks[:,1,1] = self.display(q0[:,0] + self._halfZ, 0, True)
+			segments.extend(ticks)
+			colors.extend( [ self.colors[roiInd] ] * across.size )
+		
+		return segments, colors
+
+# --------------------------------------- #
+
+class isodoseLines():
+	"""
+	Contour lines at a set of levels of a secondary image, e.g. isodose lines of a dose overlaid on a
+	CT, over the slices of the primary image. The secondary image is interpolated to the position of
+	the primary slice along the slice axis only, the lines are found on its own pixel grid by
+	marchingSquares and placed in the display coordinates of the primary slice images.
+	compute is the prepare function of a sliceBuffer, which caches and prefetches the lines.
+	"""
+	def __init__(self, data, axes, dispAxes, levels=(), colors=None):
+		"""
+		Arguments:
+			data		The secondary image, a sliceProvider or an array (see asProvider)
+			axes		The Z, Y and X axes of the secondary image
+			dispAxes	The Z, Y and X axes of the primary image the lines are drawn over
+			levels		Values the lines are drawn at
+			colors		Colour of the line of each level (default is spread over the jet colormap)
+		"""
+		self._data = asProvider(data)
+		self._axes = [ np.asarray(aa, dtype='float64') for aa in axes ]
+		self._dispAxes = [ np.asarray(aa, dtype='float64') for aa in dispAxes ]
+		self.setLevels(levels, colors)
+	
+	# --------------------------------------- #
+	
+	def setLevels(self, levels, colors=None):
+		"""
+		Change the levels and colours of the lines.
+		"""
+		self.levels = tuple([ float(ll) for ll in levels ])
+		if colors is None:
+			colors = cm.jet( np.linspace(0.0, 1.0, max(len(self.levels), 1)) )
+		self._colors = [ colorConverter.to_rgba(cc) for cc in colors ]
+	
+	# --------------------------------------- #
+	
+	def compute(self, orien, index, levels=None):
+		"""
+		Return the lines of slice index of the primary image in orientation orien, as a list of
+		segments for a LineCollection and the colour of each.
+		"""
+		if levels is None:
+			levels = self.levels
+		colors = dict(zip(self.levels, self._colors))
+		
+		s0, s1, sWt, sIn = resample.axisWeights(self._axes[orien], [ self._dispAxes[orien][index] ])
+		if len(levels) == 0 or not sIn[0]:
+			return [], []
+		
+		plane = np.asarray( self._data.slice(orien, s0[0]), dtype='float64' )
+		if sWt[0] > 0.0:
+			plane = plane * (1.0 - sWt[0]) + self._data.slice(orien, s1[0]) * sWt[0]
+		
+		rowAx, colAx = PLANE_AXES[orien]
+		segments = []
+		lineColors = []
+		for level in levels:
+			lines = marchingSquares(plane, level)
+			if lines.shape[0] == 0:
+				continue
+			
+			# Fractional pixel indices to coordinates then to display coordinates
+			rows = self._axes[rowAx][0] + lines[:,:,0] * self.step(rowAx)
+			cols = self._axes[colAx][0] + lines[:,:,1] * self.step(colAx)
+			lines = np.dstack(( displayCoords(self._dispAxes[colAx], cols), \
+								displayCoords(self._dispAxes[rowAx], rows, True) ))
+			segments.extend(lines)
+			lineColors.extend( [ colors.get(level, self._colors[0]) ] * lines.shape[0] )
+		
+		return segments, lineColors
+	
+	# --------------------------------------- #
+	
+	def step(self, axis):
+		"""
+		Return the spacing of an axis of the secondary image.
+		"""
+		aa = self._axes[axis]
+		return aa[1] - aa[0] if aa.size > 1 else 1.0
+
+# --------------------------------------- #
+
+# Edges of a marching squares cell crossed by the line for each case, the corners (top left, top
+# right, bottom right, bottom left) at or above the level giving bits 1, 2, 4 and 8. Cases 5 and 10
+# have two lines, given here for a centre below the level, and swapped when it is above.
+MS_EDGES = { 1:[(3,0)], 2:[(0,1)], 3:[(3,1)], 4:[(1,2)], 5:[(3,0),(1,2)], 6:[(0,2)], 7:[(3,2)], \
+			8:[(2,3)], 9:[(0,2)], 10:[(0,1),(2,3)], 11:[(1,2)], 12:[(1,3)], 13:[(0,1)], 14:[(0,3)] }
+MS_SADDLE = { 5:[(0,1),(2,3)], 10:[(3,0),(1,2)] }
+
+def marchingSquares(plane, level):
+	"""
+	Return the line segments where a 2D array crosses a level, as an (N, 2, 2) array of the
+	(row, column) fractional indices of the ends of each segment. Every cell is classified at once
+	and the segments of all the cells of each case are interpolated together.
+	"""
+	plane = np.asarray(plane, dtype='float64')
+	if plane.ndim != 2 or plane.shape[0] < 2 or plane.shape[1] < 2:
+		return np.zeros((0, 2, 2))
+	
+	v0, v1 = plane[:-1,:-1], plane[:-1,1:]
+	v2, v3 = plane[1:,1:], plane[1:,:-1]
+	case = (v0 >= level) * 1 + (v1 >= level) * 2 + (v2 >= level) * 4 + (v3 >= level) * 8
+	
+	cells = np.nonzero( (case > 0) & (case < 15) )
+	if cells[0].size == 0:
+		return np.zeros((0, 2, 2))
+	case = case[cells]
+	r, c = cells[0].astype('float64'), cells[1].astype('float64')
+	a0, a1, a2, a3 = v0[cells], v1[cells], v2[cells], v3[cells]
+	
+	def frac(va, vb):
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return np.clip( np.where(vb != va, (level - va) / (vb - va), 0.5), 0.0, 1.0 )
+	
+	# Crossing point of each edge, top, right, bottom and left
+	edges = [ np.column_stack(( r, c + frac(a0, a1) )), np.column_stack(( r + frac(a1, a2), c + 1.0 )), \
+			np.column_stack(( r + 1.0, c + frac(a3, a2) )), np.column_stack(( r + frac(a0, a3), c )) ]
+	
+	centreAbove = (a0 + a1 + a2 + a3) * 0.25 >= level
+	segments = []
+	for caseInd, pairs in MS_EDGES.items():
+		sel = case == caseInd
+		if caseInd in MS_SADDLE:
+			for above, casePairs in [ (False, pairs), (True, MS_SADDLE[caseInd]) ]:
+				selSaddle = sel & (centreAbove == above)
+				for e0, e1 in casePairs:
+					segments.append( np.stack(( edges[e0][selSaddle], edges[e1][selSaddle] ), axis=1) )
+		else:
+			for e0, e1 in pairs:
+				segments.append( np.stack(( edges[e0][sel], edges[e1][sel] ), axis=1) )
+	
+	return np.concatenate(segments)
+
+# --------------------------------------- #
+
+class sliceBuffer():
+	"""
+	Ring buffer of prepared display slices for one axes, keyed by (orientation, slice index, level).
+	Slices not in the buffer are prepared on request, and slices asked for by prefetch are prepared
+	by a background thread so they are ready when the user scrolls to them. The least recently used
+	slices are dropped when the buffer is full.
+	"""
+	def __init__(self, prepare, size=10, background=True):
+		"""
+		Arguments:
+			prepare		Function of (orientation, index, level) returning the prepared slices
+			size		Number of prepared slices kept
+			background	Prepare prefetched slices in a background thread
+		"""
+		self._prepare = prepare
+		self._size = size
+		self._slices = OrderedDict()
+		self._lock = threading.Lock()
+		self._pending = queue.Queue()
+		self._generation = 0
+		self._closed = False
+		self.misses = 0
+		
+		if background:
+			self._thread = threading.Thread(target=self.fill)
+			self._thread.daemon = True
+			self._thread.start()
+	
+	# --------------------------------------- #
+	
+	def get(self, key):
+		"""
+		Return the prepared slices for a key, preparing them now if they are not in the buffer, which
+		is counted in misses. The key becomes the most recently used.
+		"""
+		with self._lock:
+			if key in self._slices:
+				self._slices[key] = self._slices.pop(key)
+				return self._slices[key]
+			self.misses += 1
+		
+		slices = self._prepare(*key)
+		self.store(key, slices, self._generation)
+		return slices
+	
+	# --------------------------------------- #
+	
+	def store(self, key, slices, generation):
+		"""
+		Add prepared slices to the buffer, unless the buffer was cleared since they were requested.
+		"""
+		with self._lock:
+			if generation != self._generation:
+				return
+			self._slices[key] = slices
+			while len(self._slices) > self._size:
+				self._slices.popitem(last=False)
+	
+	# --------------------------------------- #
+	
+	def prefetch(self, keys):
+		"""
+		Replace the slices waiting to be prepared in the background by keys, in order.
+		"""
+		if self._closed:
+			return
+		while True:
+			try:
+				self._pending.get_nowait()
+			except queue.Empty:
+				break
+		for key in keys:
+			self._pending.put( (key, self._generation) )
+	
+	# --------------------------------------- #
+	
+	def fill(self):
+		"""
+		Background thread preparing the slices that have been prefetched, until close queues None.
+		"""
+		while True:
+			item = self._pending.get()
+			if item is None:
+				return
+			key, generation = item
+			with self._lock:
+				if key in self._slices or generation != self._generation:
+					continue
+			self.store(key, self._prepare(*key), generation)
+	
+	# --------------------------------------- #
+	
+	def clear(self):
+		"""
+		Empty the buffer, e.g. when the colour map changes, and ignore slices still being prepared.
+		"""
+		with self._lock:
+			self._generation += 1
+			self._slices = OrderedDict()
+	
+	# --------------------------------------- #
+	
+	def close(self):
+		"""
+		Stop the background thread, once the slice it is preparing is done, and empty the buffer.
+		Slices asked for by get are still prepared, on request.
+		"""
+		self._closed = True
+		self.clear()
+		while True:
+			try:
+				self._pending.get_nowait()
+			except queue.Empty:
+				break
+		self._pending.put(None)
+
+# --------------------------------------- #
+
+class viewerStats():
+	"""
+	Timings of the slicesView hot path, to tell slow data access from slow rendering. Each displayed
+	frame records the time to get its prepared slice (short when it was prefetched), to update the
+	contour lines, to draw the axes on the canvas and in total. Every prepared slice records the time
+	to extract the primary slice, interpolate the overlay and colour map, with whether it was
+	prepared in the background. The most recent maxFrames of each are kept.
+	
+		v = imView.slicesView(im1_data=ct, im2_data=dose, ..., stats=True)
+		print(v.stats.summary())
+	"""
+	STAGES = ('extract', 'overlay', 'colour')
+	FRAME_TIMES = ('prepare', 'lines', 'draw', 'latency')
+	
+	def __init__(self, maxFrames=1000):
+		self._lock = threading.Lock()
+		self._mainThread = threading.current_thread()
+		self._maxFrames = maxFrames
+		self._callbacks = []
+		self.reset()
+	
+	# --------------------------------------- #
+	
+	def reset(self):
+		"""
+		Forget the frames and stages recorded so far.
+		"""
+		with self._lock:
+			self._frames = deque(maxlen=self._maxFrames)
+			self._stages = deque(maxlen=self._maxFrames)
+	
+	# --------------------------------------- #
+	
+	def addStages(self, stages):
+		"""
+		Record the times, in seconds, of the stages of preparing a slice.
+		"""
+		stages = dict(stages)
+		stages['time'] = time.time()
+		stages['background'] = threading.current_thread() is not self._mainThread
+		with self._lock:
+			self._stages.append(stages)
+	
+	# --------------------------------------- #
+	
+	def addFrame(self, frame):
+		"""
+		Record a displayed frame, a dictionary of its axes, slice and times in seconds, and pass it to
+		the callbacks added by onFrame. Returns the record, to be completed by drawFrame when its
+		draw time is only known later.
+		"""
+		frame = dict(frame)
+		frame['time'] = time.time()
+		with self._lock:
+			self._frames.append(frame)
+		for callback in self._callbacks:
+			callback(frame)
+		return frame
+	
+	# --------------------------------------- #
+	
+	def drawFrame(self, frame, draw, latency):
+		"""
+		Set the draw time and latency, in seconds, of a frame drawn by a full redraw of the figure.
+		"""
+		with self._lock:
+			frame['draw'] = draw
+			frame['latency'] = latency
+	
+	# --------------------------------------- #
+	
+	def onFrame(self, callback):
+		"""
+		Call callback with the record of every frame as it is displayed.
+		"""
+		self._callbacks.append(callback)
+	
+	# --------------------------------------- #
+	
+	def frames(self, last=None):
+		"""
+		Return the records of the frames displayed, or of the last ones, oldest first.
+		"""
+		with self._lock:
+			frames = list(self._frames)
+		return frames if last is None else frames[-last:]
+	
+	# --------------------------------------- #
+	
+	def stages(self, last=None):
+		"""
+		Return the records of the slices prepared, or of the last ones, oldest first.
+		"""
+		with self._lock:
+			stages = list(self._stages)
+		return stages if last is None else stages[-last:]
+	
+	# --------------------------------------- #
+	
+	def fps(self, last=None):
+		"""
+		Return the rate frames were displayed at over the frames recorded, or the last ones.
+		"""
+		times = [ frame['time'] for frame in self.frames(last) ]
+		if len(times) < 2 or times[-1] <= times[0]:
+			return 0.0
+		return (len(times) - 1) / (times[-1] - times[0])
+	
+	# --------------------------------------- #
+	
+	def summary(self, last=None):
+		"""
+		Return the statistics of the frames and stages recorded, or of the last ones, as a dictionary
+		of the frame rate, the fraction of frames whose slice was already prepared and, for each
+		frame time and stage, the count and the mean, median, 95th percentile and maximum in ms.
+		Stages are also given for the slices prepared in the background alone. The draw time of frames
+		drawn by a full redraw of the figure runs from the redraw request to the end of the draw in the
+		gui event loop, and frames whose redraw was merged into a later one have none.
+		"""
+		frames = self.frames(last)
+		stages = self.stages(last)
+		
+		result = {'frames':len(frames), 'fps':self.fps(last), \
+					'buffered':np.mean([ ff['buffered'] for ff in frames ]) if frames else 0.0}
+		for name in self.FRAME_TIMES:
+			result[name] = timeStats([ ff[name] for ff in frames if ff.get(name) is not None ])
+		for name in self.STAGES:
+			result[name] = timeStats([ ss[name] for ss in stages if name in ss ])
+			result[name + ' (background)'] = timeStats([ ss[name] for ss in stages if name in ss and ss['background'] ])
+		return result
+	
+	# --------------------------------------- #
+	
+	def readout(self, last=30):
+		"""
+		Return a short text of the frame rate, latency and stage times of the last frames.
+		"""
+		result = self.summary(last)
+		lines = [ '%-8s %7.1f' % ('fps', result['fps']), '%-8s %6.0f %%' % ('buffered', 100.0 * result['buffered']) ]
+		for name in self.FRAME_TIMES + self.STAGES:
+			if result[name]['count'] > 0:
+				lines.append( '%-8s %7.2f ms' % (name, result[name]['mean']) )
+		return '\n'.join(lines)
+
+# --------------------------------------- #
+
+def timeStats(times):
+	"""
+	Return the count and the mean, median, 95th percentile and maximum in ms of times in seconds.
+	"""
+	if len(times) == 0:
+		return {'count':0, 'mean':0.0, 'median':0.0, 'p95':0.0, 'max':0.0}
+	ms = 1000.0 * np.asarray(times, dtype='float64')
+	return {'count':ms.size, 'mean':ms.mean(), 'median':np.median(ms), 'p95':np.percentile(ms, 95), \
+			'max':ms.max()}
+
+# --------------------------------------- #
+
 class InvalidArgumentsException(Exception):
 	pass
 
@@ -1,14 +1,17 @@
 import pinnObjList
+import xdrReference
 
 # ------------------------------------------- #
 	
 class pinnObjDict(dict):
-	def __init__(self, dict1, filename=''):
+	def __init__(self, dict1, filename='', doseGrid=None):
 		"""
 		Initialize private variables
+		doseGrid is the DoseGrid of the enclosing object (e.g. the Trial of a Beam) giving the shape of binary data
 		"""
-		self = dict1
-		self._filename = filename
+		dict.__init__(self, dict1)
+		dict.__setattr__(self, '_filename', filename)
+		dict.__setattr__(self, '_doseGrid', doseGrid)
 
 	# ------------------------------------------- #
 	
@@ -20,10 +23,18 @@ class pinnObjDict(dict):
 		Allow user to access dictionary entries by the dot operator
 		"""
 		try:
+			doseGrid = self._doseGrid
+			if dict.__contains__(self, 'DoseGrid'):
+				doseGrid = self['DoseGrid']
+				
 			if type(self[key]) is dict:
-				return pinnObjDict(self[key],self._filename)
+				return pinnObjDict(self[key],self._filename,doseGrid)
 			elif type(self[key]) is list:
-				return pinnObjList.pinnObjList(self[key],self._filename)
+				return pinnObjList.pinnObjList(self[key],self._filename,doseGrid)
+			elif xdrReference.isXdr(self[key]):
+				# Binary references such as Beam.DoseVolume give a lazily mapped array, references to
+				# the same file share one map through xdrReference.mappedArrays
+				return xdrReference.xdrReference(self[key],self._filename,doseGrid)
 			else:
 				return self[key]
 		except:
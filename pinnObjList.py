@@ -6,17 +6,18 @@ class pinnObjList():
 	"""
 	Subclass of list object to offer some syntatic sugar.
 	"""
-	def __init__(self, inList, filename=''):
+	def __init__(self, inList, filename='', doseGrid=None):
 		self.__list = inList[:]
 		self.__curNum = 0
 		self.__listLen = len(self.__list)
 		self._filename = filename
+		self._doseGrid = doseGrid
 
 	# ------------------------------------------- #
 	
 	def __getitem__(self, index):
 		if type(self.__list[index]) is dict:		
-			return pinnObjDict.pinnObjDict(self.__list[index],self._filename)
+			return pinnObjDict.pinnObjDict(self.__list[index],self._filename,self._doseGrid)
 		else:
 			return self.__list[index]
 	
@@ -62,7 +63,7 @@ class pinnObjList():
 			raise StopIteration
 		else:
 			if type(self.__list[self.__curNum]) is dict:		
-				rtnVal = pinnObjDict.pinnObjDict(self.__list[self.__curNum],self._filename)
+				rtnVal = pinnObjDict.pinnObjDict(self.__list[self.__curNum],self._filename,self._doseGrid)
 			else:
 				rtnVal = self.__list[self.__curNum]
 			
@@ -92,7 +93,7 @@ class pinnObjList():
 		Allow access of zeroth element by use of function First
 		"""
 		if type(self.__list[0]) is dict:		
-			return pinnObjDict.pinnObjDict(self.__list[0],self._filename)
+			return pinnObjDict.pinnObjDict(self.__list[0],self._filename,self._doseGrid)
 		else:
 			return self.__list[0]
 		
@@ -106,7 +107,7 @@ class pinnObjList():
 			self.__curNum = num
 		else:
 			if type(self.__list[self.__curNum]) is dict:		
-				return pinnObjDict.pinnObjDict(self.__list[self.__curNum],self._filename)
+				return pinnObjDict.pinnObjDict(self.__list[self.__curNum],self._filename,self._doseGrid)
 			else:
 				return self.__list[self.__curNum]
 		
@@ -114,7 +115,7 @@ class pinnObjList():
 	
 	def getLast(self):
 		if type(self.__list[-1]) is dict:		
-			return pinnObjDict.pinnObjDict(self.__list[0],self._filename)
+			return pinnObjDict.pinnObjDict(self.__list[0],self._filename,self._doseGrid)
 		else:
 			return self.__list[-1]
 		
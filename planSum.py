@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+import pinnObjDict
+import dose
+import resample
+
+# ----------------------------------------- #
+"""
+Sum the doses of several trials or plans that may be calculated on different dose grids.
+
+Every contributor is resampled onto a common grid and accumulated one slab at a time. The
+trial doses are never formed on their own grids, each slab only evaluates the weighted beam
+sum for the source planes the resampler needs, so memory is bounded by the output volume,
+a slab per contributor and whatever beam doses are held in the cache.
+
+	sumDose, sumHdr = planSum.planSum([ ('/data/Patient_1/Plan_0/plan.Trial', 0, 1.0),
+										('/data/Patient_1/Plan_2/plan.Trial', 1, 0.5) ])
+"""
+
+# ----------------------------------------- #
+
+def planSum(contributors, doseHdr=None, cache=None, slabSize=8, nThreads=None):
+	"""
+	Sum the dose of several contributors onto a common grid.
+	Arguments:
+		contributors	List of (planTrialFile, trNum, scale) tuples for stored trials, or of
+							(doseData, doseHdr, scale) tuples for doses already in memory.
+							scale is optional and defaults to 1.0
+		doseHdr			DoseGrid to sum the dose on (default is a grid covering every contributor
+							with the smallest voxel size of any contributor along each axis)
+		cache			A doseCache.beamDoseCache so beam doses already loaded are reused
+		slabSize		Number of Z planes of the common grid summed together
+		nThreads		Number of contributors resampled in parallel (default is the number of cpus)
+	Returns the summed dose and the DoseGrid it is on.
+	"""
+	volumes = []
+	for contrib in contributors:
+		scale = 1.0
+		if len(contrib) > 2:
+			scale = contrib[2]
+
+		if hasattr(contrib[0], 'shape'):
+			volumes.append( (contrib[0], contrib[1], scale) )
+		else:
+			bmInds, bmDoses, bmFactors, trHdr = dose.trialBeamDoses(contrib[0], contrib[1], cache=cache)
+			volumes.append( (dose.beamDoseSum(bmDoses, bmFactors), trHdr, scale) )
+
+	if doseHdr is None:
+		doseHdr = commonGrid([ vol[1] for vol in volumes ])
+
+	dstAxes = dose.doseGridAxes(doseHdr)
+	resamplers = [ resample.gridResampler(dose.doseGridAxes(vol[1]), dstAxes, nThreads=1) \
+						for vol in volumes ]
+
+	shape = (doseHdr.Dimension.Z, doseHdr.Dimension.Y, doseHdr.Dimension.X)
+	sumDose = np.zeros(shape)
+
+	if nThreads is None:
+		nThreads = multiprocessing.cpu_count()
+	pool = None
+	if nThreads > 1 and len(volumes) > 1:
+		pool = ThreadPool(min(nThreads, len(volumes)))
+
+	try:
+		for z0 in range(0, shape[0], slabSize):
+			z1 = min(z0 + slabSize, shape[0])
+
+			def contribSlab(ind):
+				return resamplers[ind].resampleSlab(volumes[ind][0], z0, z1) * volumes[ind][2]
+
+			if pool is None:
+				slabs = [ contribSlab(ind) for ind in range(len(volumes)) ]
+			else:
+				slabs = pool.map(contribSlab, range(len(volumes)))
+
+			for slab in slabs:
+				sumDose[z0:z1] += slab
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	return sumDose, doseHdr
+
+# ----------------------------------------- #
+
+def commonGrid(doseHdrs):
+	"""
+	Return a DoseGrid covering all of a list of dose grids, with the smallest voxel size
+	of any of the grids along each axis.
+	"""
+	axes = [ dose.doseGridAxes(hdr) for hdr in doseHdrs ]
+
+	grid = {'Origin':{}, 'VoxelSize':{}, 'Dimension':{}}
+	for ax, name in enumerate(('Z','Y','X')):
+		axMin = min([ hdrAxes[ax].min() for hdrAxes in axes ])
+		axMax = max([ hdrAxes[ax].max() for hdrAxes in axes ])
+		voxSize = min([ hdr['VoxelSize'][name] for hdr in doseHdrs ])
+		nVox = int(np.ceil((axMax - axMin) / voxSize - 1.0e-6)) + 1
+
+		grid['VoxelSize'][name] = voxSize
+		grid['Dimension'][name] = nVox
+		if name == 'Y':
+			# Rows run from the top of the grid down (see dose.coordToIndex)
+			grid['Origin'][name] = axMax - nVox * voxSize
+		else:
+			grid['Origin'][name] = axMin
+
+	return pinnObjDict.pinnObjDict(grid)
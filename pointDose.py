@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, csv
+import numpy as np
+
+import dose
+import doseCache
+
+# ----------------------------------------- #
+"""
+Table of the dose at every point of interest in plan.Points for every trial of a plan.
+
+Each beam dose is opened once and all points are interpolated from it in a single vectorised
+pass. Trial doses at the points are then the weighted sum of the beam doses at the points, so
+the trial dose cubes are never formed. Beam files are memory mapped unless a cache is given,
+so only the voxels around the points are read.
+
+	table = pointDose.pointDoseTable('/data/Patient_1/Plan_0', perBeam=True)
+	pointDose.writeCsv(table, 'Plan_0_points.csv')
+"""
+
+TABLE_COLUMNS = ['Trial', 'TrialName', 'Beam', 'BeamName', 'Poi', 'X', 'Y', 'Z', 'Dose']
+
+# ----------------------------------------- #
+
+def pointDoseTable(planDir, perBeam=False, cache=None):
+	"""
+	Calculate the dose at every POI for every trial in a plan.
+	Arguments:
+		planDir		The plan directory holding plan.Trial, plan.Points and the beam dose files
+		perBeam		Also give the contribution of every beam to the dose at every POI
+		cache		A doseCache.beamDoseCache to read plans and beam doses from
+	Returns a list of rows, each a dictionary with the keys in TABLE_COLUMNS. Trial rows have a Beam
+	of -1 and an empty BeamName. Trials without stored dose have a Dose of NaN.
+	"""
+	planTrialFile = os.path.join(planDir, 'plan.Trial')
+	if cache is None:
+		cache = doseCache.beamDoseCache(mmap=True)
+
+	pln1, pts = dose.readPlanFiles(planTrialFile, cache)
+	
+	if pln1.has_key('TrialList'):
+		trials = [ tr for tr in pln1.TrialList ]
+	else:
+		trials = [ pln1.Trial ]
+
+	pois = [ pt for pt in pts.PoiList ]
+	xCoords = np.array([ pt.XCoord for pt in pois ], dtype='float64')
+	yCoords = np.array([ pt.YCoord for pt in pois ], dtype='float64')
+	zCoords = np.array([ pt.ZCoord for pt in pois ], dtype='float64')
+
+	table = []
+	for trNum, curTr in enumerate(trials):
+		try:
+			bmInds, bmDoses, bmFactors, doseHdr = dose.trialBeamDoses(planTrialFile, trNum, cache=cache)
+		except dose.DoseInvalidException:
+			bmInds, bmDoses, bmFactors = [], [], []
+			trDose = np.empty(len(pois))
+			trDose.fill(np.nan)
+		else:
+			trDose = np.zeros(len(pois))
+
+		for bInd, bmDose, doseFactor in zip(bmInds, bmDoses, bmFactors):
+			bmPtDose = dose.dosesAtCoords(bmDose, doseHdr, xCoords, yCoords, zCoords) * doseFactor
+			trDose += bmPtDose
+
+			if perBeam:
+				bmName = curTr.BeamList[bInd].Name
+				for pInd, pt in enumerate(pois):
+					table.append( tableRow(trNum, curTr.Name, bInd, bmName, pt, bmPtDose[pInd]) )
+
+		for pInd, pt in enumerate(pois):
+			table.append( tableRow(trNum, curTr.Name, -1, '', pt, trDose[pInd]) )
+
+	return table
+
+# ----------------------------------------- #
+
+def tableRow(trNum, trName, bInd, bmName, pt, ptDose):
+	"""
+	Return a row of the point dose table as a dictionary.
+	"""
+	return {'Trial':trNum, 'TrialName':trName, 'Beam':bInd, 'BeamName':bmName, 'Poi':pt.Name, \
+			'X':pt.XCoord, 'Y':pt.YCoord, 'Z':pt.ZCoord, 'Dose':ptDose}
+
+# ----------------------------------------- #
+
+def writeCsv(table, csvFile):
+	"""
+	Write a point dose table to a CSV file.
+	"""
+	f = open(csvFile, 'w')
+	writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+	writer.writeheader()
+	writer.writerows(table)
+	f.close()
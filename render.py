@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, sys
+import multiprocessing
+import numpy as np
+
+# ----------------------------------------- #
+"""
+Headless rendering of plan review snapshots, slice montages with the dose overlaid on the CT and
+DVH plots, to PNG or PDF files (the format is chosen from the file extension).
+
+Slices are prepared by the same imView.sliceRenderer as the slicesView gui, so the CT window, the
+dose colour map and the resampling of the dose onto the CT pixels are identical, and drawn with the
+Agg canvas onto figures that are never shown, so nothing opens a window or blocks. matplotlib,
+dose, dvh and imView are only imported when something is rendered, which keeps importing this
+module and starting pool workers quick.
+
+	render.renderTrial('/data/Patient_1/Plan_0/plan.Trial', 0, '/data/review/trial0.png', nAxial=8)
+	render.renderPlans(glob.glob('/data/*/Plan_*/plan.Trial'), '/data/review', ext='.pdf', nProcesses=8)
+"""
+
+ORIEN_NAMES = [ 'Axial', 'Coronal', 'Sagittal' ]
+
+# ----------------------------------------- #
+
+def renderTrial(planTrialFile, trNum, fileName, centre=None, nAxial=0, nCols=4, window=None, \
+				windowOffset=0, interpType='linear', rois=True, isodoseLevels=None, dpi=100):
+	"""
+	Render the axial, coronal and sagittal slices of the CT through a point with the dose of a trial
+	overlaid, optionally followed by rows of axial slices spread over the dose grid.
+	Arguments:
+		planTrialFile	Path to the plan.Trial file
+		trNum			Trial number
+		fileName		Image file written, .png, .pdf or any format matplotlib writes
+		centre			(x, y, z) coordinate the orthogonal slices pass through (default is the centre
+							of the dose grid)
+		nAxial			Number of axial slices in the montage below the orthogonal slices
+		nCols			Number of axial slices in each row of the montage
+		window			Display window of the CT (see imView.slicesView)
+		windowOffset	Stored value of 0 HU of the CT (see imView.slicesView)
+		interpType		Resampling of the dose, 'linear' or 'neighbour'
+		rois			Draw the contours of the rois in plan.roi
+		isodoseLevels	Doses drawn as isodose lines
+		dpi				Resolution of the image
+	Returns the name of the file written.
+	"""
+	import dose, imView
+
+	images = dose.doseOnCTImages(planTrialFile, trNum)
+	renderer, im1_axes, im2_axes = imageRenderer(images, window, windowOffset, interpType)
+	extents = imView.imageExtents(im1_axes)
+	contours = None
+	if rois and images.get('rois'):
+		contours = imView.contourIndex(images['rois'], im1_axes)
+	isodose = None
+	if isodoseLevels:
+		isodose = imView.isodoseLines(images['im2_data'], im2_axes, im1_axes, isodoseLevels)
+
+	if centre is None:
+		point = [ 0.5 * (aa[0] + aa[-1]) for aa in im2_axes ]
+	else:
+		point = [ centre[2], -centre[1], centre[0] ]
+	orthoInds = [ nearestIndex(im1_axes[nn], point[nn]) for nn in range(3) ]
+
+	# Axial slices evenly spread over the part of the CT covered by the dose grid
+	zInds = []
+	if nAxial > 0:
+		zInds = [ nearestIndex(im1_axes[0], zz) for zz in \
+					np.linspace(im2_axes[0][0], im2_axes[0][-1], nAxial + 2)[1:-1] ]
+
+	nRows = 1 + (len(zInds) + nCols - 1) // nCols
+	fig, canvas = headlessFigure( (12.0, 4.0 * nRows), dpi )
+
+	for orien, index in enumerate(orthoInds):
+		ax = fig.add_subplot(nRows, 3, orien + 1)
+		drawSlice(ax, renderer, orien, index, extents[orien], '%s %d' % (ORIEN_NAMES[orien], index), contours, \
+					isodose)
+
+	for nn, index in enumerate(zInds):
+		ax = fig.add_subplot(nRows, nCols, nCols + nn + 1)
+		drawSlice(ax, renderer, 0, index, extents[0], 'z = %.2f' % im1_axes[0][index], contours, isodose)
+
+	fig.suptitle('%s - trial %d' % (planName(planTrialFile), trNum))
+	fig.savefig(fileName, dpi=dpi)
+	return fileName
+
+# ----------------------------------------- #
+
+def renderDVH(planTrialFile, trNum, fileName, roiNames=None, batch=None, dpi=100):
+	"""
+	Plot the cumulative DVH of the rois of a trial, in the roi display colours where matplotlib
+	knows them. Pass a dvh.dvhBatch as batch to reuse its masks across trials.
+	Returns the name of the file written.
+	"""
+	import dvh, roi
+	from matplotlib.colors import colorConverter
+
+	roiFile = os.path.join(os.path.dirname(planTrialFile), 'plan.roi')
+	if batch is None:
+		batch = dvh.dvhBatch(planTrialFile, roiNames)
+	dvhs = batch.trialDVHs(trNum)
+	colors = dict([ (rr['name'], rr['color']) for rr in roi.readRoiIndex(roiFile) ])
+
+	fig, canvas = headlessFigure( (8.0, 6.0), dpi )
+	ax = fig.add_subplot(1, 1, 1)
+	for name in sorted(dvhs.keys()):
+		curDvh = dvhs[name]
+		if curDvh['volume'] <= 0.0:
+			continue
+		try:
+			color = colorConverter.to_rgba(colors.get(name))
+		except (ValueError, TypeError, KeyError):
+			color = None
+		ax.plot(curDvh['bins'], 100.0 * curDvh['cumulative'] / curDvh['volume'], label=name, color=color)
+
+	ax.set_xlabel('Dose (cGy)')
+	ax.set_ylabel('Volume (%)')
+	ax.set_ylim(0.0, 105.0)
+	ax.grid(True)
+	ax.legend(loc='upper right', fontsize='small')
+	ax.set_title('%s - trial %d' % (planName(planTrialFile), trNum))
+	fig.savefig(fileName, dpi=dpi)
+	return fileName
+
+# ----------------------------------------- #
+
+def renderPlan(planTrialFile, outDir, ext='.png', dvhs=True, **kwargs):
+	"""
+	Render the slice montage, and the DVH if dvhs is set, of every trial in a plan into outDir,
+	named after the patient and plan directories. Other keyword arguments are passed to renderTrial.
+	Returns the list of files written.
+	"""
+	import dose, dvh
+
+	if not os.path.isdir(outDir):
+		os.makedirs(outDir)
+
+	prefix = os.path.join(outDir, planName(planTrialFile))
+	batch = None
+	if dvhs and os.path.exists(os.path.join(os.path.dirname(planTrialFile), 'plan.roi')):
+		batch = dvh.dvhBatch(planTrialFile)
+
+	written = []
+	for trNum in range(dose.numTrials(planTrialFile)):
+		written.append( renderTrial(planTrialFile, trNum, '%s_trial%d_slices%s' % (prefix, trNum, ext), **kwargs) )
+		if batch is not None:
+			written.append( renderDVH(planTrialFile, trNum, '%s_trial%d_dvh%s' % (prefix, trNum, ext), batch=batch) )
+
+	return written
+
+# ----------------------------------------- #
+
+def renderPlans(planTrialFiles, outDir, ext='.png', dvhs=True, nProcesses=None, **kwargs):
+	"""
+	Render every trial of a list of plans (see renderPlan) on a pool of processes, one plan per task.
+	Returns the list of files written.
+	"""
+	if nProcesses is None:
+		nProcesses = multiprocessing.cpu_count()
+
+	tasks = [ (planTrialFile, outDir, ext, dvhs, kwargs) for planTrialFile in planTrialFiles ]
+	if nProcesses <= 1 or len(tasks) <= 1:
+		initWorker()
+		results = [ renderPlanTask(task) for task in tasks ]
+	else:
+		pool = multiprocessing.Pool(min(nProcesses, len(tasks)), initializer=initWorker)
+		try:
+			results = pool.map(renderPlanTask, tasks)
+		finally:
+			pool.close()
+			pool.join()
+
+	return [ fileName for written in results for fileName in written ]
+
+# ----------------------------------------- #
+
+def renderPlanTask(task):
+	"""
+	Pool task rendering a single plan.
+	"""
+	planTrialFile, outDir, ext, dvhs, kwargs = task
+	return renderPlan(planTrialFile, outDir, ext, dvhs, **kwargs)
+
+# ----------------------------------------- #
+
+def initWorker():
+	"""
+	Select the Agg backend before dose imports pylab, unless a backend is already in use.
+	"""
+	import matplotlib
+	if 'matplotlib.pyplot' not in sys.modules:
+		matplotlib.use('Agg')
+
+# ----------------------------------------- #
+
+def imageRenderer(images, window=None, windowOffset=0, interpType='linear'):
+	"""
+	Return an imView.sliceRenderer at full resolution for images given as the keyword arguments of
+	imView.slicesView (see dose.doseOnCTImages), with the axes of the primary and secondary images.
+	"""
+	import imView
+
+	im1_axes = imView.imageAxes(images['im1_data'].shape, images['im1_voxSize'], images['im1_startP'])
+	im2_axes = imView.imageAxes(images['im2_data'].shape, images['im2_voxSize'], images['im2_startP'])
+	renderer = imView.sliceRenderer(images['im1_data'], im1_axes, images['im1_cmap'], \
+						images['im2_data'], im2_axes, images['im2_cmap'], interpType, window, windowOffset, \
+						pyramid=False)
+
+	return renderer, im1_axes, im2_axes
+
+# ----------------------------------------- #
+
+def headlessFigure(figSize, dpi=100):
+	"""
+	Return a matplotlib figure drawn by an Agg canvas, not managed by pyplot so it is never shown
+	and is freed once it isn't referenced.
+	"""
+	from matplotlib.figure import Figure
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+	fig = Figure(figsize=figSize, dpi=dpi)
+	canvas = FigureCanvasAgg(fig)
+	return fig, canvas
+
+# ----------------------------------------- #
+
+def drawSlice(ax, renderer, orien, index, extent, title='', contours=None, isodose=None):
+	"""
+	Draw a prepared slice in an axes, with physical proportions, the isodose lines of an
+	imView.isodoseLines and the roi contours of an imView.contourIndex on the slice.
+	"""
+	from matplotlib.collections import LineCollection
+
+	ax.imshow( renderer.prepareSlice(orien, index), extent=extent, interpolation='nearest' )
+	if isodose is not None:
+		segments, colors = isodose.compute(orien, index)
+		ax.add_collection( LineCollection(segments, colors=colors, linewidths=1.0), autolim=False )
+	if contours is not None:
+		segments, colors = contours.lines(orien, index)
+		ax.add_collection( LineCollection(segments, colors=colors, linewidths=1.0), autolim=False )
+	ax.set_aspect('equal')
+	ax.set_title(title, fontsize='small')
+	ax.get_xaxis().set_visible(False)
+	ax.get_yaxis().set_visible(False)
+
+# ----------------------------------------- #
+
+def nearestIndex(axis, value):
+	"""
+	Return the index of the point of an axis nearest a value.
+	"""
+	return int(abs(axis - value).argmin())
+
+# ----------------------------------------- #
+
+def planName(planTrialFile):
+	"""
+	Return a name for a plan made of its patient and plan directory names, e.g. Patient_1_Plan_0.
+	"""
+	planDir = os.path.dirname(os.path.abspath(planTrialFile))
+	return '%s_%s' % (os.path.basename(os.path.dirname(planDir)), os.path.basename(planDir))
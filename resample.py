@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+import dose
+
+# ----------------------------------------- #
+"""
+Separable trilinear resampling of volumes between the dose grid and the CT grid.
+
+Interpolation is done one axis at a time using weight tables computed once per axis. The target
+volume is processed in slabs along Z so only the source planes needed for a slab are read (which
+keeps memory mapped sources cheap) and the temporaries are the size of a slab. Slabs are processed
+on a thread pool, numpy releases the GIL for the arithmetic so the slabs run in parallel.
+
+	doseOnCT = resample.resampleDoseToCT(doseData, doseHdr, ctHdr)
+	ctOnDose = resample.resampleCTToDose(ctData, ctHdr, doseHdr)
+"""
+
+# ----------------------------------------- #
+
+def axisWeights(srcAxis, dstAxis):
+	"""
+	Calculate the linear interpolation table from a regularly spaced source axis to a destination axis.
+	The source axis can be ascending or descending.
+	Returns the lower and upper source indices, the weight of the upper index and a mask of the
+	destination positions that are inside the source axis.
+	"""
+	srcAxis = np.asarray(srcAxis, dtype='float64')
+	dstAxis = np.asarray(dstAxis, dtype='float64')
+	nSrc = srcAxis.size
+
+	if nSrc > 1:
+		srcInd = (dstAxis - srcAxis[0]) / (srcAxis[1] - srcAxis[0])
+	else:
+		srcInd = np.zeros(dstAxis.shape)
+
+	# Allow for rounding error at the edges of the source axis
+	eps = 1.0e-6
+	inside = (srcInd >= -eps) & (srcInd <= nSrc - 1 + eps)
+	if nSrc == 1:
+		inside = np.abs(dstAxis - srcAxis[0]) < eps
+
+	ind0 = np.clip(np.floor(srcInd), 0, max(nSrc-2, 0)).astype(np.intp)
+	ind1 = np.minimum(ind0 + 1, nSrc - 1)
+	wt1 = np.clip(srcInd - ind0, 0.0, 1.0)
+
+	return ind0, ind1, wt1, inside
+
+# ----------------------------------------- #
+
+class gridResampler():
+	"""
+	Resample volumes from a source grid to a destination grid, both given as the coordinates
+	of the voxel centres along each array axis [Z, Y, X] (see dose.gridAxes).
+	The axis weight tables are calculated once and reused for every slab and every volume
+	resampled with the same pair of grids.
+	"""
+	def __init__(self, srcAxes, dstAxes, fill=0.0, slabSize=8, nThreads=None):
+		"""
+		Arguments:
+			srcAxes		Voxel centre coordinates [Z, Y, X] of the source volume
+			dstAxes		Voxel centre coordinates [Z, Y, X] of the destination volume
+			fill		Value given to destination voxels outside the source volume
+			slabSize	Number of destination Z planes calculated together
+			nThreads	Number of threads (default is the number of cpus)
+		"""
+		self._weights = []
+		for sAx, dAx in zip(srcAxes, dstAxes):
+			ind0, ind1, wt1, inside = axisWeights(sAx, dAx)
+			self._weights.append( (ind0, ind1, (1.0 - wt1).astype('float32'), wt1.astype('float32'), inside) )
+		self._srcShape = tuple([ len(sAx) for sAx in srcAxes ])
+		self._dstShape = tuple([ len(dAx) for dAx in dstAxes ])
+		self._fill = fill
+		self._slabSize = max(int(slabSize), 1)
+		self._nThreads = nThreads
+		if self._nThreads is None:
+			self._nThreads = multiprocessing.cpu_count()
+
+	# ------------------------------------------- #
+
+	def shape(self):
+		"""
+		Return the shape of the destination volume.
+		"""
+		return self._dstShape
+
+	# ------------------------------------------- #
+
+	def resample(self, srcData, out=None, dtype='float32'):
+		"""
+		Resample a whole volume onto the destination grid.
+		srcData can be any array supporting numpy indexing, e.g. a memory mapped file.
+		"""
+		if tuple(srcData.shape) != self._srcShape:
+			raise GridMismatchException("Source volume shape %s does not match the grid %s" \
+						% (str(srcData.shape), str(self._srcShape)))
+
+		if out is None:
+			out = np.empty(self._dstShape, dtype=dtype)
+
+		slabs = [ (z0, min(z0 + self._slabSize, self._dstShape[0])) \
+							for z0 in range(0, self._dstShape[0], self._slabSize) ]
+
+		def runSlab(slab):
+			self.resampleSlab(srcData, slab[0], slab[1], out[slab[0]:slab[1]])
+
+		if self._nThreads > 1 and len(slabs) > 1:
+			pool = ThreadPool(min(self._nThreads, len(slabs)))
+			try:
+				pool.map(runSlab, slabs)
+			finally:
+				pool.close()
+				pool.join()
+		else:
+			for slab in slabs:
+				runSlab(slab)
+
+		return out
+
+	# ------------------------------------------- #
+
+	def resampleSlab(self, srcData, z0, z1, out=None):
+		"""
+		Resample the destination planes z0 to z1-1. Only the source planes needed are read.
+		"""
+		zInd0, zInd1, zWt0, zWt1, zIn = [ wts[z0:z1] for wts in self._weights[0] ]
+		yInd0, yInd1, yWt0, yWt1, yIn = self._weights[1]
+		xInd0, xInd1, xWt0, xWt1, xIn = self._weights[2]
+
+		# Interpolate along Z using only the source planes this slab needs
+		srcPlanes, planeInd = np.unique(np.concatenate((zInd0, zInd1)), return_inverse=True)
+		planes = np.asarray(srcData[srcPlanes], dtype='float32')
+		nz = z1 - z0
+
+		slab = planes[planeInd[:nz]] * zWt0[:,None,None]
+		slab += planes[planeInd[nz:]] * zWt1[:,None,None]
+
+		# Then along Y and X
+		slab = slab[:,yInd0,:] * yWt0[None,:,None] + slab[:,yInd1,:] * yWt1[None,:,None]
+		slab = slab[:,:,xInd0] * xWt0[None,None,:] + slab[:,:,xInd1] * xWt1[None,None,:]
+
+		# Points outside the source volume are set to the fill value
+		inside = zIn[:,None,None] & yIn[None,:,None] & xIn[None,None,:]
+		if not inside.all():
+			slab[~np.broadcast_to(inside, slab.shape)] = self._fill
+
+		if out is None:
+			return slab
+		out[...] = slab
+		return out
+
+# ----------------------------------------- #
+
+def resample(srcData, srcAxes, dstAxes, fill=0.0, slabSize=8, nThreads=None, dtype='float32'):
+	"""
+	Resample a volume from one grid to another, grids are given as voxel centre coordinates [Z, Y, X].
+	"""
+	return gridResampler(srcAxes, dstAxes, fill, slabSize, nThreads).resample(srcData, dtype=dtype)
+
+# ----------------------------------------- #
+
+def resampleDoseToCT(doseData, doseHdr, ctHdr, fill=0.0, slabSize=8, nThreads=None):
+	"""
+	Resample the output of dose.readDose onto the voxel grid of dose.readCT
+	"""
+	return resample(doseData, dose.doseGridAxes(doseHdr), dose.ctGridAxes(ctHdr), \
+					fill, slabSize, nThreads)
+
+# ----------------------------------------- #
+
+def resampleCTToDose(ctData, ctHdr, doseHdr, fill=0.0, slabSize=8, nThreads=None):
+	"""
+	Resample the output of dose.readCT onto the dose grid of dose.readDose
+	"""
+	return resample(ctData, dose.ctGridAxes(ctHdr), dose.doseGridAxes(doseHdr), \
+					fill, slabSize, nThreads)
+
+# ----------------------------------------- #
+
+class GridMismatchException(Exception):
+	pass
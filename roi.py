@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, re, json, mmap, tempfile
+import numpy as np
+from matplotlib.path import Path
+
+import dose
+
+# ----------------------------------------- #
+"""
+Read region of interest contours from a pinnacle plan.roi file and convert them to voxel masks.
+
+The generic pinn2Json parser can not be used for plan.roi files as each roi holds a series of
+curve ={ ... }; sections with the same name, which collapse to a single entry in a dictionary.
+It is also by far the slowest file to parse that way, so plan.roi is streamed by its own reader.
+
+The curves of a roi are stored as a ragged array, one contiguous Nx3 array of vertices and an
+array of offsets, curve i being vertices[offsets[i]:offsets[i+1]]. The names and colours of the
+rois, and where each roi is in the file, are found without parsing any points so single rois can
+be read on their own :
+
+	index = roi.readRoiIndex(planDir + '/plan.roi')
+	rois = roi.readRois(planDir + '/plan.roi', names=['PTV', 'Cord'], index=index)
+
+Geometry metrics (volume, centroid, bounding box and surface area) are calculated from the contour
+vertices directly, with the curves of every roi in the file handled together as one array :
+
+	geom = roi.readRoiGeometry(planDir + '/plan.roi', sliceThickness=ctHdr.z_pixdim)
+	print(geom[0]['name'], geom[0]['volume'], geom[0]['bounds'])
+"""
+
+# Patterns starting with a literal are searched far faster than ones anchored to the start of a line
+ROI_START = re.compile(br'roi[ \t]*=[ \t]*\{')
+POINTS_START = re.compile(br'points[ \t]*=[ \t]*\{')
+POINTS_BLOCK = re.compile(br'points\s*=\s*\{([^}]*)\}')
+ROI_NAME = re.compile(br'^[ \t]*name[ \t]*:([^\n]*)', re.MULTILINE)
+ROI_COLOR = re.compile(br'^[ \t]*color[ \t]*:([^\n]*)', re.MULTILINE)
+
+# ----------------------------------------- #
+
+def readRoiIndex(roiFile):
+	"""
+	Scan a plan.roi file for the name and colour of each roi and its position in the file.
+	The file is memory mapped and searched with regular expressions, the contour points are
+	skipped over without being parsed.
+	Returns a list of dictionaries, one per roi, with the keys:
+		name		The name of the roi
+		color		The display colour of the roi
+		numCurves	The number of curves in the roi
+		start, end	The byte range of the roi in the file
+	"""
+	f = open(roiFile, 'rb')
+	if os.path.getsize(roiFile) == 0:
+		f.close()
+		return []
+	mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+	starts = [ m1.start() for m1 in ROI_START.finditer(mm) \
+				if mm[mm.rfind(b'\n', 0, m1.start())+1:m1.start()].strip() == b'' ]
+	ends = starts[1:] + [len(mm)]
+
+	rois = []
+	for start, end in zip(starts, ends):
+		# The name and colour of the roi come before its first curve
+		firstPoints = POINTS_START.search(mm, start, end)
+		hdrEnd = end if firstPoints is None else firstPoints.start()
+		names = ROI_NAME.findall(mm[start:hdrEnd])
+		color = ROI_COLOR.search(mm, start, end)
+
+		rois.append({'name':names[-1].strip().decode('latin-1') if len(names) > 0 else '', \
+					'color':color.group(1).strip().decode('latin-1') if color is not None else '', \
+					'numCurves':sum([ 1 for m1 in POINTS_START.finditer(mm, start, end) ]), \
+					'start':start, 'end':end})
+
+	mm.close()
+	f.close()
+
+	return rois
+
+# ----------------------------------------- #
+
+def readRois(roiFile, names=None, index=None):
+	"""
+	Read the regions of interest in a plan.roi file.
+	Arguments:
+		names	List of roi names to read (default is all rois)
+		index	The result of readRoiIndex for the file, if already known
+	Returns a list of dictionaries, one per roi, with the keys:
+		name		The name of the roi
+		color		The display colour of the roi
+		vertices	Nx3 numpy array of the x, y, z vertices of all the curves in cm
+		offsets		Start of each curve in vertices, followed by the number of vertices
+		curves		A list of views of vertices, one per curve
+	"""
+	if index is None:
+		index = readRoiIndex(roiFile)
+
+	rois = []
+	f = open(roiFile, 'rb')
+	for entry in index:
+		if names is not None and entry['name'] not in names:
+			continue
+		f.seek(entry['start'])
+		vertices, offsets = parseCurves(f.read(entry['end'] - entry['start']))
+		rois.append({'name':entry['name'], 'color':entry['color'], 'vertices':vertices, 'offsets':offsets, \
+					'curves':[ vertices[offsets[cc]:offsets[cc+1]] for cc in range(len(offsets)-1) ]})
+	f.close()
+
+	return rois
+
+# ----------------------------------------- #
+
+def parseCurves(roiTxt):
+	"""
+	Parse the points={ ... }; blocks in the text of a roi into a ragged array of vertices and offsets.
+	"""
+	curves = [ np.fromstring(block.decode('latin-1'), dtype='float64', sep=' ') \
+				for block in POINTS_BLOCK.findall(roiTxt) ]
+	offsets = np.concatenate(([0], np.cumsum([ curve.size // 3 for curve in curves ]))).astype(np.int64)
+
+	if len(curves) == 0:
+		return np.zeros((0,3)), offsets
+
+	values = np.concatenate(curves)
+	if values.size != 3 * offsets[-1]:
+		raise RoiFormatException("Contour points are not in x y z triplets")
+
+	return values.reshape((-1,3)), offsets
+
+# ----------------------------------------- #
+
+def roiMask(curves, imHdr, offsets=None):
+	"""
+	Rasterise the contours of a roi onto a dose grid and return a boolean mask
+	with the shape of the dose cube (Z, Y, X).
+	curves is either a list of Nx3 arrays or, with offsets, the ragged vertex array from readRois.
+	Each dose slice takes the contours of the nearest contour slice, up to half the contour spacing
+	beyond the first and last. A voxel is inside the roi if its centre is inside those contours,
+	contours on the same slice are combined with the even-odd rule so that holes are excluded.
+	"""
+	shape = (imHdr.Dimension.Z, imHdr.Dimension.Y, imHdr.Dimension.X)
+	mask = np.zeros(shape, dtype=bool)
+
+	if offsets is None:
+		offsets = np.concatenate(([0], np.cumsum([ curve.shape[0] for curve in curves ]))).astype(np.int64)
+		curves = np.concatenate(curves) if len(curves) > 0 else np.zeros((0,3))
+
+	starts = offsets[:-1][np.diff(offsets) >= 3]
+	if len(starts) == 0:
+		return mask
+
+	# Convert all the vertices to voxel indices at once
+	xAll, yAll, zAll = dose.coordToIndex(imHdr, curves[:,0], curves[:,1], curves[:,2])
+
+	# Group the curves by the slice they were drawn on
+	curveZ = np.round(curves[starts,2], 4)
+	sliceZ, curveSlice = np.unique(curveZ, return_inverse=True)
+	sliceInd = dose.coordToIndex(imHdr, 0.0, 0.0, sliceZ)[2]
+	halfGap = 0.5
+	if len(sliceInd) > 1:
+		halfGap = max(0.5 * np.median(np.diff(sliceInd)), halfGap)
+
+	zInds = np.arange(shape[0])
+	nearest = np.abs(sliceInd[np.newaxis,:] - zInds[:,np.newaxis]).argmin(axis=1)
+	covered = np.abs(sliceInd[nearest] - zInds) <= halfGap + 1.0e-6
+
+	layers = {}
+	for zz in np.flatnonzero(covered):
+		sInd = nearest[zz]
+		if sInd not in layers:
+			layers[sInd] = sliceMask(xAll, yAll, offsets, starts[curveSlice == sInd], shape[1:])
+		mask[zz] = layers[sInd]
+
+	return mask
+
+# ----------------------------------------- #
+
+def sliceMask(xAll, yAll, offsets, starts, shape):
+	"""
+	Rasterise the curves of one contour slice, starting at vertex indices starts, onto a (Y, X) plane
+	of the dose grid, combining them with the even-odd rule.
+	"""
+	layer = np.zeros(shape, dtype=bool)
+
+	for c0 in starts:
+		c1 = offsets[np.searchsorted(offsets, c0, side='right')]
+		xInd, yInd = xAll[c0:c1], yAll[c0:c1]
+
+		# Only test the voxel centres inside the bounding box of the contour
+		x0 = max(int(np.ceil(xInd.min())), 0)
+		x1 = min(int(np.floor(xInd.max())), shape[1]-1)
+		y0 = max(int(np.ceil(yInd.min())), 0)
+		y1 = min(int(np.floor(yInd.max())), shape[0]-1)
+		if x1 < x0 or y1 < y0:
+			continue
+
+		yy, xx = np.mgrid[y0:y1+1, x0:x1+1]
+		inside = Path(np.column_stack((xInd, yInd))).contains_points( \
+					np.column_stack((xx.ravel(), yy.ravel())))
+
+		layer[y0:y1+1, x0:x1+1] ^= inside.reshape(xx.shape)
+
+	return layer
+
+# ----------------------------------------- #
+
+def readRoiGeometry(roiFile, sliceThickness=None, useCache=True):
+	"""
+	Return the geometry metrics of every roi in a plan.roi file (see roiGeometry).
+	The result is stored next to the file in roiFile + '.geometry.json', as pinn.read does for
+	the files it parses, and reused while it is newer than the roi file. JSON stores tuples as
+	lists, so the centroid and bounds of a cached result are converted back. A cache file that can't
+	be read is recalculated, and failing to write it (e.g. on a read only mount) is ignored.
+	"""
+	cacheFile = roiFile + '.geometry.json'
+
+	if useCache and os.path.exists(cacheFile) and os.path.getmtime(cacheFile) >= os.path.getmtime(roiFile):
+		try:
+			f = open(cacheFile)
+			try:
+				cached = json.load(f)
+			finally:
+				f.close()
+		except (IOError, OSError, ValueError):
+			cached = None
+		if not isinstance(cached, dict) or 'rois' not in cached:
+			cached = None
+		if cached is not None and cached.get('sliceThickness') == sliceThickness:
+			for res in cached['rois']:
+				if res['centroid'] is not None:
+					res['centroid'] = tuple(res['centroid'])
+				if res['bounds'] is not None:
+					res['bounds'] = tuple([ tuple(bb) for bb in res['bounds'] ])
+			return cached['rois']
+
+	geom = roiGeometry(readRois(roiFile), sliceThickness)
+
+	if useCache:
+		# Written to a temporary file renamed over the cache so an interrupted write leaves no partial file
+		tmpFile = None
+		try:
+			fd, tmpFile = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(cacheFile)))
+			f = os.fdopen(fd, 'w')
+			try:
+				json.dump({'sliceThickness':sliceThickness, 'rois':geom}, f)
+			finally:
+				f.close()
+			os.rename(tmpFile, cacheFile)
+		except (IOError, OSError):
+			if tmpFile is not None and os.path.exists(tmpFile):
+				os.remove(tmpFile)
+
+	return geom
+
+# ----------------------------------------- #
+
+def roiGeometry(rois, sliceThickness=None):
+	"""
+	Calculate the volume, centroid, bounding box and surface area of a list of rois from readRois
+	without rasterising them, working on the ragged vertex arrays of all the rois at once. Each
+	contour is treated as a prism extending half way to the neighbouring contours of the roi, with
+	areas from the shoelace formula. Contours on the same slice are combined with the even-odd rule,
+	as in roiMask, so holes are subtracted.
+	Arguments:
+		sliceThickness	Thickness of each contour in cm, usually the CT slice thickness (default is
+							the spacing between contours, or for rois on a single slice the median
+							contour spacing of all rois)
+	Returns a list with a dictionary per roi with the keys :
+		name, numCurves, volume (cm^3), centroid (x, y, z in cm), bounds ((xMin,xMax), (yMin,yMax),
+		(zMin,zMax)) in cm as used by dose.readCT and surfaceArea (cm^2)
+	"""
+	result = [ {'name':rr['name'], 'numCurves':0, 'volume':0.0, 'centroid':None, 'bounds':None, \
+				'surfaceArea':0.0} for rr in rois ]
+
+	# Join the ragged arrays of every roi, dropping curves of less than 3 points
+	roiVertices = []
+	counts = []
+	curveRoi = []
+	for rInd, rr in enumerate(rois):
+		if 'offsets' in rr:
+			rrOffsets = rr['offsets']
+			rrVertices = rr['vertices']
+		else:
+			rrOffsets = np.concatenate(([0], np.cumsum([ curve.shape[0] for curve in rr['curves'] ]))).astype(np.int64)
+			rrVertices = np.concatenate(rr['curves']) if len(rr['curves']) > 0 else np.zeros((0,3))
+		rrCounts = np.diff(rrOffsets)
+		keep = rrCounts >= 3
+		if np.all(keep):
+			roiVertices.append(rrVertices)
+		else:
+			roiVertices.append(rrVertices[np.repeat(keep, rrCounts)])
+		counts.append(rrCounts[keep])
+		curveRoi.append(np.full(np.count_nonzero(keep), rInd, dtype=int))
+
+	counts = np.concatenate(counts) if len(counts) > 0 else np.zeros(0, dtype=int)
+	if len(counts) == 0:
+		return result
+
+	vertices = np.concatenate(roiVertices)
+	offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+	curveRoi = np.concatenate(curveRoi)
+
+	area, momentX, momentY, perimeter, curveZ = curveGeometry(vertices, offsets)
+	signs = curveSigns(vertices, offsets, curveRoi, curveZ)
+	area *= signs
+	momentX *= signs
+	momentY *= signs
+
+	# Contours of a roi on the same slice are summed, holes have negative area
+	sliceKeys, sliceInd = np.unique(np.column_stack((curveRoi, np.round(curveZ, 4))), axis=0, return_inverse=True)
+	sliceInd = sliceInd.ravel()
+	sliceRoi = sliceKeys[:,0].astype(int)
+	sliceZ = sliceKeys[:,1]
+	sliceArea = np.bincount(sliceInd, area)
+	sliceMomentX = np.bincount(sliceInd, momentX)
+	sliceMomentY = np.bincount(sliceInd, momentY)
+	slicePerimeter = np.bincount(sliceInd, perimeter)
+
+	thickness, isEnd = sliceThicknesses(sliceRoi, sliceZ, sliceThickness)
+
+	nRois = len(rois)
+	volume = np.bincount(sliceRoi, sliceArea * thickness, minlength=nRois)
+	sumX = np.bincount(sliceRoi, sliceMomentX * thickness, minlength=nRois)
+	sumY = np.bincount(sliceRoi, sliceMomentY * thickness, minlength=nRois)
+	sumZ = np.bincount(sliceRoi, sliceArea * sliceZ * thickness, minlength=nRois)
+	surface = np.bincount(sliceRoi, slicePerimeter * thickness + isEnd * np.abs(sliceArea), minlength=nRois)
+	numCurves = np.bincount(curveRoi, minlength=nRois)
+
+	# Curves are in roi order so the vertices of each roi are contiguous
+	roiStarts = offsets[np.searchsorted(curveRoi, np.arange(nRois))]
+	hasCurves = np.flatnonzero(numCurves)
+	vMin = np.minimum.reduceat(vertices, roiStarts[hasCurves], axis=0)
+	vMax = np.maximum.reduceat(vertices, roiStarts[hasCurves], axis=0)
+
+	for ii, rInd in enumerate(hasCurves):
+		res = result[rInd]
+		res['numCurves'] = int(numCurves[rInd])
+		res['volume'] = float(volume[rInd])
+		res['surfaceArea'] = float(surface[rInd])
+		res['bounds'] = tuple([ (float(vMin[ii,ax]), float(vMax[ii,ax])) for ax in range(3) ])
+		if volume[rInd] > 0:
+			res['centroid'] = (sumX[rInd] / volume[rInd], sumY[rInd] / volume[rInd], sumZ[rInd] / volume[rInd])
+
+	return result
+
+# ----------------------------------------- #
+
+def curveGeometry(vertices, offsets):
+	"""
+	Calculate the area, first moments of area and perimeter of a set of closed planar contours stored
+	as a ragged array, curve i being vertices[offsets[i]:offsets[i+1]].
+	Areas are positive whatever the direction of the contour, the moments are the centroid x and y
+	times the area. Also returns the z of each contour.
+	"""
+	starts = offsets[:-1]
+	counts = np.diff(offsets)
+
+	# Index of the next vertex of each vertex, wrapping round to the start of its curve
+	nxt = np.arange(1, vertices.shape[0] + 1)
+	nxt[offsets[1:] - 1] = starts
+
+	x, y = vertices[:,0], vertices[:,1]
+	xn, yn = x[nxt], y[nxt]
+	cross = x * yn - xn * y
+
+	area = 0.5 * np.add.reduceat(cross, starts)
+	orient = np.where(area < 0, -1.0, 1.0)
+	momentX = orient * np.add.reduceat((x + xn) * cross, starts) / 6.0
+	momentY = orient * np.add.reduceat((y + yn) * cross, starts) / 6.0
+	perimeter = np.add.reduceat(np.hypot(xn - x, yn - y), starts)
+	curveZ = np.add.reduceat(vertices[:,2], starts) / counts
+
+	return np.abs(area), momentX, momentY, perimeter, curveZ
+
+# ----------------------------------------- #
+
+def curveSigns(vertices, offsets, curveRoi, curveZ):
+	"""
+	Return +1 for each contour or -1 if it is a hole, i.e. inside an odd number of the other contours
+	of its roi on the same slice. Only slices with more than one contour are tested.
+	"""
+	signs = np.ones(len(curveZ))
+
+	keys = np.column_stack((curveRoi, np.round(curveZ, 4)))
+	order = np.lexsort((keys[:,1], keys[:,0]))
+	sameAsNext = np.all(keys[order][1:] == keys[order][:-1], axis=1)
+	groupStarts = np.flatnonzero(np.concatenate(([True], ~sameAsNext)))
+	groupEnds = np.concatenate((groupStarts[1:], [len(order)]))
+
+	for g0, g1 in zip(groupStarts, groupEnds):
+		if g1 - g0 < 2:
+			continue
+		group = order[g0:g1]
+		paths = [ Path(vertices[offsets[cc]:offsets[cc+1], :2]) for cc in group ]
+		for ii, cc in enumerate(group):
+			depth = 0
+			for jj in range(len(group)):
+				if jj != ii and paths[jj].contains_point(vertices[offsets[cc], :2]):
+					depth += 1
+			if depth % 2 == 1:
+				signs[cc] = -1.0
+
+	return signs
+
+# ----------------------------------------- #
+
+def sliceThicknesses(sliceRoi, sliceZ, sliceThickness=None):
+	"""
+	Return the thickness of each roi slice and whether it is the first or last slice of its roi.
+	Without a given thickness each slice extends half way to its neighbours, or the distance to its
+	only neighbour for end slices.
+	"""
+	order = np.lexsort((sliceZ, sliceRoi))
+	roiS = sliceRoi[order]
+	zS = sliceZ[order]
+
+	sameNext = np.concatenate((roiS[1:] == roiS[:-1], [False]))
+	samePrev = np.concatenate(([False], roiS[1:] == roiS[:-1]))
+	isEnd = np.empty(len(order))
+	isEnd[order] = (~sameNext).astype(float) + (~samePrev).astype(float)
+
+	if sliceThickness is not None:
+		return np.full(len(order), float(sliceThickness)), isEnd
+
+	gapNext = np.where(sameNext, np.concatenate((zS[1:] - zS[:-1], [0.0])), np.nan)
+	gapPrev = np.where(samePrev, np.concatenate(([0.0], zS[1:] - zS[:-1])), np.nan)
+
+	thick = np.where(np.isnan(gapNext), gapPrev, np.where(np.isnan(gapPrev), gapNext, 0.5 * (gapNext + gapPrev)))
+
+	# Rois on a single slice take the typical spacing of the other rois
+	gaps = gapNext[~np.isnan(gapNext)]
+	thick[np.isnan(thick)] = np.median(gaps) if len(gaps) > 0 else 0.0
+
+	thickness = np.empty(len(order))
+	thickness[order] = thick
+	return thickness, isEnd
+
+# ----------------------------------------- #
+
+class RoiFormatException(Exception):
+	pass
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, tempfile, uuid
+import numpy as np
+
+try:
+	from multiprocessing import shared_memory
+except ImportError:
+	shared_memory = None
+
+import pinnObjDict
+import dose
+
+# ----------------------------------------- #
+"""
+Share CT and dose volumes between the processes of a multiprocessing pipeline.
+
+A volume is loaded once into a block of shared memory (multiprocessing.shared_memory on python 3.8+,
+otherwise a memory mapped file in /dev/shm or the temp directory) and described by a small picklable
+sharedVolume carrying the shape, data type and header of the volume. Workers receive the descriptor
+and read it to get a numpy view of the shared block with the same (data, header) return as readCT
+and readDose, so nothing is copied or read from disk again.
+
+	ctShared = sharedVolume.shareCT(planTrialFile)
+	doseShared = sharedVolume.shareDose(planTrialFile, 0)
+
+	def worker(args):
+		ctShared, doseShared, roiName = args
+		ctData, ctHdr = ctShared.read()
+		doseData, doseHdr = doseShared.read()
+		...
+
+	pool.map(worker, [ (ctShared, doseShared, name) for name in roiNames ])
+	ctShared.unlink()
+	doseShared.unlink()
+"""
+
+# ----------------------------------------- #
+
+def shareCT(planTrialFile, zRange=None, bounds=None, useShm=None, tmpDir=None):
+	"""
+	Load the CT of a plan into shared memory and return its sharedVolume.
+	zRange and bounds select a sub-volume as for dose.readCT. The image is copied from the
+	memory mapped file a slab at a time and stored as native int16.
+	"""
+	ctData, ctHdr = dose.readCT(planTrialFile, mmap=True, zRange=zRange, bounds=bounds)
+	return shareArray(ctData, ctHdr, dtype='int16', useShm=useShm, tmpDir=tmpDir)
+
+# ----------------------------------------- #
+
+def shareDose(planTrialFile, trNum, chooseBmInd=-1, cache=None, beamWeights=None, prescriptionDose=None, \
+				numberOfFractions=None, useShm=None, tmpDir=None):
+	"""
+	Load the dose of a trial into shared memory and return its sharedVolume. Arguments are as for
+	dose.readDose, the weighted beam sum is formed slab by slab straight into the shared block.
+	"""
+	bmInds, bmDoses, bmFactors, doseHdr = dose.trialBeamDoses(planTrialFile, trNum, chooseBmInd, cache, \
+												beamWeights, prescriptionDose, numberOfFractions)
+	shape = (doseHdr.Dimension.Z, doseHdr.Dimension.Y, doseHdr.Dimension.X)
+	return shareArray(dose.beamDoseSum(bmDoses, bmFactors, shape), doseHdr, dtype='float64', \
+						useShm=useShm, tmpDir=tmpDir)
+
+# ----------------------------------------- #
+
+def shareArray(data, header=None, dtype=None, useShm=None, tmpDir=None, slabSize=16):
+	"""
+	Copy a (Z, Y, X) volume into shared memory and return its sharedVolume.
+	Arguments:
+		data		Any volume that can be sliced along Z, e.g. an array, a memory map or a dose.beamDoseSum
+		header		The header of the volume (ImageSet header or DoseGrid), returned with the data by read
+		dtype		Data type stored (default is that of data)
+		useShm		Use multiprocessing.shared_memory rather than a memory mapped file
+						(default is to use it when available)
+		tmpDir		Directory of the memory mapped file (default is /dev/shm if present, else the temp directory)
+		slabSize	Number of Z planes copied at a time
+	"""
+	if dtype is None:
+		dtype = data.dtype
+	dtype = np.dtype(dtype)
+
+	if useShm is None:
+		useShm = shared_memory is not None
+
+	vol = sharedVolume.create(data.shape, dtype, header, useShm, tmpDir)
+	out = vol.array(writeable=True)
+	for z0 in range(0, data.shape[0], slabSize):
+		out[z0:z0+slabSize] = data[z0:z0+slabSize]
+	del out
+
+	return vol
+
+# ----------------------------------------- #
+
+def attach(vol, writeable=False):
+	"""
+	Return the (data, header) of a sharedVolume, as returned by dose.readCT or dose.readDose.
+	"""
+	return vol.read(writeable)
+
+# ----------------------------------------- #
+
+class sharedVolume():
+	"""
+	Picklable descriptor of a volume held in shared memory. Only the name of the shared block and the
+	geometry are pickled, each process maps the block itself the first time its data is accessed.
+	The process that created the volume owns it and should call unlink when every worker is finished.
+	"""
+	def __init__(self, name, shape, dtype, header=None, useShm=True):
+		self.name = name
+		self.shape = tuple(shape)
+		self.dtype = np.dtype(dtype).str
+		self.header = header if header is None else dict(header)
+		self.useShm = useShm
+
+		self._owner = False
+		self._shm = None
+		self._data = None
+
+	# ------------------------------------------- #
+
+	@classmethod
+	def create(cls, shape, dtype, header=None, useShm=True, tmpDir=None):
+		"""
+		Allocate a new shared block for a volume, the calling process becomes its owner.
+		"""
+		dtype = np.dtype(dtype)
+		nBytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+
+		if useShm:
+			if shared_memory is None:
+				raise SharedVolumeException("multiprocessing.shared_memory needs python 3.8 or later")
+			shm = shared_memory.SharedMemory(create=True, size=nBytes)
+			vol = cls(shm.name, shape, dtype, header, True)
+			vol._shm = shm
+		else:
+			if tmpDir is None:
+				tmpDir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+			fileName = os.path.join(tmpDir, 'pinnpy_%s.vol' % uuid.uuid4().hex)
+			f = open(fileName, 'wb')
+			f.truncate(nBytes)
+			f.close()
+			vol = cls(fileName, shape, dtype, header, False)
+
+		vol._owner = True
+		return vol
+
+	# ------------------------------------------- #
+
+	def __getstate__(self):
+		"""
+		Pickle only the description of the volume, never the mapping or ownership.
+		"""
+		return {'name':self.name, 'shape':self.shape, 'dtype':self.dtype, 'header':self.header, \
+				'useShm':self.useShm}
+
+	# ------------------------------------------- #
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._owner = False
+		self._shm = None
+		self._data = None
+
+	# ------------------------------------------- #
+
+	def array(self, writeable=False):
+		"""
+		Return a numpy view of the shared volume, read only unless writeable is set.
+		"""
+		if self._data is None:
+			if self.useShm:
+				if self._shm is None:
+					self._shm = attachShm(self.name)
+				self._data = np.asarray(shmBuffer(self._shm, self.shape, self.dtype))
+			else:
+				self._data = np.memmap(self.name, dtype=self.dtype, mode='r+', shape=self.shape)
+
+		view = self._data.view()
+		view.flags.writeable = writeable
+		return view
+
+	# ------------------------------------------- #
+
+	def read(self, writeable=False):
+		"""
+		Return the (data, header) of the volume, as returned by dose.readCT or dose.readDose.
+		"""
+		header = None
+		if self.header is not None:
+			header = pinnObjDict.pinnObjDict(self.header)
+		return self.array(writeable), header
+
+	# ------------------------------------------- #
+
+	def close(self):
+		"""
+		Release this process's mapping of the volume. The block stays mapped until every view already
+		returned has been freed.
+		"""
+		self._data = None
+		self._shm = None
+
+	# ------------------------------------------- #
+
+	def unlink(self):
+		"""
+		Free the shared block, called by the owner once every worker is finished. As with close, views
+		already returned stay valid and the memory is released when the last of them is freed.
+		"""
+		self._data = None
+		if self.useShm:
+			shm = self._shm if self._shm is not None else attachShm(self.name)
+			self._shm = None
+			shm.unlink()
+		elif os.path.exists(self.name):
+			os.remove(self.name)
+
+	# ------------------------------------------- #
+
+	def __enter__(self):
+		return self
+
+	# ------------------------------------------- #
+
+	def __exit__(self, excType, excValue, traceback):
+		if self._owner:
+			self.unlink()
+		else:
+			self.close()
+
+# ----------------------------------------- #
+
+def attachShm(name):
+	"""
+	Attach to an existing shared memory block. On python 3.13+ the block isn't registered with the
+	resource tracker as it belongs to the owner. Processes started by multiprocessing share the resource
+	tracker of their parent, so on earlier versions registering it again is harmless.
+	"""
+	try:
+		return shared_memory.SharedMemory(name=name, track=False)
+	except TypeError:
+		return shared_memory.SharedMemory(name=name)
+
+# ----------------------------------------- #
+
+class shmBuffer():
+	"""
+	Array interface to a shared memory block that keeps the block attached. Arrays made from it hold it
+	as their base, so the block is only closed once the last view of it has been freed.
+	"""
+	def __init__(self, shm, shape, dtype):
+		self._shm = shm
+		# The address is taken from a temporary array so no buffer export of the block is left open
+		address = np.frombuffer(shm.buf, dtype='u1').ctypes.data
+		self.__array_interface__ = {'shape':tuple(shape), 'typestr':np.dtype(dtype).str, \
+									'data':(address, False), 'version':3}
+
+# ----------------------------------------- #
+
+class SharedVolumeException(Exception):
+	pass
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, sys, shutil, tempfile, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive
+import export
+
+# ----------------------------------------- #
+
+def writePlan(planDir, ct):
+	"""
+	Write a plan with a big endian CT and a trial with one beam dose.
+	"""
+	nz, ny, nx = ct.shape
+	f = open(os.path.join(planDir, 'plan.defaults'), 'w')
+	f.write('image_file      : ImageSet_0\n')
+	f.close()
+
+	ct.astype('>i2').tofile(os.path.join(planDir, 'ImageSet_0.img'))
+	f = open(os.path.join(planDir, 'ImageSet_0.header'), 'w')
+	f.write('byte_order = 1;\nx_dim = %d;\ny_dim = %d;\nz_dim = %d;\nx_pixdim = 0.25;\ny_pixdim = 0.25;\n' \
+			'z_pixdim = 0.3;\nx_start = -4;\ny_start = -3.5;\nz_start = -3.6;\n' % (nx, ny, nz))
+	f.close()
+
+	f = open(os.path.join(planDir, 'plan.Trial'), 'w')
+	f.write('Trial ={\n  Name = "T1";\n' \
+			'  DoseGrid .VoxelSize .X = 0.4;\n  DoseGrid .VoxelSize .Y = 0.4;\n  DoseGrid .VoxelSize .Z = 0.5;\n' \
+			'  DoseGrid .Dimension .X = 4;\n  DoseGrid .Dimension .Y = 3;\n  DoseGrid .Dimension .Z = 2;\n' \
+			'  DoseGrid .Origin .X = -1;\n  DoseGrid .Origin .Y = -1;\n  DoseGrid .Origin .Z = -1;\n' \
+			'  BeamList ={\n    Beam ={\n      Name = "B0";\n      Weight = 100;\n' \
+			'      DoseVolume = \\XDR:0\\;\n    };\n  };\n};\n')
+	f.close()
+	np.ones((2, 3, 4), dtype='>f4').tofile(os.path.join(planDir, 'plan.Trial.binary.000'))
+
+# ----------------------------------------- #
+
+class exportCTTest(unittest.TestCase):
+
+	def setUp(self):
+		self.planDir = tempfile.mkdtemp()
+		self.ct = np.random.RandomState(0).randint(-1000, 1500, size=(10, 12, 16)).astype('>i2')
+		writePlan(self.planDir, self.ct)
+		self.planTrialFile = os.path.join(self.planDir, 'plan.Trial')
+
+	def tearDown(self):
+		shutil.rmtree(self.planDir)
+
+	# ----------------------------------------- #
+
+	def rawData(self, fileName):
+		"""
+		Return the voxel data following the header of an attached NRRD file.
+		"""
+		f = open(fileName, 'rb')
+		data = f.read()
+		f.close()
+		return data[data.index(b'\n\n') + 2:]
+
+	def headerFields(self, fileName, sep):
+		"""
+		Return the fields of a NRRD (sep ':') or MetaImage (sep '=') header as a dictionary of strings.
+		"""
+		f = open(fileName, 'rb')
+		lines = f.read().decode('ascii', 'replace').split('\n')
+		f.close()
+		fields = {}
+		for line in lines:
+			if line == '' and sep == ':':
+				break
+			if sep in line and not line.startswith('#'):
+				key, value = line.split(sep, 1)
+				fields[key.strip()] = value.strip()
+		return fields
+
+	# ----------------------------------------- #
+
+	def testExportAfterCompression(self):
+		"""
+		The CT exported from the archive is identical to the one exported from the .img file
+		"""
+		export.exportCT(self.planTrialFile, os.path.join(self.planDir, 'before.nrrd'))
+		archive.compressPlan(self.planDir, slabSize=4, removeOriginal=True)
+		self.assertFalse(os.path.exists(os.path.join(self.planDir, 'ImageSet_0.img')))
+
+		export.exportCT(self.planTrialFile, os.path.join(self.planDir, 'after.nrrd'))
+		export.exportCT(self.planTrialFile, os.path.join(self.planDir, 'after.nhdr'))
+
+		before = self.rawData(os.path.join(self.planDir, 'before.nrrd'))
+		self.assertEqual(before, self.ct.tobytes())
+		self.assertEqual(self.rawData(os.path.join(self.planDir, 'after.nrrd')), before)
+		f = open(os.path.join(self.planDir, 'after.raw'), 'rb')
+		self.assertEqual(f.read(), before)
+		f.close()
+
+	# ----------------------------------------- #
+
+	def testNrrdHeader(self):
+		"""
+		The NRRD geometry is written as plain numbers in mm
+		"""
+		export.exportCT(self.planTrialFile, os.path.join(self.planDir, 'ct.nhdr'))
+		fields = self.headerFields(os.path.join(self.planDir, 'ct.nhdr'), ':')
+
+		self.assertEqual([ int(vv) for vv in fields['sizes'].split() ], [16, 12, 10])
+		directions = [ [ float(vv) for vv in dd.strip('()').split(',') ] for dd in fields['space directions'].split() ]
+		self.assertEqual(directions, [[2.5, 0.0, 0.0], [0.0, -2.5, 0.0], [0.0, 0.0, 3.0]])
+		origin = [ float(vv) for vv in fields['space origin'].strip('()').split(',') ]
+		self.assertEqual(origin, [-40.0, -5.0, -36.0])
+
+	def testMetaImageHeader(self):
+		"""
+		The MetaImage geometry is written as plain numbers in mm
+		"""
+		export.exportCT(self.planTrialFile, os.path.join(self.planDir, 'ct.mhd'))
+		fields = self.headerFields(os.path.join(self.planDir, 'ct.mhd'), '=')
+
+		self.assertEqual([ float(vv) for vv in fields['Offset'].split() ], [-40.0, -5.0, -36.0])
+		self.assertEqual([ float(vv) for vv in fields['ElementSpacing'].split() ], [2.5, 2.5, 3.0])
+		self.assertEqual([ int(vv) for vv in fields['TransformMatrix'].split() ], [1, 0, 0, 0, -1, 0, 0, 0, 1])
+		self.assertEqual([ int(vv) for vv in fields['DimSize'].split() ], [16, 12, 10])
+
+# ----------------------------------------- #
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, sys, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pinnObjDict
+import gamma
+
+# ----------------------------------------- #
+
+def doseHeader(shape, voxSize, origin):
+	"""
+	Return a DoseGrid header of a (Z, Y, X) shape, voxel size and origin.
+	"""
+	return pinnObjDict.pinnObjDict({'Dimension':{'Z':shape[0], 'Y':shape[1], 'X':shape[2]}, \
+					'VoxelSize':{'Z':voxSize[0], 'Y':voxSize[1], 'X':voxSize[2]}, \
+					'Origin':{'Z':origin[0], 'Y':origin[1], 'X':origin[2]}})
+
+# ----------------------------------------- #
+
+class gammaIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		"""
+		A gaussian dose with a zero dose region around it
+		"""
+		shape = (12, 14, 16)
+		zz, yy, xx = np.meshgrid(*[ np.arange(nn) - nn / 2.0 for nn in shape ], indexing='ij')
+		self.dose = 60.0 * np.exp(-(zz**2 + yy**2 + xx**2) / 8.0)
+		self.dose[self.dose < 1.0] = 0.0
+		self.hdr = doseHeader(shape, (0.3, 0.3, 0.3), (-2.0, -2.0, -2.0))
+
+	# ----------------------------------------- #
+
+	def testIdenticalGlobal(self):
+		"""
+		A dose compared with itself passes everywhere in global mode
+		"""
+		gam = gamma.gammaIndex(self.dose, self.hdr, self.dose, self.hdr, cutoff=0.0, nThreads=1)
+		self.assertEqual(gamma.gammaPassRate(gam), 100.0)
+
+	def testIdenticalLocal(self):
+		"""
+		A dose compared with itself passes everywhere in local mode, including zero dose voxels
+		"""
+		with np.errstate(divide='raise', invalid='raise'):
+			gam = gamma.gammaIndex(self.dose, self.hdr, self.dose, self.hdr, local=True, cutoff=0.0, \
+									nThreads=1)
+		self.assertFalse(np.isnan(gam).any())
+		self.assertEqual(gamma.gammaPassRate(gam), 100.0)
+
+# ----------------------------------------- #
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, sys, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pinnObjDict
+import roi
+
+# ----------------------------------------- #
+
+def cylinderCurves(radius, zValues, nPoints=64):
+	"""
+	Return the contours of a cylinder along z centred on the origin, one circle per z.
+	"""
+	angles = np.linspace(0.0, 2.0 * np.pi, nPoints, endpoint=False)
+	return [ np.column_stack((radius * np.cos(angles), radius * np.sin(angles), np.full(nPoints, zz))) \
+				for zz in zValues ]
+
+# ----------------------------------------- #
+
+def doseHeader(shape, voxSize, origin):
+	"""
+	Return a DoseGrid header of a (Z, Y, X) shape, voxel size and origin.
+	"""
+	return pinnObjDict.pinnObjDict({'Dimension':{'Z':shape[0], 'Y':shape[1], 'X':shape[2]}, \
+					'VoxelSize':{'Z':voxSize[0], 'Y':voxSize[1], 'X':voxSize[2]}, \
+					'Origin':{'Z':origin[0], 'Y':origin[1], 'X':origin[2]}})
+
+# ----------------------------------------- #
+
+class roiMaskTest(unittest.TestCase):
+
+	def testCylinderVolume(self):
+		"""
+		Contours 0.3 cm apart on a 0.5 cm dose grid, so some dose slices have two contours nearest
+		"""
+		radius = 2.0
+		zValues = np.arange(21) * 0.3 + 1.0
+		hdr = doseHeader((20, 40, 40), (0.5, 0.25, 0.25), (0.0, -5.0, -5.0))
+
+		mask = roi.roiMask(cylinderCurves(radius, zValues), hdr)
+
+		counts = mask.sum(axis=(1,2))
+		filled = counts[counts > 0]
+		self.assertTrue(np.all(filled == filled[0]))
+		self.assertEqual(len(filled), np.count_nonzero(np.diff(np.flatnonzero(counts)) == 1) + 1)
+
+		volume = mask.sum() * 0.5 * 0.25 * 0.25
+		expected = np.pi * radius ** 2 * (zValues[-1] - zValues[0] + 0.3)
+		self.assertAlmostEqual(volume / expected, 1.0, delta=0.1)
+
+	# ----------------------------------------- #
+
+	def testHole(self):
+		"""
+		A contour inside another on the same slice is a hole
+		"""
+		hdr = doseHeader((4, 40, 40), (1.0, 0.25, 0.25), (0.0, -5.0, -5.0))
+		curves = cylinderCurves(3.0, [1.0, 2.0]) + cylinderCurves(1.0, [1.0, 2.0])
+
+		mask = roi.roiMask(curves, hdr)
+
+		self.assertFalse(mask[1, 20, 20])
+		self.assertTrue(mask[1, 20, 10])
+		self.assertEqual(mask[1].sum(), mask[2].sum())
+
+# ----------------------------------------- #
+
+if __name__ == '__main__':
+	unittest.main()
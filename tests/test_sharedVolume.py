@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os, sys, gc, pickle, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sharedVolume
+
+# ----------------------------------------- #
+
+@unittest.skipIf(sharedVolume.shared_memory is None, "multiprocessing.shared_memory needs python 3.8 or later")
+class sharedVolumeTest(unittest.TestCase):
+
+	def setUp(self):
+		self.data = np.arange(4 * 5 * 6, dtype='float64').reshape((4, 5, 6))
+		self.vol = sharedVolume.shareArray(self.data, {'Name':'test'})
+
+	def tearDown(self):
+		if self.vol is not None:
+			self.vol.unlink()
+
+	# ----------------------------------------- #
+
+	def testPickledDescriptor(self):
+		"""
+		The view read through an unpickled descriptor stays valid after the descriptor is freed
+		"""
+		data, hdr = pickle.loads(pickle.dumps(self.vol)).read()
+		gc.collect()
+		self.assertEqual(data.sum(), self.data.sum())
+		self.assertEqual(hdr.Name, 'test')
+
+	def testViewAfterUnlink(self):
+		"""
+		Views read before the block is unlinked stay valid
+		"""
+		data, hdr = self.vol.read()
+		self.vol.unlink()
+		self.vol = None
+		gc.collect()
+		self.assertEqual(data.sum(), self.data.sum())
+		self.assertFalse(data.flags.writeable)
+
+# ----------------------------------------- #
+
+if __name__ == '__main__':
+	unittest.main()
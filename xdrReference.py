@@ -0,0 +1,87 @@
+import os, re, weakref
+
+# ------------------------------------------- #
+
+XDR_PATTERN = re.compile(r'^XDR-([0-9]+)$')
+
+# Arrays mapped by any reference, by file name, so every reference to a binary file shares one map
+mappedArrays = weakref.WeakValueDictionary()
+
+try:
+	stringTypes = basestring
+except NameError:
+	stringTypes = str
+
+# ------------------------------------------- #
+
+def isXdr(value):
+	"""
+	Check if a value read from a pinnacle file is a reference to a binary file, written as "XDR-n" by pinn2Json
+	"""
+	return isinstance(value, stringTypes) and XDR_PATTERN.match(value) is not None
+
+# ------------------------------------------- #
+
+def xdrIndex(value):
+	"""
+	Return the binary file number n of an "XDR-n" reference
+	"""
+	return int(XDR_PATTERN.match(value).group(1))
+
+# ------------------------------------------- #
+
+class xdrReference(str):
+	"""
+	Reference to a binary file stored with a pinnacle file, e.g. the dose of a beam in plan.Trial.binary.NNN.
+	Behaves as the "XDR-n" string it replaces. The array property memory maps the binary file the first
+	time it is accessed, as big endian float32 with the shape of the DoseGrid the reference belongs to,
+	so no data is read until the array is sliced. References to the same file share the mapped array.
+	"""
+	def __new__(cls, value, filename='', doseGrid=None):
+		return str.__new__(cls, value)
+
+	# ------------------------------------------- #
+
+	def __init__(self, value, filename='', doseGrid=None):
+		self.index = xdrIndex(value)
+		self.fileName = '%s.binary.%03d' % (filename, self.index)
+		self._doseGrid = doseGrid
+		self._array = None
+
+	# ------------------------------------------- #
+
+	@property
+	def array(self):
+		"""
+		The binary data as a read only (Z, Y, X) array, mapped on first access
+		"""
+		if self._array is None:
+			if self._doseGrid is None:
+				raise XdrReferenceException("No DoseGrid found for %s, the shape of %s is unknown" \
+												% (self, self.fileName))
+
+			# Only needed once an array is accessed, imported here to keep reading files light
+			import dose, archive
+			import pinnObjDict
+
+			self._array = mappedArrays.get(self.fileName)
+			if self._array is None:
+				if not os.path.exists(self.fileName) and archive.archiveFile(self.fileName) is None:
+					raise XdrReferenceException("Binary file %s not found" % self.fileName)
+
+				self._array = dose.readBeamDose(self.fileName, pinnObjDict.pinnObjDict(self._doseGrid), mmap=True)
+				mappedArrays[self.fileName] = self._array
+		return self._array
+
+	# ------------------------------------------- #
+
+	def __reduce__(self):
+		"""
+		Pickle as a plain string, a memory map isn't carried across
+		"""
+		return (str, (str(self),))
+
+# ------------------------------------------- #
+
+class XdrReferenceException(Exception):
+	pass